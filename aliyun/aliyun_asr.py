@@ -7,14 +7,28 @@ import json
 import time
 import logging
 import os
-from typing import Dict, List, Any
+import sys
+import uuid
+from typing import Callable, Dict, List, Any, Optional, Tuple
 
+import requests
 from aliyunsdkcore.client import AcsClient
 from aliyunsdkcore.request import CommonRequest
 from aliyunsdkcore.acs_exception.exceptions import ClientException, ServerException
 
 from config import config
-from utils import upload_to_oss
+from utils import upload_media, get_media_duration, detect_silences, plan_chunks
+from task_scheduler import PollPolicy, TaskScheduler, run_file_tasks
+from realtime_asr import RealtimeRecognizer, open_pcm_source, pace_frames
+from realtime_stub_server import StubNLSServer
+from rate_limiter import rate_limiter, ThrottledError, THROTTLE_ERROR_CODES
+
+# 添加项目根目录，使用与 Whisper 后端共享的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import instrumentation
+
+# 一句话识别网关表示请求过多的状态码
+_SENTENCE_TOO_MANY_REQUESTS = 40000005
 
 class AliyunASRClient:
     """阿里云语音识别客户端（SDK版本）"""
@@ -29,6 +43,15 @@ class AliyunASRClient:
         self.config = config
         self.use_mock = use_mock
         self.logger = self._setup_logger()
+        # 录音文件识别任务的查询间隔策略，模拟模式下没有排队和处理时间
+        self.poll_policy = PollPolicy(min_interval=0.2, processing_ratio=0) if use_mock else PollPolicy()
+        # 模拟模式下已提交任务的 TaskId -> 文件路径
+        self._mock_tasks = {}
+        # 回调接收服务，为 None 时只通过轮询获取结果
+        self.callback_receiver = None
+        # 访问令牌及其过期时间（Unix 时间戳）
+        self._token = None
+        self._token_expire_time = 0
         
         if use_mock:
             self.logger.info("使用模拟模式，将生成示例识别结果")
@@ -84,6 +107,72 @@ class AliyunASRClient:
         
         return [{'text': text, 'confidence': 0.94, 'words': words, 'start_time': 0.0, 'end_time': 3.8}]
 
+    def create_token(self) -> str:
+        """
+        获取智能语音交互的访问令牌（Token），过期前重复使用
+
+        Returns:
+            str: Token，模拟模式下返回固定值
+        """
+        if self.use_mock:
+            return 'mock-token'
+        # 提前 60 秒刷新，避免使用中过期
+        if self._token is not None and self._token_expire_time - 60 > time.time():
+            return self._token
+
+        request = CommonRequest()
+        request.set_method('POST')
+        request.set_domain(f"nls-meta.{self.config.region}.aliyuncs.com")
+        request.set_version('2019-02-28')
+        request.set_action_name('CreateToken')
+        response = self._do_action('CreateToken', request)
+        token = response.get('Token') or {}
+        if not token.get('Id'):
+            raise Exception(f"获取Token失败: {response}")
+        self._token = token['Id']
+        self._token_expire_time = token.get('ExpireTime', 0)
+        self.logger.info("已获取新的访问Token")
+        return self._token
+
+    def recognize_realtime(self, input_path: str,
+                           on_result: Optional[Callable[[Dict[str, Any], bool], None]] = None,
+                           pace: bool = True) -> List[Dict[str, Any]]:
+        """
+        实时语音识别：边读取音频边发送，识别结果逐条回调
+
+        Args:
+            input_path (str): 音频文件路径，"-" 表示从标准输入读取 PCM
+            on_result (callable): on_result(分段, 是否为句子最终结果)
+            pace (bool): 从文件读取时是否按实时速度发送
+        """
+        sample_rate = self.config.realtime_config['sample_rate']
+        frames = open_pcm_source(input_path, sample_rate)
+        if pace and input_path != '-':
+            frames = pace_frames(frames, sample_rate)
+
+        # 模拟模式且未指定网关地址时，连接本地替身服务
+        stub_server = None
+        url = None
+        if self.use_mock and not os.getenv('ALIYUN_NLS_URL'):
+            stub_server = StubNLSServer(sentence_seconds=3.0).start()
+            url = stub_server.url
+
+        recognizer = RealtimeRecognizer(self.create_token(), url=url)
+        try:
+            # 实时识别按会话占用并发配额；音频已开始发送，被限流时无法重试
+            with rate_limiter.slot('RealtimeTranscription'), \
+                    instrumentation.span('realtime', file=input_path) as span:
+                segments = recognizer.recognize(frames, on_result)
+                if segments:
+                    span['audio_duration'] = segments[-1]['end_time']
+            if recognizer.time_to_first_caption is not None:
+                # 首条字幕延迟单独作为一个阶段写入统计报告
+                instrumentation.record('first_caption', recognizer.time_to_first_caption, file=input_path)
+        finally:
+            if stub_server is not None:
+                stub_server.stop()
+        return segments
+
     def recognize_sentence(self, audio_file_path: str) -> Dict[str, Any]:
         """一句话识别（适合60秒以内的短音频）"""
         if self.use_mock:
@@ -96,45 +185,249 @@ class AliyunASRClient:
         return self._real_api_recognize_sentence(audio_file_path)
 
     def _real_api_recognize_sentence(self, audio_file_path: str) -> Dict[str, Any]:
-        """真实的一句话识别API调用（当前版本未完全实现）"""
-        self.logger.error("真实API的'一句话识别'功能需要不同的API实现，当前版本暂未支持。")
-        raise NotImplementedError("真实'一句话识别'API调用功能待实现。")
+        """
+        真实的一句话识别API调用
+
+        音频解码为 PCM 后直接放在请求体中发送，不经过 OSS 上传和任务轮询，一次请求返回结果。
+        """
+        self.logger.info(f'开始一句话识别: {audio_file_path}')
+        sentence_config = self.config.sentence_config
+        sample_rate = sentence_config['sample_rate']
+        with instrumentation.span('decode', file=audio_file_path) as span:
+            audio = b''.join(open_pcm_source(audio_file_path, sample_rate))
+            audio_duration = len(audio) / (sample_rate * 2)
+            span['audio_duration'] = audio_duration
+
+        params = {
+            'appkey': sentence_config.get('appkey') or self.config.appkey,
+            'format': 'pcm',
+            'sample_rate': sample_rate,
+            'enable_punctuation_prediction': str(sentence_config['enable_punctuation_prediction']).lower(),
+            'enable_inverse_text_normalization': str(sentence_config['enable_inverse_text_normalization']).lower(),
+        }
+        if sentence_config.get('vocabulary_id'):
+            params['vocabulary_id'] = sentence_config['vocabulary_id']
+        headers = {
+            'X-NLS-Token': self.create_token(),
+            'Content-Type': 'application/octet-stream',
+        }
+
+        def send():
+            response = requests.post(self.config.sentence_url, params=params, data=audio,
+                                     headers=headers, timeout=sentence_config.get('timeout', 30))
+            try:
+                result = response.json()
+            except ValueError:
+                response.raise_for_status()
+                raise Exception(f"一句话识别返回了无法解析的响应: {response.text[:200]}")
+            if result.get('status') == _SENTENCE_TOO_MANY_REQUESTS:
+                raise ThrottledError(f"一句话识别请求被限流: {result.get('message')}")
+            return result
+
+        with instrumentation.span('sentence_request', audio_duration=audio_duration, file=audio_file_path):
+            result = rate_limiter.call('SentenceRecognition', send)
+        if result.get('status') != 20000000:
+            raise Exception(f"一句话识别失败: {result.get('message')} (status: {result.get('status')})")
+
+        text = result.get('result', '')
+        self.logger.info(f"一句话识别完成, TaskId: {result.get('task_id')}")
+        # 该接口只返回整句文本，时间戳取整段音频
+        return {'text': text, 'confidence': -1, 'words': [], 'start_time': 0.0, 'end_time': audio_duration}
+
+    def recognize_file(self, audio_file_path: str, audio_duration: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        录音文件识别（适合长音频），超过 chunk_seconds 的音频切分后并行识别
+
+        audio_duration 为调用方已探测到的音频时长（秒），未传入时在这里探测一次。
+        """
+        if audio_duration is None:
+            audio_duration = get_media_duration(audio_file_path)
+        if self.needs_chunking(audio_duration):
+            return self._recognize_file_chunked(audio_file_path, audio_duration)
 
-    def recognize_file(self, audio_file_path: str) -> List[Dict[str, Any]]:
-        """录音文件识别（适合长音频）"""
         if self.use_mock:
             time.sleep(1)
             segments = self._generate_mock_result(audio_file_path)
             self.logger.info(f'模拟文件识别完成，共 {len(segments)} 段')
             return segments
             
-        return self._real_api_recognize_file(audio_file_path)
+        return self._real_api_recognize_file(audio_file_path, audio_duration)
 
-    def _real_api_recognize_file(self, audio_file_path: str) -> List[Dict[str, Any]]:
+    def _real_api_recognize_file(self, audio_file_path: str,
+                                 audio_duration: Optional[float]) -> List[Dict[str, Any]]:
         """真实的文件识别API调用（使用官方SDK）"""
         self.logger.info(f'开始真实文件识别: {audio_file_path}')
-        
-        # API常量，根据官方文档
-        PRODUCT = "nls-filetrans"
-        DOMAIN = f"filetrans.{self.config.region}.aliyuncs.com"
-        API_VERSION = "2018-08-17"
-        POST_REQUEST_ACTION = "SubmitTask"
-        GET_REQUEST_ACTION = "GetTaskResult"
 
+        # 1. 上传并提交任务
         try:
-            file_link = upload_to_oss(audio_file_path)
+            task_id = self.submit_file_task(audio_file_path)
+        except (ClientException, ServerException) as e:
+            self.logger.error(f"提交任务时发生SDK异常: {e}")
+            return []
         except Exception as e:
-            self.logger.error(f"上传文件到OSS失败: {e}")
+            self.logger.error(f"提交任务失败: {e}")
             return []
 
-        # 1. 提交任务
-        post_request = CommonRequest()
-        post_request.set_domain(DOMAIN)
-        post_request.set_version(API_VERSION)
-        post_request.set_product(PRODUCT)
-        post_request.set_action_name(POST_REQUEST_ACTION)
-        post_request.set_method('POST')
+        # 2. 轮询结果
+        with instrumentation.span('poll_task', audio_duration=audio_duration, file=audio_file_path) as poll_span:
+            segments = self._poll_task_result(task_id, audio_duration)
+        # 识别完成后才知道音频时长，补充到统计记录中
+        if segments:
+            poll_span['audio_duration'] = max(segment['end_time'] for segment in segments)
+        return segments
+
+    def needs_chunking(self, audio_duration: Optional[float]) -> bool:
+        """是否启用了长音频切分且音频（时长未知时为 None）超过切分长度"""
+        chunk_seconds = self.config.file_recognition_config.get('chunk_seconds')
+        if not chunk_seconds:
+            return False
+        # 不超过切分长度 10% 的音频按一段处理，与 plan_chunks 的切点搜索范围一致
+        return audio_duration is not None and audio_duration > chunk_seconds * 1.1
+
+    def _recognize_file_chunked(self, audio_file_path: str, audio_duration: float) -> List[Dict[str, Any]]:
+        """
+        将长音频在静音处切分为互相重叠的分段，并行提交识别任务后合并结果
+
+        每段独立重试，某一段用尽重试次数后整个文件识别失败，返回空列表。
+        """
+        file_config = self.config.file_recognition_config
+        silences = detect_silences(audio_file_path, file_config['chunk_silence_db'], file_config['chunk_min_silence'])
+        chunks = plan_chunks(audio_duration, silences, file_config['chunk_seconds'], file_config['chunk_overlap'])
+        self.logger.info(f"音频时长 {audio_duration:.0f} 秒，在静音处切分为 {len(chunks)} 段并行识别: {audio_file_path}")
+
+        results = [None] * len(chunks)
+        failed = []
+
+        def on_finished(index, segments, error):
+            if error is not None:
+                self.logger.error(f"第 {index + 1}/{len(chunks)} 段识别失败: {error}")
+                failed.append(index)
+            else:
+                results[index] = segments
+
+        labels = {
+            f"{audio_file_path} [{start:.0f}-{end:.0f}s]": chunk
+            for chunk in chunks for start, end in [chunk[:2]]
+        }
+
+        def submit_chunk(label):
+            # 在提交线程中截取并上传分段，OSS 中已有该分段的转码结果时（如重试）跳过截取
+            start, end, _, _ = labels[label]
+            return self.submit_file_task(audio_file_path, start=start, duration=end - start), end - start
+
+        with instrumentation.span('poll_task', audio_duration=audio_duration, file=audio_file_path,
+                                  chunks=len(chunks)):
+            run_file_tasks(
+                TaskScheduler(self), list(enumerate(labels)), submit_chunk, on_finished,
+                concurrency=file_config['concurrency'], retries=file_config['chunk_retries']
+            )
+
+        if failed:
+            self.logger.error(f"{len(failed)} 段识别失败，放弃文件: {audio_file_path}")
+            return []
+        return self._merge_chunk_segments(chunks, results)
+
+    @staticmethod
+    def _merge_chunk_segments(chunks: List[Tuple[float, float, float, float]],
+                              results: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """
+        合并各分段的识别结果
+
+        时间戳加上分段的起始时间；重叠部分两段都会识别到，只保留中点落在该段归属区间内的句子。
+        """
+        def shift(item, offset):
+            return dict(item, start_time=round(item['start_time'] + offset, 3),
+                        end_time=round(item['end_time'] + offset, 3))
+
+        merged = []
+        for (start, _, core_start, core_end), segments in zip(chunks, results):
+            for segment in segments:
+                shifted = shift(segment, start)
+                midpoint = (shifted['start_time'] + shifted['end_time']) / 2
+                if not core_start <= midpoint < core_end:
+                    continue
+                shifted['words'] = [shift(word, start) for word in segment.get('words', [])]
+                merged.append(shifted)
+        merged.sort(key=lambda segment: segment['start_time'])
+        return merged
 
+    def enable_callback(self, receiver) -> None:
+        """
+        使用回调接收录音文件识别结果
+
+        提交任务时附带接收服务的回调地址；轮询改为以较长间隔兜底，防止回调丢失时任务一直等待。
+
+        Args:
+            receiver (CallbackReceiver): 已启动的回调接收服务
+        """
+        if self.use_mock:
+            self.logger.warning("模拟模式不会发送回调，仍使用轮询获取结果")
+            return
+        file_config = self.config.file_recognition_config
+        fallback_interval = file_config['callback_fallback_interval']
+        self.callback_receiver = receiver
+        self.poll_policy = PollPolicy(
+            min_interval=fallback_interval,
+            max_interval=max(fallback_interval, file_config['poll_max_interval'])
+        )
+
+    def _do_action(self, action: str, request: CommonRequest) -> Dict[str, Any]:
+        """
+        在接口配额内发送请求并解析响应，被限流时退避重试
+
+        Raises:
+            ThrottledError: 重试次数用尽后仍被限流
+            ClientException, ServerException: 其他请求错误
+        """
+        def send():
+            response_data = json.loads(self.client.do_action_with_exception(request))
+            if response_data.get('StatusText') in THROTTLE_ERROR_CODES:
+                raise ThrottledError(f"{action} 请求被限流: {response_data}")
+            return response_data
+
+        return rate_limiter.call(action, send)
+
+    def _filetrans_request(self, action: str, method: str) -> CommonRequest:
+        """构造录音文件识别接口的请求，API常量根据官方文档"""
+        request = CommonRequest()
+        request.set_domain(f"filetrans.{self.config.region}.aliyuncs.com")
+        request.set_version("2018-08-17")
+        request.set_product("nls-filetrans")
+        request.set_action_name(action)
+        request.set_method(method)
+        return request
+
+    def submit_file_task(self, audio_file_path: str, start: Optional[float] = None,
+                         duration: Optional[float] = None) -> str:
+        """
+        上传文件到OSS并提交录音文件识别任务，不等待识别结果
+
+        Args:
+            audio_file_path (str): 音频文件路径
+            start (float): 只识别从该时间（秒）开始的一段
+            duration (float): 只识别该时长（秒）的一段
+
+        Returns:
+            str: 任务的 TaskId
+
+        Raises:
+            Exception: 上传或提交失败
+        """
+        if self.use_mock:
+            time.sleep(0.5)
+            task_id = f"mock-{uuid.uuid4().hex}"
+            self._mock_tasks[task_id] = audio_file_path
+            self.logger.info(f"模拟任务提交成功, TaskId: {task_id}")
+            return task_id
+
+        try:
+            # 视频、无损音频和分段先转码为单声道压缩音频再上传，OSS 中已有转码结果时跳过转码
+            file_link = upload_media(audio_file_path, start=start, duration=duration)
+        except Exception as e:
+            self.logger.error(f"上传文件到OSS失败: {e}")
+            raise
+
+        post_request = self._filetrans_request("SubmitTask", 'POST')
         task_payload = {
             'appkey': self.config.appkey,
             'file_link': file_link,
@@ -142,60 +435,71 @@ class AliyunASRClient:
             'enable_words': self.config.file_recognition_config.get('enable_words', False),
             'enable_sample_rate_adaptive': True, # 自动适配采样率
         }
-        task_json = json.dumps(task_payload)
-        post_request.add_body_params("Task", task_json)
+        if self.callback_receiver is not None:
+            task_payload['enable_callback'] = True
+            task_payload['callback_url'] = self.callback_receiver.url
+        post_request.add_body_params("Task", json.dumps(task_payload))
 
-        task_id = ""
-        try:
-            post_response = self.client.do_action_with_exception(post_request)
-            post_response_data = json.loads(post_response)
-            self.logger.debug(f"提交任务响应: {post_response_data}")
-            
-            if post_response_data.get('StatusText') == 'SUCCESS':
-                task_id = post_response_data.get('TaskId')
-                self.logger.info(f"任务提交成功, TaskId: {task_id}")
-            else:
-                raise Exception(f"提交任务失败: {post_response_data}")
-        except (ClientException, ServerException) as e:
-            self.logger.error(f"提交任务时发生SDK异常: {e}")
-            return []
+        with instrumentation.span('submit_task', file=audio_file_path):
+            post_response_data = self._do_action('SubmitTask', post_request)
+        self.logger.debug(f"提交任务响应: {post_response_data}")
 
+        if post_response_data.get('StatusText') != 'SUCCESS':
+            raise Exception(f"提交任务失败: {post_response_data}")
+        task_id = post_response_data.get('TaskId')
         if not task_id:
-            return []
+            raise Exception(f"提交任务响应中没有TaskId: {post_response_data}")
+        self.logger.info(f"任务提交成功, TaskId: {task_id}")
+        return task_id
 
-        # 2. 轮询结果
-        get_request = CommonRequest()
-        get_request.set_domain(DOMAIN)
-        get_request.set_version(API_VERSION)
-        get_request.set_product(PRODUCT)
-        get_request.set_action_name(GET_REQUEST_ACTION)
-        get_request.set_method('GET')
+    def query_file_task(self, task_id: str) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+        """
+        查询一次录音文件识别任务的状态
+
+        Returns:
+            tuple: (状态, 分段列表)。任务仍在排队或处理中时分段列表为 None
+
+        Raises:
+            Exception: 任务处理失败
+        """
+        if self.use_mock:
+            audio_file_path = self._mock_tasks.pop(task_id)
+            return 'SUCCESS', self._generate_mock_result(audio_file_path)
+
+        get_request = self._filetrans_request("GetTaskResult", 'GET')
         get_request.add_query_param("TaskId", task_id)
+        get_response_data = self._do_action('GetTaskResult', get_request)
+        self.logger.debug(f"查询任务响应: {get_response_data}")
+        return self.parse_task_response(get_response_data)
 
-        while True:
-            try:
-                self.logger.info("等待10秒后查询任务状态...")
-                time.sleep(10)
-                get_response = self.client.do_action_with_exception(get_request)
-                get_response_data = json.loads(get_response)
-                self.logger.debug(f"查询任务响应: {get_response_data}")
-
-                status_text = get_response_data.get('StatusText')
-                if status_text in ['RUNNING', 'QUEUEING']:
-                    self.logger.info(f"任务仍在处理中... (状态: {status_text})")
-                    continue
-                
-                if status_text == 'SUCCESS':
-                    self.logger.info("任务处理成功")
-                    result = get_response_data.get('Result', {})
-                    return self._format_file_result(result)
-                
-                raise Exception(f"任务处理失败，状态: {status_text}, 响应: {get_response_data}")
-
-            except (ClientException, ServerException) as e:
-                self.logger.error(f"查询任务时发生SDK异常: {e}")
-                break
-        
+    def parse_task_response(self, response_data: Dict[str, Any]) -> Tuple[str, Optional[List[Dict[str, Any]]]]:
+        """
+        解析 GetTaskResult 响应或回调请求体（两者格式相同）
+
+        Returns:
+            tuple: (状态, 分段列表)。任务仍在排队或处理中时分段列表为 None
+
+        Raises:
+            Exception: 任务处理失败
+        """
+        status_text = response_data.get('StatusText')
+        if status_text in ['RUNNING', 'QUEUEING']:
+            return status_text, None
+
+        if status_text == 'SUCCESS':
+            result = response_data.get('Result', {})
+            return status_text, self._format_file_result(result)
+
+        raise Exception(f"任务处理失败，状态: {status_text}, 响应: {response_data}")
+
+    def _poll_task_result(self, task_id: str, audio_duration: Optional[float] = None) -> List[Dict[str, Any]]:
+        """按音频时长自适应地轮询任务状态直到完成，返回格式化后的分段列表"""
+        scheduler = TaskScheduler(self)
+        scheduler.add(task_id, audio_duration=audio_duration)
+        self.logger.info(f"等待任务完成, TaskId: {task_id}")
+        for _, segments, error in scheduler.run_until_complete():
+            if error is None:
+                return segments
         return []
 
     def _format_file_result(self, result: Dict[str, Any]) -> List[Dict[str, Any]]:
@@ -205,20 +509,16 @@ class AliyunASRClient:
             return []
             
         formatted_segments = []
-        all_words = result.get('Words', [])
-
-        for sentence in sentences:
-            words_list = []
-            if all_words:
-                # 根据文档，词信息和句子是分开的，需要自己匹配
-                for word_info in all_words:
-                     if sentence.get('BeginTime') <= word_info.get('BeginTime') and word_info.get('EndTime') <= sentence.get('EndTime'):
-                        words_list.append({
-                            'text': word_info.get('Word'),
-                            'start_time': word_info.get('BeginTime') / 1000.0,
-                            'end_time': word_info.get('EndTime') / 1000.0,
-                            'confidence': -1
-                        })
+        # 根据文档，词信息和句子是分开的，需要自己匹配
+        aligned_words = self._align_words(sentences, result.get('Words') or [])
+
+        for sentence, sentence_words in zip(sentences, aligned_words):
+            words_list = [{
+                'text': word_info.get('Word'),
+                'start_time': word_info.get('BeginTime') / 1000.0,
+                'end_time': word_info.get('EndTime') / 1000.0,
+                'confidence': -1
+            } for word_info in sentence_words]
             
             formatted_segments.append({
                 'text': sentence.get('Text'),
@@ -229,3 +529,42 @@ class AliyunASRClient:
             })
             
         return formatted_segments
+
+    @staticmethod
+    def _align_words(sentences: List[Dict[str, Any]], words: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        将词按时间归入句子，返回与 sentences 一一对应的词列表
+
+        每个词归入开始时间所在的句子（句子 BeginTime <= 词 BeginTime < 句子 EndTime），
+        跨越句末的词留在开始的句子中，落在句间静音里的词丢弃；句子重叠时归入最早开始的句子。
+        多声道结果按 ChannelId 分别对齐。句子和词各按开始时间排序后归并一遍，
+        接口返回的结果本身有序，排序也是线性时间。
+        """
+        aligned = [[] for _ in sentences]
+        if not words:
+            return aligned
+
+        # 声道 -> (句子下标列表, 词列表)
+        channels = {}
+        for index, sentence in enumerate(sentences):
+            channels.setdefault(sentence.get('ChannelId', 0), ([], []))[0].append(index)
+        for word in words:
+            channel = channels.get(word.get('ChannelId', 0))
+            if channel is not None:
+                channel[1].append(word)
+
+        for sentence_indexes, channel_words in channels.values():
+            sentence_indexes.sort(key=lambda index: sentences[index]['BeginTime'])
+            channel_words.sort(key=lambda word: word['BeginTime'])
+            position = 0
+            sentence_count = len(sentence_indexes)
+            for word in channel_words:
+                begin = word['BeginTime']
+                # 词按开始时间递增，已在当前词之前结束的句子之后也不会再匹配
+                while position < sentence_count and sentences[sentence_indexes[position]]['EndTime'] <= begin:
+                    position += 1
+                if position == sentence_count:
+                    break
+                if sentences[sentence_indexes[position]]['BeginTime'] <= begin:
+                    aligned[sentence_indexes[position]].append(word)
+        return aligned
@@ -6,28 +6,45 @@ import os
 import sys
 import argparse
 import logging
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
 from pathlib import Path
 
 # 添加当前目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# 添加项目根目录，使用与 Whisper 后端共享的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from aliyun_asr import AliyunASRClient
-from output_formatter import OutputFormatter
+from output_formatter import OutputFormatter, LiveCaptionWriter
+from task_scheduler import TaskScheduler, run_file_tasks
+from callback_server import CallbackReceiver
+from rate_limiter import rate_limiter
+from utils import get_media_duration
 from config import config
+from transcript_cache import TranscriptCache, hash_file
+from transcript import Transcript
+from instrumentation import instrumentation
+
+# 需要逐字时间戳的输出格式，一句话识别没有逐字结果，auto 模式请求这些格式时不走一句话识别
+WORD_LEVEL_FORMATS = ('srt_words', 'lrc_words')
 
 class AliyunTranscriber:
     """阿里云转录器主类"""
 
-    def __init__(self, use_mock=True):
+    def __init__(self, use_mock=True, cache: TranscriptCache = None, live_srt: str = None):
         """
         初始化转录器
 
         Args:
             use_mock (bool): 是否使用模拟模式
+            cache (TranscriptCache): 转录结果缓存，为 None 时不使用缓存
+            live_srt (str): 实时识别时逐句追加字幕的 SRT 文件路径
         """
         self.asr_client = AliyunASRClient(use_mock=use_mock)
         self.formatter = OutputFormatter()
+        self.cache = cache
+        self.live_srt = live_srt
         self.logger = logging.getLogger('AliyunTranscriber')
     
     def is_supported_file(self, file_path: str) -> bool:
@@ -39,53 +56,217 @@ class AliyunTranscriber:
             '.mp4', '.mov', '.mkv', '.avi', '.flv'
         ]
         return Path(file_path).suffix.lower() in supported_extensions
+
+    def _cache_key(self, input_path: str, mode: str) -> str:
+        """由文件内容哈希和识别参数生成缓存键"""
+        service_config = config.get_service_config(mode)
+        options = {
+            name: service_config.get(name)
+            for name in ('format', 'sample_rate', 'enable_words', 'vocabulary_id', 'chunk_seconds')
+        }
+        # 模拟结果不能与真实识别结果混用
+        backend = 'aliyun-mock' if self.asr_client.use_mock else 'aliyun'
+        return self.cache.make_key(
+            hash_file(input_path), backend, f'nls-{mode}',
+            language=service_config.get('language'), options=options
+        )
+
+    def _recognize(self, input_path: str, mode: str, audio_duration: Optional[float] = None) -> List[Dict[str, Any]]:
+        """根据模式调用识别接口，返回分段列表"""
+        with instrumentation.span('recognize', file=input_path, mode=mode) as span:
+            if mode == 'file':
+                segments = self.asr_client.recognize_file(input_path, audio_duration)
+            elif mode == 'realtime':
+                # 识别结果边到边输出，不等整段音频处理完
+                writer = LiveCaptionWriter(self.formatter, self.live_srt)
+                try:
+                    segments = self.asr_client.recognize_realtime(input_path, on_result=writer)
+                finally:
+                    writer.close()
+            else:
+                segment = self.asr_client.recognize_sentence(input_path)
+                segments = [segment] if segment else []
+            if segments:
+                span['audio_duration'] = max(s.get('end_time', 0) for s in segments)
+        return segments
+    
+    def _probe_duration(self, input_path: str, mode: str) -> Optional[float]:
+        """探测音频时长，每个文件只探测一次；只有 auto 和录音文件识别模式需要"""
+        if mode not in ('auto', 'file') or input_path == '-':
+            return None
+        return get_media_duration(input_path)
+
+    def _resolve_mode(self, input_path: str, mode: str, duration: Optional[float],
+                      formats: Optional[List[str]] = None) -> str:
+        """
+        auto 模式按探测到的音频时长选择识别方式：短音频走一句话识别，无需上传和轮询
+
+        一句话识别只返回一个覆盖整段音频的分段，没有逐字和逐句时间戳，请求了逐字格式时仍使用录音文件识别。
+        """
+        if mode != 'auto':
+            return mode
+        if duration is None or duration >= config.sentence_config['max_duration']:
+            return 'file'
+        word_formats = [name for name in formats or () if name in WORD_LEVEL_FORMATS]
+        if word_formats:
+            self.logger.info(f"请求了逐字格式 {', '.join(word_formats)}，短音频仍使用录音文件识别: {input_path}")
+            return 'file'
+        self.logger.warning(f"音频时长 {duration:.1f} 秒，使用一句话识别: {input_path}；"
+                            f"结果为一个覆盖整段音频的字幕，没有逐句和逐字时间戳，需要时请使用 --mode file")
+        return 'sentence'
+
+    def _check_input(self, input_path: str, mode: str) -> bool:
+        """检查输入文件和识别模式是否可以处理"""
+        if mode == 'realtime' and input_path == '-':
+            # 从标准输入读取 PCM
+            return True
+
+        if not os.path.exists(input_path):
+            self.logger.error(f"文件不存在: {input_path}")
+            return False
+        
+        if not self.is_supported_file(input_path):
+            self.logger.error(f"不支持的文件格式: {input_path}")
+            return False
+        
+        if mode not in ('auto', 'file', 'sentence', 'realtime'):
+            self.logger.error(f"不支持的识别模式: {mode}")
+            return False
+        return True
+
+    def _lookup_cache(self, input_path: str, mode: str) -> Tuple[Optional[str], Optional[List[Dict[str, Any]]]]:
+        """
+        查询转录缓存，返回 (缓存键, 分段列表)；未启用缓存或未命中时分段列表为 None
+
+        实时识别模式不读写缓存：回放缓存结果不会输出实时字幕，与该模式的用途相悖。
+        """
+        if self.cache is None or input_path == '-' or mode == 'realtime':
+            return None, None
+        cache_key = self._cache_key(input_path, mode)
+        segments = self.cache.get(cache_key)
+        if segments is not None:
+            self.logger.info(f"命中转录缓存，跳过识别: {input_path}")
+        return cache_key, segments
+
+    def _save_segments(self, input_path: str, segments: List[Dict[str, Any]],
+                       output_dir: str, formats: List[str]) -> bool:
+        """保存识别结果对应的输出文件"""
+        if not segments:
+            self.logger.warning(f"未识别到任何内容: {input_path}")
+            return False
+        
+        # 标准输入没有文件名，输出文件命名为 stdin.*
+        output_name = 'stdin' if input_path == '-' else input_path
+        # 模拟结果与真实识别结果分开归档
+        backend = 'aliyun-mock' if self.asr_client.use_mock else 'aliyun'
+        saved_files = self.formatter.save_output(
+            Transcript.from_aliyun(segments, keep_segments='json' in formats), output_name, output_dir, formats,
+            backend=backend
+        )
+        
+        self.logger.info(f"文件处理完成: {input_path}")
+        for format_name, file_path in saved_files.items():
+            self.logger.info(f"  {format_name.upper()}: {file_path}")
+        return True
     
     def process_file(self, input_path: str, mode: str, output_dir: str, 
-                    formats: List[str]) -> bool:
-        """处理单个文件"""
+                    formats: List[str], audio_duration: Optional[float] = None) -> bool:
+        """处理单个文件，audio_duration 为已探测到的音频时长，未传入时在这里探测"""
         try:
             self.logger.info(f"开始处理文件: {input_path} (模式: {mode})")
             
-            if not os.path.exists(input_path):
-                self.logger.error(f"文件不存在: {input_path}")
-                return False
-            
-            if not self.is_supported_file(input_path):
-                self.logger.error(f"不支持的文件格式: {input_path}")
-                return False
-            
-            # 根据模式选择识别方法
-            if mode == 'file':
-                segments = self.asr_client.recognize_file(input_path)
-            elif mode == 'sentence':
-                segment = self.asr_client.recognize_sentence(input_path)
-                segments = [segment] if segment else []
-            else:
-                self.logger.error(f"不支持的识别模式: {mode}")
-                return False
-            
-            if not segments:
-                self.logger.warning(f"未识别到任何内容: {input_path}")
+            if not self._check_input(input_path, mode):
                 return False
+            if audio_duration is None:
+                audio_duration = self._probe_duration(input_path, mode)
+            mode = self._resolve_mode(input_path, mode, audio_duration, formats)
+
+            # 缓存命中时跳过识别，直接输出
+            cache_key, segments = self._lookup_cache(input_path, mode)
+            if segments is None:
+                segments = self._recognize(input_path, mode, audio_duration)
+                if segments and cache_key is not None:
+                    self.cache.put(cache_key, segments)
             
             # 保存输出文件
-            saved_files = self.formatter.save_output(
-                segments, input_path, output_dir, formats
-            )
-            
-            self.logger.info(f"文件处理完成: {input_path}")
-            for format_name, file_path in saved_files.items():
-                self.logger.info(f"  {format_name.upper()}: {file_path}")
-            
-            return True
+            return self._save_segments(input_path, segments, output_dir, formats)
             
         except Exception as e:
             self.logger.error(f"处理文件时出错 {input_path}: {str(e)}")
             return False
+
+    def _submit_file_task(self, input_path: str, audio_duration: Optional[float]) -> Tuple[str, Optional[float]]:
+        """上传并提交任务，同时返回音频时长供调度器估算查询时间"""
+        return self.asr_client.submit_file_task(input_path), audio_duration
+
+    def _process_files_concurrent(self, input_paths: List[str], mode: str, output_dir: str,
+                                  formats: List[str], concurrency: int) -> int:
+        """
+        并发处理录音文件识别
+
+        先在 concurrency 个线程中上传并提交全部任务，由同一个调度器轮询所有未完成的 TaskId，
+        每个任务完成后立即格式化输出。需要切分的长音频，以及 auto 模式下走一句话识别的短音频，
+        各自在后台线程中识别。返回成功处理的文件数。
+        """
+        success_count = 0
+        scheduler = TaskScheduler(self.asr_client)
+        # (文件路径, 缓存键), 文件路径
+        jobs = []
+        # (文件路径, 识别模式, 音频时长)
+        direct_files = []
+        # 文件路径 -> 音频时长，每个文件只探测一次
+        durations = {}
+
+        for input_path in input_paths:
+            if not self._check_input(input_path, mode):
+                continue
+            durations[input_path] = self._probe_duration(input_path, mode)
+            file_mode = self._resolve_mode(input_path, mode, durations[input_path], formats)
+            cache_key, segments = self._lookup_cache(input_path, file_mode)
+            if segments is not None:
+                success_count += self._save_segments(input_path, segments, output_dir, formats)
+            elif file_mode == 'sentence' or self.asr_client.needs_chunking(durations[input_path]):
+                direct_files.append((input_path, file_mode, durations[input_path]))
+            else:
+                jobs.append(((input_path, cache_key), input_path))
+
+        def on_finished(context, segments, error):
+            nonlocal success_count
+            input_path, cache_key = context
+            if error is not None:
+                self.logger.error(f"处理文件时出错 {input_path}: {error}")
+                return
+            try:
+                if segments and cache_key is not None:
+                    self.cache.put(cache_key, segments)
+                if self._save_segments(input_path, segments, output_dir, formats):
+                    success_count += 1
+            except Exception as e:
+                self.logger.error(f"处理文件时出错 {input_path}: {str(e)}")
+            self.logger.info(f"剩余任务: {len(scheduler)}")
+
+        with ThreadPoolExecutor(max_workers=concurrency) as direct_executor:
+            direct_futures = [
+                direct_executor.submit(self.process_file, input_path, file_mode, output_dir, formats, audio_duration)
+                for input_path, file_mode, audio_duration in direct_files
+            ]
+            self.logger.info(f"提交 {len(jobs)} 个识别任务，{len(direct_files)} 个文件单独识别"
+                             f"（短音频或需切分的长音频），并发上传数: {concurrency}")
+            run_file_tasks(scheduler, jobs, lambda path: self._submit_file_task(path, durations[path]),
+                           on_finished, concurrency)
+            success_count += sum(future.result() for future in direct_futures)
+
+        self.logger.info(f"共查询任务状态 {scheduler.query_count} 次")
+        return success_count
     
     def process_files(self, input_paths: List[str], mode: str, output_dir: str, 
-                     formats: List[str]) -> None:
-        """批量处理文件"""
+                     formats: List[str], concurrency: int = 1) -> None:
+        """
+        批量处理文件
+
+        concurrency 大于 1 且为录音文件识别或 auto 模式时，所有任务先并发提交再统一轮询，
+        否则逐个文件处理。
+        """
         if not config.validate_config():
             self.logger.error("配置验证失败，请检查环境变量设置")
             return
@@ -98,20 +279,25 @@ class AliyunTranscriber:
         self.logger.info(f"输出目录: {output_dir}")
         self.logger.info(f"输出格式: {', '.join(formats)}")
         
-        for i, input_path in enumerate(input_paths, 1):
-            self.logger.info(f"\n[{i}/{total_files}] 处理文件: {input_path}")
-            
-            if self.process_file(input_path, mode, output_dir, formats):
-                success_count += 1
-            
-            # 显示进度
-            progress = (i / total_files) * 100
-            self.logger.info(f"进度: {progress:.1f}% ({i}/{total_files})")
+        if mode in ('auto', 'file') and concurrency > 1 and total_files > 1:
+            success_count = self._process_files_concurrent(input_paths, mode, output_dir, formats, concurrency)
+        else:
+            for i, input_path in enumerate(input_paths, 1):
+                self.logger.info(f"\n[{i}/{total_files}] 处理文件: {input_path}")
+                
+                if self.process_file(input_path, mode, output_dir, formats):
+                    success_count += 1
+                
+                # 显示进度
+                progress = (i / total_files) * 100
+                self.logger.info(f"进度: {progress:.1f}% ({i}/{total_files})")
         
         self.logger.info(f"\n批量处理完成！")
         self.logger.info(f"成功: {success_count}/{total_files}")
         if success_count < total_files:
             self.logger.warning(f"失败: {total_files - success_count}/{total_files}")
+        # 各接口的请求数、被限流次数和等待配额的时间
+        rate_limiter.log_stats()
 
 
 def setup_logging(log_level: str = 'INFO'):
@@ -133,15 +319,31 @@ def main():
         formatter_class=argparse.RawDescriptionHelpFormatter,
         epilog="""
 使用示例:
+  # 自动选择：短于 60 秒的文件用一句话识别，其余用录音文件识别
+  python aliyun_transcribe.py audio.wav voice_note.m4a
+  
   # 录音文件识别
   python aliyun_transcribe.py --mode file audio.wav
   
   # 一句话识别
   python aliyun_transcribe.py --mode sentence short_audio.wav
   
+  # 实时识别：边发送音频边输出字幕（"-" 表示从标准输入读取 16 位单声道 PCM）
+  python aliyun_transcribe.py --mode realtime lecture.mp4
+  ffmpeg -i rtmp://live/stream -f s16le -ac 1 -ar 16000 - | python aliyun_transcribe.py --mode realtime --live-srt live.srt -
+  
   # 批量处理
   python aliyun_transcribe.py --mode file audio1.wav audio2.mp3
   
+  # 批量处理，同时上传/提交 8 个任务
+  python aliyun_transcribe.py --mode file --concurrency 8 *.wav
+  
+  # 长录音每 30 分钟切分一段并行识别
+  python aliyun_transcribe.py --mode file --chunk-seconds 1800 meeting.mp3
+  
+  # 通过回调获取结果（本地 8765 端口已映射到公网地址）
+  python aliyun_transcribe.py --mode file --callback-url https://example.ngrok.io *.wav
+  
   # 指定输出格式
   python aliyun_transcribe.py --mode file --formats srt,vtt,json audio.wav
   
@@ -163,9 +365,10 @@ def main():
     
     parser.add_argument(
         '--mode',
-        choices=['file', 'sentence'],
-        default='file',
-        help='识别模式 (默认: file)'
+        choices=['auto', 'file', 'sentence', 'realtime'],
+        default='auto',
+        help='识别模式，auto 按音频时长在一句话识别和录音文件识别之间选择，'
+             '短音频的结果没有逐句和逐字时间戳，请求逐字格式时不走一句话识别 (默认: auto)'
     )
     
     parser.add_argument(
@@ -180,6 +383,17 @@ def main():
         help='输出格式，用逗号分隔 (默认: srt,vtt,txt,json)'
     )
     
+    parser.add_argument(
+        '--json-compact',
+        action='store_true',
+        help='JSON 输出使用不带缩进的紧凑格式'
+    )
+    
+    parser.add_argument(
+        '--archive-dir',
+        help='同时把识别结果追加到该目录下按日期和后端分区的 Parquet 归档，需要 pyarrow (默认读取 TRANSCRIBE_ARCHIVE_DIR)'
+    )
+    
     parser.add_argument(
         '--sample-rate',
         type=int,
@@ -210,6 +424,60 @@ def main():
         help='热词表ID'
     )
     
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=config.file_recognition_config['concurrency'],
+        help='录音文件识别批量处理时同时上传/提交的任务数，1 表示逐个处理 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--chunk-seconds',
+        type=float,
+        default=config.file_recognition_config['chunk_seconds'],
+        help='超过该时长的音频在静音处切分为互相重叠的分段，并行提交识别任务后合并，0 表示不切分 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--callback-url',
+        help='公网可访问的回调基础地址（如内网穿透地址），指定后录音文件识别通过回调获取结果，轮询作为兜底'
+    )
+    
+    parser.add_argument(
+        '--callback-port',
+        type=int,
+        default=config.file_recognition_config['callback_port'],
+        help='本地回调接收服务的监听端口 (默认: %(default)s)'
+    )
+    
+    parser.add_argument(
+        '--live-srt',
+        help='实时识别时逐句追加字幕的 SRT 文件路径'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        dest='use_cache',
+        action='store_false',
+        help='不使用转录结果缓存'
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        help='转录缓存目录 (默认: ~/.cache/transcribe)'
+    )
+
+    parser.add_argument(
+        '--cache-max-mb',
+        type=float,
+        help='转录缓存总大小上限 MB (默认: 1024)'
+    )
+    
+    parser.add_argument(
+        '--metrics-report',
+        help='将各阶段耗时与资源统计保存为 JSON 报告的路径'
+    )
+    
     parser.add_argument(
         '--log-level',
         choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
@@ -232,16 +500,24 @@ def main():
     formats = [f.strip() for f in args.formats.split(',')]
     
     # 更新配置
+    if args.json_compact:
+        config.update_config('output', json_compact=True)
+    if args.archive_dir:
+        config.update_config('output', archive_dir=args.archive_dir)
+
     file_config_updates = {
         'sample_rate': args.sample_rate,
         'language': args.lang,
         'vocabulary_id': args.vocabulary_id,
+        'chunk_seconds': args.chunk_seconds,
     }
     if args.oss_bucket:
         file_config_updates['oss_bucket'] = args.oss_bucket
     
     config.update_config('file', **file_config_updates)
     
+    config.update_config('realtime', sample_rate=args.sample_rate, vocabulary_id=args.vocabulary_id)
+    
     config.update_config('sentence', 
         sample_rate=args.sample_rate,
         language=args.lang,
@@ -249,8 +525,24 @@ def main():
     )
     
     # 创建转录器并处理文件
-    transcriber = AliyunTranscriber(use_mock=args.use_mock)
-    transcriber.process_files(args.input_files, args.mode, args.output_dir, formats)
+    cache = TranscriptCache(args.cache_dir, args.cache_max_mb) if args.use_cache else None
+    transcriber = AliyunTranscriber(use_mock=args.use_mock, cache=cache, live_srt=args.live_srt)
+    receiver = None
+    if args.callback_url and args.mode in ('auto', 'file'):
+        receiver = CallbackReceiver(
+            config.file_recognition_config['callback_host'], args.callback_port, args.callback_url
+        ).start()
+        transcriber.asr_client.enable_callback(receiver)
+    try:
+        transcriber.process_files(args.input_files, args.mode, args.output_dir, formats,
+                                  concurrency=max(1, args.concurrency))
+    finally:
+        if receiver is not None:
+            receiver.stop()
+
+    if args.metrics_report:
+        instrumentation.save_report(args.metrics_report)
+        logging.info(f"阶段统计报告保存在: {args.metrics_report}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+词与句子对齐的性能对比
+
+生成模拟的录音文件识别结果（默认约 4 小时会议：3000 句、40000 词），
+比较逐句扫描全部词的原实现与归并对齐的耗时，并检查两者结果一致。
+
+    python benchmark_alignment.py
+    python benchmark_alignment.py --sentences 300 --words-per-sentence 13
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+# 添加当前目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aliyun_asr import AliyunASRClient
+
+
+def make_payload(sentence_count: int, words_per_sentence: int, seed: int = 0) -> dict:
+    """生成模拟结果：句子之间有静音间隔，词都落在句子内部"""
+    rng = random.Random(seed)
+    sentences, words = [], []
+    current = 0
+    for index in range(sentence_count):
+        current += rng.randint(200, 1500)
+        begin = current
+        for _ in range(words_per_sentence):
+            duration = rng.randint(80, 400)
+            words.append({'Word': f'w{len(words)}', 'BeginTime': current,
+                          'EndTime': current + duration, 'ChannelId': 0})
+            current += duration
+        sentences.append({'Text': f'sentence {index}', 'BeginTime': begin,
+                          'EndTime': current, 'ChannelId': 0})
+    return {'Sentences': sentences, 'Words': words}
+
+
+def align_quadratic(sentences, words):
+    """原实现：每个句子扫描全部词，要求词完整落在句子内"""
+    return [
+        [word for word in words
+         if sentence['BeginTime'] <= word['BeginTime'] and word['EndTime'] <= sentence['EndTime']]
+        for sentence in sentences
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='词与句子对齐的性能对比')
+    parser.add_argument('--sentences', type=int, default=3000, help='句子数 (默认: 3000)')
+    parser.add_argument('--words-per-sentence', type=int, default=13, help='每句词数 (默认: 13)')
+    args = parser.parse_args()
+
+    payload = make_payload(args.sentences, args.words_per_sentence)
+    sentences, words = payload['Sentences'], payload['Words']
+    print(f"句子数: {len(sentences)}，词数: {len(words)}")
+
+    start = time.perf_counter()
+    expected = align_quadratic(sentences, words)
+    quadratic_seconds = time.perf_counter() - start
+    print(f"逐句扫描: {quadratic_seconds:.3f} 秒")
+
+    start = time.perf_counter()
+    aligned = AliyunASRClient._align_words(sentences, words)
+    merge_seconds = time.perf_counter() - start
+    print(f"归并对齐: {merge_seconds:.3f} 秒")
+
+    if aligned != expected:
+        print("❌ 两种实现的对齐结果不一致")
+        sys.exit(1)
+    print(f"✅ 结果一致，加速 {quadratic_seconds / merge_seconds:.0f} 倍")
+
+
+if __name__ == '__main__':
+    main()
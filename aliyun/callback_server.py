@@ -0,0 +1,115 @@
+"""
+录音文件识别回调接收模块
+
+录音文件识别支持在任务完成时向 callback_url 发送 POST 请求，请求体与 GetTaskResult 的响应相同。
+本模块在本地启动一个小型 HTTP 服务接收这些回调（可通过内网穿透或反向代理暴露到公网），
+调度器收到回调后立即输出结果，轮询只作为回调丢失时的兜底。
+"""
+import json
+import secrets
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+    """接收录音文件识别的回调请求"""
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        if self.path.split('?', 1)[0] != receiver.path:
+            self.send_error(404)
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(length).decode('utf-8'))
+            task_id = data['TaskId']
+        except (ValueError, KeyError, TypeError) as e:
+            receiver.logger.warning(f"无法解析的回调请求: {e}")
+            self.send_error(400)
+            return
+
+        receiver.deliver(task_id, data)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        self.server.receiver.logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class CallbackReceiver:
+    """本地回调接收服务，按 TaskId 保存收到的任务结果"""
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 0, public_url: Optional[str] = None):
+        """
+        初始化接收服务
+
+        Args:
+            host (str): 监听地址
+            port (int): 监听端口，0 表示随机端口
+            public_url (str): 公网可访问的基础地址（如内网穿透地址），为空时使用本地监听地址
+        """
+        self.host = host
+        self.port = port
+        self.public_url = public_url
+        # 路径中带随机串，避免他人伪造回调
+        self.path = f"/filetrans/{secrets.token_hex(8)}"
+        self.logger = logging.getLogger('CallbackReceiver')
+        # TaskId -> 回调请求体；回调可能早于调度器登记任务到达，因此收到即保存
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._arrived = threading.Event()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """填入 SubmitTask 的 callback_url"""
+        base_url = self.public_url or f"http://{self.host}:{self.port}"
+        return base_url.rstrip('/') + self.path
+
+    def start(self) -> 'CallbackReceiver':
+        """在后台线程中启动 HTTP 服务"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _CallbackHandler)
+        self._server.daemon_threads = True
+        self._server.receiver = self
+        # 端口为 0 时取实际分配的端口
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.logger.info(f"回调接收服务已启动，监听 {self.host}:{self.port}，回调地址: {self.url}")
+        return self
+
+    def stop(self) -> None:
+        """停止 HTTP 服务"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def deliver(self, task_id: str, data: Dict[str, Any]) -> None:
+        """保存一条回调结果并唤醒等待中的调度器"""
+        with self._lock:
+            self._results[task_id] = data
+        self.logger.info(f"收到任务回调, TaskId: {task_id} (状态: {data.get('StatusText')})")
+        self._arrived.set()
+
+    def pop(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """取出指定任务的回调结果，尚未收到时返回 None"""
+        with self._lock:
+            return self._results.pop(task_id, None)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待新的回调到达，超时返回 False"""
+        arrived = self._arrived.wait(timeout)
+        self._arrived.clear()
+        return arrived
+
+    def __enter__(self) -> 'CallbackReceiver':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
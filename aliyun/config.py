@@ -19,6 +19,10 @@ class AliyunConfig:
         # 服务地址配置
         self.region = os.getenv('ALIYUN_REGION', 'cn-shanghai')
         self.endpoint = f'https://nls-meta.{self.region}.aliyuncs.com'
+        # 实时语音识别网关地址，可用环境变量指向本地替身服务（见 realtime_stub_server.py）
+        self.nls_gateway_url = os.getenv('ALIYUN_NLS_URL', f'wss://nls-gateway.{self.region}.aliyuncs.com/ws/v1')
+        # 一句话识别 RESTful 接口地址
+        self.sentence_url = f'https://nls-gateway.{self.region}.aliyuncs.com/stream/v1/asr'
         
         # OSS 配置
         self.oss_bucket = os.getenv('ALIYUN_OSS_BUCKET', '')
@@ -37,8 +41,52 @@ class AliyunConfig:
             'max_single_segment_time': 60000,  # 单段最大时长(毫秒)
             'vocabulary_id': '',  # 热词表ID(可选)
             'oss_bucket': self.oss_bucket, # 存储音频文件的OSS Bucket名称
+            'poll_min_interval': 1.0,  # 查询任务结果的最短间隔(秒)
+            'poll_max_interval': 60.0,  # 查询任务结果的最长间隔(秒)
+            'poll_backoff': 1.5,  # 超过预计完成时间后查询间隔的放大倍数
+            'poll_jitter': 0.1,  # 查询间隔的随机抖动比例
+            'poll_processing_ratio': 0.1,  # 预计识别耗时与音频时长之比
+            'callback_host': '0.0.0.0',  # 回调接收服务的监听地址
+            'callback_port': 8765,  # 回调接收服务的监听端口
+            'callback_fallback_interval': 60.0,  # 使用回调时兜底轮询的间隔(秒)
+            'concurrency': 4,  # 批量处理时同时上传/提交的任务数
+            'chunk_seconds': 0,  # 超过该时长的音频在静音处切分后并行识别(秒)，0 表示不切分
+            'chunk_overlap': 2.0,  # 相邻分段的重叠时长(秒)
+            'chunk_silence_db': -35,  # 静音检测的电平阈值(dB)
+            'chunk_min_silence': 0.5,  # 可作为切点的最短静音时长(秒)
+            'chunk_retries': 2,  # 每个分段失败后的重试次数
         }
         
+        # OSS 上传配置
+        self.oss_upload_config = {
+            'object_prefix': 'transcribe/',  # 对象名前缀，对象名为 前缀 + 内容SHA-256 + 扩展名
+            'multipart_threshold': 10 * 1024 * 1024,  # 超过该大小使用分片断点续传(字节)
+            'part_size': 5 * 1024 * 1024,  # 分片大小(字节)
+            'num_threads': 4,  # 并行上传分片的线程数
+            'checkpoint_dir': os.path.join(os.path.expanduser('~'), '.cache', 'transcribe-oss'),  # 断点续传信息目录
+            'transcode': True,  # 上传前将视频和无损音频转码为单声道MP3
+            'transcode_bitrate': '32k',  # 转码后的码率
+            'transcode_extensions': ['.mp4', '.mov', '.mkv', '.avi', '.flv', '.wav', '.flac'],  # 需要转码的格式
+        }
+
+        # 接口限流配置：每个接口的每秒请求数(qps)和同时进行的请求数(concurrency)上限，按账号配额调整
+        self.rate_limit_config = {
+            'actions': {
+                'SubmitTask': {'qps': 10, 'concurrency': 8},  # 录音文件识别提交任务
+                'GetTaskResult': {'qps': 50, 'concurrency': 16},  # 录音文件识别查询结果
+                'CreateToken': {'qps': 1, 'concurrency': 1},  # 获取访问令牌
+                'SentenceRecognition': {'qps': 10, 'concurrency': 2},  # 一句话识别
+                'RealtimeTranscription': {'qps': 10, 'concurrency': 2},  # 实时识别（并发数即同时进行的会话数）
+                'OSSHead': {'qps': 100, 'concurrency': 16},  # OSS 检查对象是否存在
+                'OSSUpload': {'qps': 20, 'concurrency': 8},  # OSS 上传
+            },
+            'default': {'qps': 20, 'concurrency': 8},  # 未单独配置的接口
+            'max_retries': 5,  # 被限流后的最多重试次数
+            'retry_base_delay': 1.0,  # 首次重试前等待的秒数，之后每次加倍
+            'retry_max_delay': 30.0,  # 重试等待的最长秒数
+            'retry_jitter': 0.2,  # 重试等待的随机抖动比例
+        }
+
         # 实时语音识别配置
         self.realtime_config = {
             'format': 'pcm',
@@ -60,6 +108,9 @@ class AliyunConfig:
             'enable_punctuation_prediction': True,
             'enable_inverse_text_normalization': True,
             'enable_words': True,  # 开启逐字时间戳
+            'vocabulary_id': '',  # 热词表ID(可选)
+            'max_duration': 60,  # 一句话识别支持的最长音频(秒)，auto 模式下更短的文件走一句话识别
+            'timeout': 30,  # 请求超时(秒)
         }
         
         # 输出配置
@@ -68,6 +119,8 @@ class AliyunConfig:
             'create_date_subdir': True,
             'supported_formats': ['srt', 'vtt', 'lrc', 'txt', 'json'],
             'default_encoding': 'utf-8',
+            'json_compact': False,  # JSON 输出不带缩进和空格，文件更小、解析更快
+            'archive_dir': os.getenv('TRANSCRIBE_ARCHIVE_DIR', ''),  # 列式归档目录，为空时不归档（需要 pyarrow）
         }
         
         # 日志配置
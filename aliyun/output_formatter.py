@@ -1,12 +1,32 @@
 """
 阿里云语音识别结果输出格式化模块
 """
-import json
 import os
+import sys
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Sequence, Union
 from config import config
 
+# 添加项目根目录，使用与 Whisper 后端共享的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import instrumentation
+from subtitle_writer import CueSink, JsonSink, LineSink, WordCueSink, WordLineSink, render, write_files
+from timestamps import clock_timestamps, lrc_timestamps
+from transcript import Transcript, as_transcript
+from transcript_archive import TranscriptArchive
+
+# LRC 文件头
+_LRC_HEADER = """[ti:{title}]
+[ar:阿里云语音识别]
+[al:转录文件]
+[by:阿里云ASR]
+[offset:0]
+
+"""
+
+# 分段列表或 Transcript，两者都可直接输出
+Segments = Union[List[Dict[str, Any]], Transcript]
+
 class OutputFormatter:
     """输出格式化器"""
     
@@ -34,170 +54,108 @@ class OutputFormatter:
         minutes = int(seconds // 60)
         sec = seconds - minutes * 60
         return f"[{minutes:02d}:{sec:05.2f}]"
+
+    def format_timestamps_for_srt(self, values: Sequence[float]) -> List[str]:
+        """批量格式化SRT时间戳，小时按天取模"""
+        return clock_timestamps(values, self.format_timestamp_for_srt, ',', hour_width=2, wrap_days=True)
+
+    def format_timestamps_for_vtt(self, values: Sequence[float]) -> List[str]:
+        """批量格式化VTT时间戳"""
+        return clock_timestamps(values, self.format_timestamp_for_vtt, '.', hour_width=2, wrap_days=True)
+
+    def format_timestamps_for_lrc(self, values: Sequence[float]) -> List[str]:
+        """批量格式化LRC时间戳"""
+        return lrc_timestamps(values, self.format_timestamp_for_lrc)
     
-    def generate_srt(self, segments: List[Dict[str, Any]]) -> str:
+    def srt_sink(self, f) -> CueSink:
+        return CueSink(f, self.format_timestamps_for_srt)
+
+    def vtt_sink(self, f) -> CueSink:
+        return CueSink(f, self.format_timestamps_for_vtt, header="WEBVTT\n\n")
+
+    def lrc_sink(self, f) -> LineSink:
+        return LineSink(f, self.format_timestamps_for_lrc, header=_LRC_HEADER.format(title='语音转录结果'))
+
+    def txt_sink(self, f) -> LineSink:
+        return LineSink(f)
+
+    def word_level_srt_sink(self, f) -> WordCueSink:
+        # 每组4个词
+        return WordCueSink(f, self.format_timestamps_for_srt, group_size=4)
+
+    def word_level_lrc_sink(self, f) -> WordLineSink:
+        return WordLineSink(f, self.format_timestamps_for_lrc, header=_LRC_HEADER.format(title='语音转录结果(逐字)'))
+
+    def json_metadata(self, total_segments: int, total_duration: float) -> Dict[str, Any]:
+        """JSON 输出的 metadata，分段总数和总时长由 JsonSink 在写出分段时累计"""
+        return {
+            'generated_at': datetime.now().isoformat(),
+            'total_segments': total_segments,
+            'total_duration': total_duration,
+            'service': 'aliyun_asr',
+            'version': '1.0'
+        }
+
+    def json_sink(self, f, include_metadata: bool = True, compact: bool = None) -> JsonSink:
+        if compact is None:
+            compact = self.config.output_config['json_compact']
+        return JsonSink(f, self.json_metadata if include_metadata else None, indent=None if compact else 2)
+
+    def generate_srt(self, segments: Segments) -> str:
         """生成SRT格式字幕"""
-        srt_output = ""
-        
-        for i, segment in enumerate(segments, 1):
-            text = segment.get('text', '').strip()
-            if not text:
-                continue
-                
-            # 使用句子级时间戳
-            start_time = segment.get('start_time', 0)
-            end_time = segment.get('end_time', start_time + 2)
-            
-            start_str = self.format_timestamp_for_srt(start_time)
-            end_str = self.format_timestamp_for_srt(end_time)
-            
-            srt_output += f"{i}\n{start_str} --> {end_str}\n{text}\n\n"
-        
-        return srt_output
+        return render(segments, self.srt_sink)
     
-    def generate_word_level_srt(self, segments: List[Dict[str, Any]]) -> str:
+    def generate_word_level_srt(self, segments: Segments) -> str:
         """生成逐字级SRT格式字幕"""
-        srt_output = ""
-        subtitle_index = 1
-        
-        for segment in segments:
-            words = segment.get('words', [])
-            if not words:
-                continue
-            
-            # 将词语按时间分组，每组3-5个词
-            word_groups = []
-            current_group = []
-            
-            for word in words:
-                current_group.append(word)
-                if len(current_group) >= 4:  # 每组4个词
-                    word_groups.append(current_group)
-                    current_group = []
-            
-            if current_group:  # 添加剩余的词
-                word_groups.append(current_group)
-            
-            # 为每组生成字幕
-            for group in word_groups:
-                if not group:
-                    continue
-                
-                text = ''.join([w.get('text', '') for w in group])
-                start_time = group[0].get('start_time', 0)
-                end_time = group[-1].get('end_time', start_time + 1)
-                
-                start_str = self.format_timestamp_for_srt(start_time)
-                end_str = self.format_timestamp_for_srt(end_time)
-                
-                srt_output += f"{subtitle_index}\n{start_str} --> {end_str}\n{text}\n\n"
-                subtitle_index += 1
-        
-        return srt_output
+        return render(segments, self.word_level_srt_sink)
     
-    def generate_vtt(self, segments: List[Dict[str, Any]]) -> str:
+    def generate_vtt(self, segments: Segments) -> str:
         """生成VTT格式字幕"""
-        vtt_output = "WEBVTT\n\n"
-        
-        for i, segment in enumerate(segments, 1):
-            text = segment.get('text', '').strip()
-            if not text:
-                continue
-                
-            start_time = segment.get('start_time', 0)
-            end_time = segment.get('end_time', start_time + 2)
-            
-            start_str = self.format_timestamp_for_vtt(start_time)
-            end_str = self.format_timestamp_for_vtt(end_time)
-            
-            vtt_output += f"{i}\n{start_str} --> {end_str}\n{text}\n\n"
-        
-        return vtt_output
+        return render(segments, self.vtt_sink)
     
-    def generate_lrc(self, segments: List[Dict[str, Any]]) -> str:
+    def generate_lrc(self, segments: Segments) -> str:
         """生成LRC格式歌词"""
-        lrc_output = ""
-        
-        # 添加LRC头信息
-        lrc_output += "[ti:语音转录结果]\n"
-        lrc_output += f"[ar:阿里云语音识别]\n"
-        lrc_output += f"[al:转录文件]\n"
-        lrc_output += f"[by:阿里云ASR]\n"
-        lrc_output += f"[offset:0]\n\n"
-        
-        for segment in segments:
-            text = segment.get('text', '').strip()
-            if not text:
-                continue
-                
-            start_time = segment.get('start_time', 0)
-            timestamp = self.format_timestamp_for_lrc(start_time)
-            lrc_output += f"{timestamp}{text}\n"
-        
-        return lrc_output
+        return render(segments, self.lrc_sink)
     
-    def generate_word_level_lrc(self, segments: List[Dict[str, Any]]) -> str:
+    def generate_word_level_lrc(self, segments: Segments) -> str:
         """生成逐字级LRC格式"""
-        lrc_output = ""
-        
-        # 添加LRC头信息
-        lrc_output += "[ti:语音转录结果(逐字)]\n"
-        lrc_output += f"[ar:阿里云语音识别]\n"
-        lrc_output += f"[al:转录文件]\n"
-        lrc_output += f"[by:阿里云ASR]\n"
-        lrc_output += f"[offset:0]\n\n"
-        
-        for segment in segments:
-            words = segment.get('words', [])
-            for word in words:
-                text = word.get('text', '').strip()
-                if not text:
-                    continue
-                    
-                start_time = word.get('start_time', 0)
-                timestamp = self.format_timestamp_for_lrc(start_time)
-                lrc_output += f"{timestamp}{text}\n"
-        
-        return lrc_output
+        return render(segments, self.word_level_lrc_sink)
     
-    def generate_txt(self, segments: List[Dict[str, Any]]) -> str:
+    def generate_txt(self, segments: Segments) -> str:
         """生成纯文本格式"""
-        txt_output = ""
-        
-        for segment in segments:
-            text = segment.get('text', '').strip()
-            if text:
-                txt_output += text + "\n"
-        
-        return txt_output
+        return render(segments, self.txt_sink)
     
-    def generate_json(self, segments: List[Dict[str, Any]], include_metadata: bool = True) -> str:
-        """生成JSON格式"""
-        output_data = {
-            'segments': segments
-        }
-        
-        if include_metadata:
-            output_data['metadata'] = {
-                'generated_at': datetime.now().isoformat(),
-                'total_segments': len(segments),
-                'total_duration': max([s.get('end_time', 0) for s in segments]) if segments else 0,
-                'service': 'aliyun_asr',
-                'version': '1.0'
-            }
-        
-        return json.dumps(output_data, ensure_ascii=False, indent=2)
+    def generate_json(self, segments: Segments, include_metadata: bool = True, compact: bool = None) -> str:
+        """
+        生成JSON格式
+
+        Args:
+            include_metadata (bool): 是否包含 metadata
+            compact (bool): 是否输出不带缩进和空格的紧凑格式，默认读取 output_config['json_compact']
+        """
+        return render(segments, lambda f: self.json_sink(f, include_metadata, compact))
     
-    def save_output(self, segments: List[Dict[str, Any]], input_filename: str, 
-                   output_dir: str, formats: List[str] = None) -> Dict[str, str]:
-        """保存输出文件"""
+    def save_output(self, segments: Segments, input_filename: str, 
+                   output_dir: str, formats: List[str] = None, backend: str = 'aliyun') -> Dict[str, str]:
+        """
+        保存输出文件，分段列表先转换为 Transcript，各格式都从同一份列式数据写出
+
+        配置了 output_config['archive_dir'] 时，同时把结果追加到列式归档（见 transcript_archive.py），
+        backend 为归档中的后端分区。
+        """
         if formats is None:
             formats = self.config.output_config['supported_formats']
-        
+        # 只有 JSON 需要原样写出原始分段，其他格式只用紧凑的数组
+        transcript = as_transcript(segments, keep_segments='json' in formats)
+        with instrumentation.span('save_output', audio_duration=transcript.duration, file=input_filename):
+            return self._save_output(transcript, input_filename, output_dir, formats, backend)
+
+    def _save_output(self, transcript: Transcript, input_filename: str,
+                     output_dir: str, formats: List[str], backend: str = 'aliyun') -> Dict[str, str]:
         # 创建输出目录
+        date = datetime.now().strftime("%Y%m%d")
         if self.config.output_config['create_date_subdir']:
-            date_subdir = datetime.now().strftime("%Y%m%d")
-            output_dir = os.path.join(output_dir, date_subdir)
+            output_dir = os.path.join(output_dir, date)
         
         os.makedirs(output_dir, exist_ok=True)
         
@@ -205,51 +163,98 @@ class OutputFormatter:
         base_name = os.path.splitext(os.path.basename(input_filename))[0]
         
         saved_files = {}
+        encoding = self.config.output_config['default_encoding']
         
-        # 生成各种格式
-        format_generators = {
-            'srt': self.generate_srt,
-            'vtt': self.generate_vtt,
-            'lrc': self.generate_lrc,
-            'txt': self.generate_txt,
-            'json': self.generate_json,
+        # 字幕、文本和 JSON 格式：格式名 -> (文件名后缀, sink)
+        streaming_formats = {
+            'srt': ('.srt', self.srt_sink),
+            'vtt': ('.vtt', self.vtt_sink),
+            'lrc': ('.lrc', self.lrc_sink),
+            'txt': ('.txt', self.txt_sink),
+            'srt_words': ('_words.srt', self.word_level_srt_sink),
+            'lrc_words': ('_words.lrc', self.word_level_lrc_sink),
+            'json': ('.json', self.json_sink),
         }
-        
-        for format_name in formats:
-            if format_name not in format_generators:
-                continue
-            
-            generator = format_generators[format_name]
-            content = generator(segments)
-            
-            output_path = os.path.join(output_dir, f"{base_name}.{format_name}")
-            
+        requested = {name: os.path.join(output_dir, f"{base_name}{streaming_formats[name][0]}")
+                     for name in formats if name in streaming_formats}
+        if requested:
+            # 一次遍历分段，同时写出所有文本格式的文件；某个格式失败时只删除该格式的文件
             try:
-                with open(output_path, 'w', encoding=self.config.output_config['default_encoding']) as f:
-                    f.write(content)
-                saved_files[format_name] = output_path
+                failures = write_files(
+                    transcript, {path: streaming_formats[name][1] for name, path in requested.items()}, encoding
+                )
             except Exception as e:
-                print(f"保存{format_name}文件失败: {e}")
+                failures = dict.fromkeys(requested.values(), e)
+            for name, path in requested.items():
+                if path in failures:
+                    print(f"保存{name}文件失败: {failures[path]}")
+                else:
+                    saved_files[name] = path
         
-        # 生成逐字级格式（如果支持）
-        if 'srt_words' in formats:
-            content = self.generate_word_level_srt(segments)
-            output_path = os.path.join(output_dir, f"{base_name}_words.srt")
+        if 'transcript' in formats:
+            # 二进制列式文件，可用 Transcript.load 直接读回
+            output_path = os.path.join(output_dir, f"{base_name}.transcript")
             try:
-                with open(output_path, 'w', encoding=self.config.output_config['default_encoding']) as f:
-                    f.write(content)
-                saved_files['srt_words'] = output_path
+                transcript.save(output_path)
+                saved_files['transcript'] = output_path
             except Exception as e:
-                print(f"保存逐字SRT文件失败: {e}")
+                print(f"保存transcript文件失败: {e}")
         
-        if 'lrc_words' in formats:
-            content = self.generate_word_level_lrc(segments)
-            output_path = os.path.join(output_dir, f"{base_name}_words.lrc")
+        archive_dir = self.config.output_config['archive_dir']
+        if archive_dir:
+            # 追加到按日期和后端分区的列式归档，供跨文件统计分析
             try:
-                with open(output_path, 'w', encoding=self.config.output_config['default_encoding']) as f:
-                    f.write(content)
-                saved_files['lrc_words'] = output_path
+                TranscriptArchive(archive_dir).append(transcript, input_filename, backend, date)
+                saved_files['archive'] = archive_dir
             except Exception as e:
-                print(f"保存逐字LRC文件失败: {e}")
+                print(f"追加转录归档失败: {e}")
         
         return saved_files
+
+
+class LiveCaptionWriter:
+    """
+    实时识别的增量输出
+
+    中间结果在终端同一行刷新，句子结束后输出带时间戳的定稿字幕，
+    并可同时追加到 SRT 文件，供播放器或直播软件实时读取。
+    """
+
+    def __init__(self, formatter: OutputFormatter, srt_path: str = None, stream=None):
+        """
+        初始化输出
+
+        Args:
+            formatter (OutputFormatter): 用于格式化时间戳
+            srt_path (str): 逐句追加的 SRT 文件路径，为空时只输出到终端
+            stream: 终端输出流，默认 sys.stdout
+        """
+        self.formatter = formatter
+        self.stream = stream or sys.stdout
+        self.srt_file = None
+        if srt_path:
+            os.makedirs(os.path.dirname(os.path.abspath(srt_path)), exist_ok=True)
+            self.srt_file = open(srt_path, 'w', encoding=formatter.config.output_config['default_encoding'])
+        self.count = 0
+
+    def __call__(self, segment: Dict[str, Any], final: bool) -> None:
+        text = segment.get('text', '').strip()
+        if not final:
+            self.stream.write(f"\r… {text}")
+            self.stream.flush()
+            return
+
+        self.count += 1
+        start_str = self.formatter.format_timestamp_for_srt(segment.get('start_time', 0))
+        end_str = self.formatter.format_timestamp_for_srt(segment.get('end_time', 0))
+        # 清除中间结果所在的行
+        self.stream.write(f"\r\033[K[{start_str} --> {end_str}] {text}\n")
+        self.stream.flush()
+        if self.srt_file is not None:
+            self.srt_file.write(f"{self.count}\n{start_str} --> {end_str}\n{text}\n\n")
+            self.srt_file.flush()
+
+    def close(self) -> None:
+        if self.srt_file is not None:
+            self.srt_file.close()
+            self.srt_file = None
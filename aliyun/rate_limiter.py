@@ -0,0 +1,200 @@
+"""
+阿里云接口限流模块
+
+录音文件识别、一句话识别、实时识别和 OSS 都有按账号计算的 QPS 和并发配额，
+并发处理时很容易超出而被拒绝。本模块为每个接口维护一个令牌桶（限制每秒请求数）
+和一个信号量（限制同时进行的请求数），所有线程共用同一个全局限流器；
+请求被服务端限流时按指数退避重试，不再让整个文件失败。
+
+等待配额的时间按接口累计，可在日志和阶段统计报告（rate_limit_wait）中查看，
+据此把配置调到刚好贴近配额。
+"""
+import os
+import sys
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+from config import config
+
+# 添加项目根目录，使用与 Whisper 后端共享的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import instrumentation
+
+# 表示被限流的错误码（POP 网关、OSS）和录音文件识别的状态文本
+THROTTLE_ERROR_CODES = {
+    'Throttling', 'Throttling.User', 'Throttling.Api', 'Throttling.Concurrency', 'ServiceUnavailable',
+    'TOO_MANY_REQUESTS', 'SlowDown', 'RequestLimitExceeded',
+}
+# 表示被限流的 HTTP 状态码
+THROTTLE_HTTP_STATUS = {429, 503}
+# 短于该秒数的等待不计入统计报告，避免每次请求都产生一条记录
+_MIN_RECORDED_WAIT = 0.001
+
+
+class ThrottledError(Exception):
+    """服务端在响应内容中表示请求被限流（HTTP 请求本身成功）"""
+
+
+def is_throttled(error: Exception) -> bool:
+    """判断异常是否表示请求被限流，可以稍后重试"""
+    if isinstance(error, ThrottledError):
+        return True
+    # aliyunsdkcore 的 ServerException/ClientException
+    get_error_code = getattr(error, 'get_error_code', None)
+    if get_error_code is not None and get_error_code() in THROTTLE_ERROR_CODES:
+        return True
+    get_http_status = getattr(error, 'get_http_status', None)
+    if get_http_status is not None and get_http_status() in THROTTLE_HTTP_STATUS:
+        return True
+    # oss2 的 OssError
+    if getattr(error, 'code', None) in THROTTLE_ERROR_CODES:
+        return True
+    if getattr(error, 'status', None) in THROTTLE_HTTP_STATUS:
+        return True
+    # requests 的 HTTPError
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) in THROTTLE_HTTP_STATUS
+
+
+class TokenBucket:
+    """令牌桶：平均每秒发放 rate 个令牌，最多积攒 burst 个"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        取一个令牌，不足时等待
+
+        令牌可以预支为负数，每个调用方按自己排到的位置等待，先到先得。
+
+        Returns:
+            float: 等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class _ActionLimit:
+    """单个接口的令牌桶、信号量和统计"""
+
+    def __init__(self, qps: float, concurrency: int):
+        self.bucket = TokenBucket(qps)
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.calls = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+
+class RateLimiter:
+    """按接口限制请求速率和并发数，被限流时退避重试"""
+
+    def __init__(self, limit_config: Optional[Dict[str, Any]] = None):
+        """
+        初始化限流器
+
+        Args:
+            limit_config (dict): 限流配置，默认使用 config.rate_limit_config
+        """
+        self.limit_config = limit_config or config.rate_limit_config
+        self._limits: Dict[str, _ActionLimit] = {}
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger('RateLimiter')
+
+    def _limit(self, action: str) -> _ActionLimit:
+        with self._lock:
+            if action not in self._limits:
+                settings = self.limit_config['actions'].get(action, self.limit_config['default'])
+                self._limits[action] = _ActionLimit(settings['qps'], settings['concurrency'])
+            return self._limits[action]
+
+    @contextmanager
+    def slot(self, action: str):
+        """
+        占用一个接口配额：先等并发名额，再等令牌，with 块结束时归还并发名额
+
+        Yields:
+            float: 本次等待的秒数
+        """
+        limit = self._limit(action)
+        start = time.monotonic()
+        limit.semaphore.acquire()
+        try:
+            limit.bucket.acquire()
+            wait = time.monotonic() - start
+            with self._lock:
+                limit.calls += 1
+                limit.wait_seconds += wait
+                limit.max_wait = max(limit.max_wait, wait)
+            if wait >= _MIN_RECORDED_WAIT:
+                instrumentation.record('rate_limit_wait', wait, action=action)
+            yield wait
+        finally:
+            limit.semaphore.release()
+
+    def call(self, action: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        在接口配额内调用 func，被限流时按指数退避重试
+
+        Raises:
+            Exception: func 抛出的非限流异常，或重试次数用尽后的限流异常
+        """
+        max_retries = self.limit_config['max_retries']
+        for attempt in range(max_retries + 1):
+            with self.slot(action):
+                try:
+                    return func(*args, **kwargs)
+                except Exception as e:
+                    if not is_throttled(e) or attempt == max_retries:
+                        raise
+                    error = e
+            # 退避等待时不占用并发名额
+            limit = self._limit(action)
+            with self._lock:
+                limit.throttled += 1
+            delay = min(self.limit_config['retry_base_delay'] * 2 ** attempt, self.limit_config['retry_max_delay'])
+            delay *= 1 + random.uniform(-self.limit_config['retry_jitter'], self.limit_config['retry_jitter'])
+            self.logger.warning(f"{action} 请求被限流，{delay:.1f} 秒后重试 ({attempt + 1}/{max_retries}): {error}")
+            time.sleep(delay)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """按接口返回请求数、被限流次数和等待配额的时间"""
+        with self._lock:
+            return {
+                action: {
+                    'calls': limit.calls,
+                    'throttled': limit.throttled,
+                    'wait_seconds': limit.wait_seconds,
+                    'avg_wait': limit.wait_seconds / limit.calls if limit.calls else 0.0,
+                    'max_wait': limit.max_wait,
+                }
+                for action, limit in self._limits.items()
+            }
+
+    def log_stats(self) -> None:
+        """把各接口的统计写入日志"""
+        for action, stats in self.stats().items():
+            self.logger.info(
+                f"{action}: 请求 {stats['calls']} 次，被限流 {stats['throttled']} 次，"
+                f"等待配额共 {stats['wait_seconds']:.1f} 秒（平均 {stats['avg_wait']:.3f} 秒，最长 {stats['max_wait']:.1f} 秒）"
+            )
+
+
+# 全局实例，所有线程共用同一份配额
+rate_limiter = RateLimiter()
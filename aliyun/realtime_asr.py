@@ -0,0 +1,234 @@
+"""
+实时语音识别模块
+
+按实时语音识别（SpeechTranscriber）的 WebSocket 协议，把 PCM 音频帧边读边发，
+服务端返回的中间结果和句子结束结果逐条回调给调用方，用于直播字幕等场景。
+音频可以来自 .pcm 文件、标准输入或 ffmpeg 解码管道，参数取自 config.realtime_config。
+"""
+import io
+import sys
+import json
+import time
+import uuid
+import logging
+import threading
+import subprocess
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import websocket
+
+from config import config
+
+# 每帧音频时长（毫秒），官方建议每次发送 100ms 左右的音频
+FRAME_MS = 100
+# 等待服务端响应的超时时间（秒）
+_RECV_TIMEOUT = 30
+
+
+def iter_pcm_stream(stream: io.RawIOBase, frame_bytes: int) -> Iterator[bytes]:
+    """从二进制流中按帧读取 PCM 数据"""
+    while True:
+        frame = stream.read(frame_bytes)
+        if not frame:
+            break
+        yield frame
+
+
+def iter_pcm_ffmpeg(input_path: str, sample_rate: int, frame_bytes: int) -> Iterator[bytes]:
+    """用 ffmpeg 把任意媒体解码为 16 位单声道 PCM，按帧读取"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-v', 'error',
+        '-i', input_path,
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(sample_rate),
+        '-'
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield from iter_pcm_stream(process.stdout, frame_bytes)
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode('utf-8', errors='replace')
+        if process.wait() != 0:
+            raise RuntimeError(f"ffmpeg 解码失败: {stderr.strip()}")
+
+
+def open_pcm_source(input_path: str, sample_rate: int, frame_ms: int = FRAME_MS) -> Iterator[bytes]:
+    """
+    打开音频来源，返回 PCM 帧迭代器
+
+    "-" 表示从标准输入读取 PCM；.pcm 文件直接读取；其他格式用 ffmpeg 解码。
+    """
+    frame_bytes = sample_rate * 2 * frame_ms // 1000
+    if input_path == '-':
+        return iter_pcm_stream(sys.stdin.buffer, frame_bytes)
+    if input_path.lower().endswith('.pcm'):
+        return _iter_pcm_file(input_path, frame_bytes)
+    return iter_pcm_ffmpeg(input_path, sample_rate, frame_bytes)
+
+
+def _iter_pcm_file(input_path: str, frame_bytes: int) -> Iterator[bytes]:
+    with open(input_path, 'rb') as f:
+        yield from iter_pcm_stream(f, frame_bytes)
+
+
+def pace_frames(frames: Iterable[bytes], sample_rate: int) -> Iterator[bytes]:
+    """按实时速度发送：从文件读取时模拟麦克风的节奏，避免一次性灌入服务端"""
+    start = time.monotonic()
+    sent_seconds = 0.0
+    for frame in frames:
+        delay = start + sent_seconds - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield frame
+        sent_seconds += len(frame) / (sample_rate * 2)
+
+
+class RealtimeRecognizer:
+    """实时语音识别客户端"""
+
+    def __init__(self, token: str, url: Optional[str] = None, appkey: Optional[str] = None,
+                 realtime_config: Optional[Dict[str, Any]] = None):
+        """
+        初始化客户端
+
+        Args:
+            token (str): 访问令牌，见 AliyunASRClient.create_token()
+            url (str): 网关地址，默认使用 config.nls_gateway_url
+            appkey (str): 项目 Appkey，默认使用配置中的 appkey
+            realtime_config (dict): 识别参数，默认使用 config.realtime_config
+        """
+        self.token = token
+        self.url = url or config.nls_gateway_url
+        self.appkey = appkey or config.appkey
+        self.realtime_config = realtime_config or config.realtime_config
+        self.logger = logging.getLogger('RealtimeASR')
+        # 最近一次识别从发送第一帧音频到收到第一条识别结果的秒数
+        self.time_to_first_caption = None
+
+    def _message(self, task_id: str, name: str, payload: Optional[Dict[str, Any]] = None) -> str:
+        return json.dumps({
+            'header': {
+                'message_id': uuid.uuid4().hex,
+                'task_id': task_id,
+                'namespace': 'SpeechTranscriber',
+                'name': name,
+                'appkey': self.appkey,
+            },
+            'payload': payload or {},
+        })
+
+    def _start_payload(self) -> Dict[str, Any]:
+        """StartTranscription 的参数，空值不发送"""
+        names = ('format', 'sample_rate', 'enable_intermediate_result', 'enable_punctuation_prediction',
+                 'enable_inverse_text_normalization', 'enable_words', 'max_sentence_silence', 'vocabulary_id')
+        return {name: self.realtime_config[name] for name in names if self.realtime_config.get(name) not in (None, '')}
+
+    @staticmethod
+    def _to_segment(payload: Dict[str, Any], begin_ms: int) -> Dict[str, Any]:
+        """把识别事件转换为与录音文件识别相同的分段结构"""
+        return {
+            'text': payload.get('result', ''),
+            'start_time': begin_ms / 1000.0,
+            'end_time': payload.get('time', begin_ms) / 1000.0,
+            'confidence': payload.get('confidence', -1),
+            'words': [{
+                'text': word.get('text'),
+                'start_time': word.get('startTime', 0) / 1000.0,
+                'end_time': word.get('endTime', 0) / 1000.0,
+                'confidence': -1,
+            } for word in payload.get('words') or []],
+        }
+
+    def _send_audio(self, ws, task_id: str, frames: Iterable[bytes], state: Dict[str, Any]) -> None:
+        """在发送线程中逐帧发送音频，结束（包括音频源出错）后发送 StopTranscription"""
+        try:
+            for frame in frames:
+                if state['first_frame_at'] is None:
+                    state['first_frame_at'] = time.monotonic()
+                ws.send_binary(frame)
+        except Exception as e:
+            state['error'] = e
+        finally:
+            try:
+                ws.send(self._message(task_id, 'StopTranscription'))
+            except Exception as e:
+                if state['error'] is None:
+                    state['error'] = e
+                # 连接已不可用，关闭连接让主线程从 recv 返回，避免一直阻塞
+                ws.close()
+
+    def recognize(self, frames: Iterable[bytes],
+                  on_result: Optional[Callable[[Dict[str, Any], bool], None]] = None) -> List[Dict[str, Any]]:
+        """
+        识别音频帧流
+
+        Args:
+            frames (iterable): 16 位单声道 PCM 音频帧
+            on_result (callable): on_result(分段, 是否为句子最终结果)，中间结果会随识别进度多次回调
+
+        Returns:
+            list: 所有句子的最终结果
+
+        Raises:
+            RuntimeError: 服务端返回 TaskFailed 或发送音频失败
+        """
+        task_id = uuid.uuid4().hex
+        ws = websocket.create_connection(self.url, header=[f'X-NLS-Token: {self.token}'], timeout=_RECV_TIMEOUT)
+        segments = []
+        state = {'first_frame_at': None, 'error': None}
+        self.time_to_first_caption = None
+        try:
+            ws.send(self._message(task_id, 'StartTranscription', self._start_payload()))
+            event = json.loads(ws.recv())
+            if event['header']['name'] != 'TranscriptionStarted':
+                raise RuntimeError(f"开始识别失败: {event['header'].get('status_text')}")
+            self.logger.info(f"实时识别已开始, TaskId: {task_id}")
+            # 直播等场景中音频可能断续，开始后不再限制等待识别结果的时间
+            ws.settimeout(None)
+
+            sender = threading.Thread(target=self._send_audio, args=(ws, task_id, frames, state), daemon=True)
+            sender.start()
+
+            # 句子序号 -> 开始时间（毫秒）
+            sentence_begins = {}
+            while True:
+                try:
+                    event = json.loads(ws.recv())
+                except Exception:
+                    # 发送线程出错时关闭了连接，抛出真正的原因
+                    if state['error'] is not None:
+                        raise RuntimeError(f"发送音频失败: {state['error']}") from state['error']
+                    raise
+                name = event['header']['name']
+                payload = event.get('payload', {})
+
+                if name == 'TaskFailed':
+                    raise RuntimeError(f"实时识别失败: {event['header'].get('status_text')}")
+                if name == 'TranscriptionCompleted':
+                    break
+                if name == 'SentenceBegin':
+                    sentence_begins[payload.get('index')] = payload.get('time', 0)
+                    continue
+                if name not in ('TranscriptionResultChanged', 'SentenceEnd'):
+                    continue
+
+                if self.time_to_first_caption is None and state['first_frame_at'] is not None:
+                    self.time_to_first_caption = time.monotonic() - state['first_frame_at']
+                    self.logger.info(f"首条字幕延迟: {self.time_to_first_caption:.3f} 秒")
+
+                final = name == 'SentenceEnd'
+                begin_ms = payload.get('begin_time', sentence_begins.get(payload.get('index'), 0))
+                segment = self._to_segment(payload, begin_ms)
+                if final:
+                    segments.append(segment)
+                if on_result is not None:
+                    on_result(segment, final)
+
+            sender.join()
+            if state['error'] is not None:
+                raise RuntimeError(f"发送音频失败: {state['error']}") from state['error']
+        finally:
+            ws.close()
+
+        self.logger.info(f"实时识别完成，共 {len(segments)} 句")
+        return segments
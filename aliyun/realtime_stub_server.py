@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+实时语音识别的本地替身服务
+
+只用标准库实现最小的 WebSocket 服务端，按实时语音识别协议应答：
+收到 StartTranscription 后返回 TranscriptionStarted；每收到 sentence_seconds 秒的 PCM 音频
+产生一句识别结果（SentenceBegin、TranscriptionResultChanged、SentenceEnd）；
+收到 StopTranscription 后结束剩余的句子并返回 TranscriptionCompleted。
+用于测试和离线调试，不校验 Token。
+
+    python realtime_stub_server.py --port 8900
+    ALIYUN_NLS_URL=ws://127.0.0.1:8900/ws/v1 python aliyun_transcribe.py --mode realtime --use-mock audio.wav
+
+模拟模式下未设置 ALIYUN_NLS_URL 时，AliyunASRClient 会自动在随机端口启动本服务。
+"""
+import json
+import uuid
+import base64
+import struct
+import hashlib
+import argparse
+import threading
+import socketserver
+from typing import Optional
+
+# WebSocket 握手使用的固定 GUID（RFC 6455）
+_WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+_OPCODE_TEXT = 0x1
+_OPCODE_BINARY = 0x2
+_OPCODE_CLOSE = 0x8
+_OPCODE_PING = 0x9
+_OPCODE_PONG = 0xA
+
+
+class _WebSocketConnection:
+    """一个 WebSocket 连接的帧读写"""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._send_lock = threading.Lock()
+
+    def handshake(self) -> bool:
+        """完成 HTTP Upgrade 握手"""
+        request_line = self.rfile.readline()
+        if not request_line:
+            return False
+        headers = {}
+        while True:
+            line = self.rfile.readline().decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        key = headers.get('sec-websocket-key')
+        if not key:
+            self.wfile.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + _WEBSOCKET_GUID).encode()).digest()).decode()
+        self.wfile.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        ).encode())
+        self.wfile.flush()
+        return True
+
+    def _read_exact(self, size: int) -> bytes:
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise EOFError('连接已关闭')
+        return data
+
+    def recv(self):
+        """读取一条完整消息，返回 (opcode, payload)"""
+        opcode, chunks = None, []
+        while True:
+            first, second = self._read_exact(2)
+            fin = first & 0x80
+            frame_opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack('>H', self._read_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', self._read_exact(8))[0]
+            mask = self._read_exact(4) if second & 0x80 else None
+            payload = self._read_exact(length)
+            if mask:
+                payload = bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+            if frame_opcode >= 0x8:
+                # 控制帧可以插在分片消息之间
+                return frame_opcode, payload
+            if frame_opcode:
+                opcode = frame_opcode
+            chunks.append(payload)
+            if fin:
+                return opcode, b''.join(chunks)
+
+    def send(self, opcode: int, payload: bytes) -> None:
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 1 << 16:
+            header += bytes([126]) + struct.pack('>H', length)
+        else:
+            header += bytes([127]) + struct.pack('>Q', length)
+        with self._send_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+    def send_json(self, message: dict) -> None:
+        self.send(_OPCODE_TEXT, json.dumps(message, ensure_ascii=False).encode('utf-8'))
+
+
+class _TranscriptionSession:
+    """按收到的音频时长生成识别事件"""
+
+    def __init__(self, connection: _WebSocketConnection, task_id: str, sample_rate: int,
+                 sentence_seconds: float):
+        self.connection = connection
+        self.task_id = task_id
+        self.bytes_per_ms = sample_rate * 2 / 1000
+        self.sentence_ms = int(sentence_seconds * 1000)
+        self.received_ms = 0
+        self.sentence_begin_ms = 0
+        self.index = 0
+
+    def _event(self, name: str, payload: Optional[dict] = None) -> None:
+        self.connection.send_json({
+            'header': {
+                'namespace': 'SpeechTranscriber',
+                'name': name,
+                'status': 20000000,
+                'message_id': uuid.uuid4().hex,
+                'task_id': self.task_id,
+                'status_text': 'Gateway:SUCCESS:Success.',
+            },
+            'payload': payload or {},
+        })
+
+    def _finish_sentence(self, end_ms: int) -> None:
+        self.index += 1
+        text = f'第{self.index}句'
+        begin_ms = self.sentence_begin_ms
+        self._event('SentenceBegin', {'index': self.index, 'time': begin_ms})
+        self._event('TranscriptionResultChanged', {
+            'index': self.index, 'time': end_ms, 'result': text[:-1], 'words': [],
+        })
+        self._event('SentenceEnd', {
+            'index': self.index,
+            'time': end_ms,
+            'begin_time': begin_ms,
+            'result': text,
+            'confidence': 0.9,
+            'words': [{'text': text, 'startTime': begin_ms, 'endTime': end_ms}],
+        })
+        self.sentence_begin_ms = end_ms
+
+    def feed(self, audio: bytes) -> None:
+        self.received_ms += int(len(audio) / self.bytes_per_ms)
+        while self.received_ms - self.sentence_begin_ms >= self.sentence_ms:
+            self._finish_sentence(self.sentence_begin_ms + self.sentence_ms)
+
+    def stop(self) -> None:
+        if self.received_ms > self.sentence_begin_ms:
+            self._finish_sentence(self.received_ms)
+        self._event('TranscriptionCompleted')
+
+
+class _StubHandler(socketserver.StreamRequestHandler):
+    """处理一个实时识别连接"""
+
+    def handle(self):
+        connection = _WebSocketConnection(self.rfile, self.wfile)
+        if not connection.handshake():
+            return
+
+        session = None
+        while True:
+            try:
+                opcode, payload = connection.recv()
+            except (EOFError, ConnectionError):
+                return
+
+            if opcode == _OPCODE_CLOSE:
+                connection.send(_OPCODE_CLOSE, payload[:2])
+                return
+            if opcode == _OPCODE_PING:
+                connection.send(_OPCODE_PONG, payload)
+            elif opcode == _OPCODE_BINARY and session is not None:
+                session.feed(payload)
+            elif opcode == _OPCODE_TEXT:
+                message = json.loads(payload.decode('utf-8'))
+                name = message['header']['name']
+                if name == 'StartTranscription':
+                    session = _TranscriptionSession(
+                        connection, message['header']['task_id'],
+                        message['payload'].get('sample_rate', 16000), self.server.sentence_seconds
+                    )
+                    session._event('TranscriptionStarted')
+                elif name == 'StopTranscription' and session is not None:
+                    session.stop()
+
+
+class StubNLSServer(socketserver.ThreadingTCPServer):
+    """实时语音识别替身服务"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, sentence_seconds: float = 1.0):
+        self.sentence_seconds = sentence_seconds
+        super().__init__((host, port), _StubHandler)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'ws://{host}:{port}/ws/v1'
+
+    def start(self) -> 'StubNLSServer':
+        """在后台线程中运行"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='实时语音识别的本地替身服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址 (默认: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8900, help='监听端口 (默认: 8900)')
+    parser.add_argument('--sentence-seconds', type=float, default=3.0, help='每句对应的音频秒数 (默认: 3.0)')
+    args = parser.parse_args()
+
+    server = StubNLSServer(args.host, args.port, args.sentence_seconds)
+    print(f'实时识别替身服务已启动: {server.url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\n服务退出')
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""
+录音文件识别任务调度模块
+
+批量处理时所有文件的任务先全部提交，由一个调度器统一跟踪未完成的 TaskId，
+到期时查询状态，结果一到就交给调用方格式化输出，不再逐个文件等待。
+
+每个任务的查询时间按音频时长和已观察到的排队时间估算：短音频很快查询，
+长音频等到预计完成时再查；估算时间过后仍未完成则按倍数退避，并加入随机抖动，
+避免大量同时提交的任务在同一时刻查询。客户端启用回调时，收到回调的任务直接结束，
+轮询只作为兜底。
+"""
+import heapq
+import random
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import count
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import config
+
+# 排队时间估计的平滑系数（指数加权移动平均）
+_QUEUE_TIME_SMOOTHING = 0.3
+
+
+class PollPolicy:
+    """查询间隔策略"""
+
+    def __init__(self, min_interval: Optional[float] = None, max_interval: Optional[float] = None,
+                 backoff: Optional[float] = None, jitter: Optional[float] = None,
+                 processing_ratio: Optional[float] = None):
+        """
+        初始化策略，未指定的参数读取录音文件识别配置
+
+        Args:
+            min_interval (float): 最短查询间隔（秒）
+            max_interval (float): 最长查询间隔（秒）
+            backoff (float): 任务超过预计完成时间后，每次查询间隔的放大倍数
+            jitter (float): 随机抖动比例，0.1 表示在间隔上浮动 ±10%
+            processing_ratio (float): 预计识别耗时与音频时长之比
+        """
+        file_config = config.file_recognition_config
+        self.min_interval = min_interval if min_interval is not None else file_config['poll_min_interval']
+        self.max_interval = max_interval if max_interval is not None else file_config['poll_max_interval']
+        self.backoff = backoff if backoff is not None else file_config['poll_backoff']
+        self.jitter = jitter if jitter is not None else file_config['poll_jitter']
+        self.processing_ratio = (processing_ratio if processing_ratio is not None
+                                 else file_config['poll_processing_ratio'])
+
+    def clamp(self, delay: float) -> float:
+        """限制在最短和最长间隔之间，并加入随机抖动"""
+        delay = min(max(delay, self.min_interval), self.max_interval)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def expected_processing(self, audio_duration: Optional[float]) -> float:
+        """按音频时长估算开始处理后到识别完成所需的秒数"""
+        if not audio_duration:
+            return 0.0
+        return audio_duration * self.processing_ratio
+
+
+class _Task:
+    """调度器内部记录的单个任务状态"""
+
+    __slots__ = ('task_id', 'context', 'audio_duration', 'submitted_at', 'started_at',
+                 'interval', 'polls')
+
+    def __init__(self, task_id: str, context: Any, audio_duration: Optional[float], now: float):
+        self.task_id = task_id
+        self.context = context
+        self.audio_duration = audio_duration
+        self.submitted_at = now
+        # 第一次查询到 RUNNING 的时间，之前一直在排队
+        self.started_at = None
+        # 超过预计完成时间后当前使用的退避间隔
+        self.interval = None
+        self.polls = 0
+
+
+class TaskScheduler:
+    """跟踪所有未完成的录音文件识别任务并统一轮询"""
+
+    def __init__(self, asr_client, policy: Optional[PollPolicy] = None):
+        """
+        初始化调度器
+
+        Args:
+            asr_client (AliyunASRClient): 用于查询任务状态的客户端
+            policy (PollPolicy): 查询间隔策略，默认使用客户端的 poll_policy
+        """
+        self.asr_client = asr_client
+        self.policy = policy or asr_client.poll_policy
+        # 客户端启用回调时使用的回调接收服务
+        self.receiver = getattr(asr_client, 'callback_receiver', None)
+        # 按下次查询时间排序的 (时间, 序号, TaskId)
+        self._heap: List[Tuple[float, int, str]] = []
+        self._tasks: Dict[str, _Task] = {}
+        self._counter = count()
+        # 已观察到的排队时间估计（秒）
+        self.queue_time_estimate = 0.0
+        # 已发出的 GetTaskResult 次数
+        self.query_count = 0
+        self.logger = logging.getLogger('TaskScheduler')
+
+    def add(self, task_id: str, context: Any = None, audio_duration: Optional[float] = None) -> None:
+        """
+        登记一个已提交的任务
+
+        Args:
+            task_id (str): 任务 TaskId
+            context: 调用方附带的上下文，随结果原样返回
+            audio_duration (float): 音频时长（秒），未知时按最短间隔开始退避
+        """
+        now = time.monotonic()
+        task = _Task(task_id, context, audio_duration, now)
+        self._tasks[task_id] = task
+        # 预计先排队，再按音频时长处理
+        expected = self.queue_time_estimate + self.policy.expected_processing(audio_duration)
+        self._schedule(task, now + self.policy.clamp(expected))
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def _schedule(self, task: _Task, due: float) -> None:
+        heapq.heappush(self._heap, (due, next(self._counter), task.task_id))
+
+    def _next_delay(self, task: _Task, status_text: str, now: float) -> float:
+        """任务未完成时计算到下次查询的秒数"""
+        if status_text == 'RUNNING' and task.started_at is None:
+            # 刚开始处理：记录排队时间，下次在预计完成时查询
+            task.started_at = now
+            queue_time = now - task.submitted_at
+            self.queue_time_estimate += _QUEUE_TIME_SMOOTHING * (queue_time - self.queue_time_estimate)
+            remaining = self.policy.expected_processing(task.audio_duration)
+            if remaining > self.policy.min_interval:
+                return self.policy.clamp(remaining)
+
+        # 仍在排队，或已超过预计完成时间：按倍数退避
+        if task.interval is None:
+            task.interval = self.policy.min_interval
+        else:
+            task.interval = min(task.interval * self.policy.backoff, self.policy.max_interval)
+        return self.policy.clamp(task.interval)
+
+    def seconds_until_next_poll(self) -> Optional[float]:
+        """距离最早一个任务需要查询的秒数，没有未完成任务时返回 None"""
+        # 丢弃已通过回调结束的任务留下的排期
+        while self._heap and self._heap[0][2] not in self._tasks:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def wait(self, timeout: Optional[float]) -> None:
+        """等待到下次查询时间；启用回调时收到新回调会提前返回"""
+        if self.receiver is not None:
+            self.receiver.wait(timeout)
+        elif timeout:
+            time.sleep(timeout)
+
+    def _collect_callbacks(self) -> List[Tuple[Any, Optional[List[Dict[str, Any]]], Optional[Exception]]]:
+        """结束所有已收到回调的任务"""
+        finished = []
+        for task_id in list(self._tasks):
+            data = self.receiver.pop(task_id)
+            if data is None:
+                continue
+            task = self._tasks[task_id]
+            try:
+                _, segments = self.asr_client.parse_task_response(data)
+            except Exception as e:
+                self.logger.error(f"任务 {task_id} 处理失败: {e}")
+                del self._tasks[task_id]
+                finished.append((task.context, None, e))
+                continue
+            if segments is None:
+                continue
+            self.logger.info(f"通过回调获得任务结果, TaskId: {task_id} "
+                             f"(耗时 {time.monotonic() - task.submitted_at:.1f} 秒)")
+            del self._tasks[task_id]
+            finished.append((task.context, segments, None))
+        return finished
+
+    def poll_due(self) -> List[Tuple[Any, Optional[List[Dict[str, Any]]], Optional[Exception]]]:
+        """
+        处理已收到的回调，并查询所有已到期的任务
+
+        Returns:
+            list: 本轮结束的任务 (context, 分段列表, 异常)。成功时异常为 None，失败时分段列表为 None
+        """
+        # 先取出本轮到期的任务，重新排期的任务留到下一轮
+        now = time.monotonic()
+        due_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due_ids.append(heapq.heappop(self._heap)[2])
+
+        finished = self._collect_callbacks() if self.receiver is not None else []
+        for task_id in due_ids:
+            task = self._tasks.get(task_id)
+            if task is None:
+                continue
+            task.polls += 1
+            self.query_count += 1
+            try:
+                status_text, segments = self.asr_client.query_file_task(task_id)
+            except Exception as e:
+                self.logger.error(f"查询任务 {task_id} 失败: {e}")
+                del self._tasks[task_id]
+                finished.append((task.context, None, e))
+                continue
+
+            now = time.monotonic()
+            if segments is None:
+                delay = self._next_delay(task, status_text, now)
+                self.logger.debug(f"任务 {task_id} 仍在处理中 (状态: {status_text})，{delay:.1f} 秒后再查询")
+                self._schedule(task, now + delay)
+                continue
+
+            self.logger.info(f"任务处理成功, TaskId: {task_id} "
+                             f"(耗时 {now - task.submitted_at:.1f} 秒，查询 {task.polls} 次)")
+            del self._tasks[task_id]
+            finished.append((task.context, segments, None))
+        return finished
+
+    def run_until_complete(self) -> List[Tuple[Any, Optional[List[Dict[str, Any]]], Optional[Exception]]]:
+        """阻塞直到所有已登记的任务结束，返回全部结果"""
+        finished = []
+        while self._tasks:
+            self.wait(self.seconds_until_next_poll())
+            finished.extend(self.poll_due())
+        return finished
+
+
+def run_file_tasks(scheduler: TaskScheduler, jobs: List[Tuple[Any, str]],
+                   submit: Callable[[str], Tuple[str, Optional[float]]],
+                   on_finished: Callable[[Any, Optional[List[Dict[str, Any]]], Optional[Exception]], None],
+                   concurrency: int = 4, retries: int = 0) -> None:
+    """
+    并发提交一批任务并由调度器统一等待，每个任务结束时立即回调
+
+    Args:
+        scheduler (TaskScheduler): 跟踪未完成任务的调度器
+        jobs (list): (context, 文件路径)，context 原样传给 on_finished
+        submit (callable): 上传并提交一个文件，返回 (TaskId, 音频时长)
+        on_finished (callable): on_finished(context, 分段列表, 异常)，失败时分段列表为 None
+        concurrency (int): 同时上传/提交的任务数
+        retries (int): 提交或识别失败后重新提交的次数
+    """
+    logger = logging.getLogger('TaskScheduler')
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # 提交中的任务 future -> (context, 文件路径, 已失败次数)
+        submissions = {executor.submit(submit, path): (context, path, 0) for context, path in jobs}
+
+        def handle_failure(job, error):
+            context, path, attempt = job
+            if attempt < retries:
+                logger.warning(f"任务失败，重新提交 ({attempt + 1}/{retries}) {path}: {error}")
+                submissions[executor.submit(submit, path)] = (context, path, attempt + 1)
+            else:
+                on_finished(context, None, error)
+
+        while submissions or scheduler:
+            # 等到有任务提交完成或有任务需要查询
+            timeout = scheduler.seconds_until_next_poll()
+            if submissions:
+                done, _ = wait(list(submissions), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = submissions.pop(future)
+                    try:
+                        task_id, audio_duration = future.result()
+                    except Exception as e:
+                        handle_failure(job, e)
+                        continue
+                    scheduler.add(task_id, job, audio_duration)
+            else:
+                scheduler.wait(timeout)
+
+            for job, segments, error in scheduler.poll_due():
+                if error is not None:
+                    handle_failure(job, error)
+                else:
+                    on_finished(job[0], segments, None)
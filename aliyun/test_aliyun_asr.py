@@ -2,20 +2,38 @@
 """
 阿里云语音识别测试脚本
 """
+import io
 import os
 import sys
+import json
+import time
 import tempfile
+import threading
 import unittest
+import urllib.error
+import urllib.request
+from contextlib import redirect_stdout
 from unittest.mock import Mock, patch, MagicMock
 
 # 添加当前目录到Python路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# 添加项目根目录，使用与 Whisper 后端共享的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from config import config
 from aliyun_asr import AliyunASRClient
 from output_formatter import OutputFormatter
 from utils import validate_audio_file, format_duration, estimate_cost
 
+# 测试用的输入与期望输出文件
+TEST_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+except ImportError:  # 列式归档的测试需要 pyarrow
+    pyarrow = None
+
 class TestAliyunASRConfig(unittest.TestCase):
     """测试配置类"""
     
@@ -129,6 +147,136 @@ class TestOutputFormatter(unittest.TestCase):
         self.assertIn('你好，欢迎使用阿里云语音识别', txt_content)
         self.assertIn('这是一个测试音频文件', txt_content)
 
+    def test_save_output_single_pass(self):
+        """测试一次遍历写出的各格式文件与单独生成的内容一致"""
+        generators = {
+            'srt': self.formatter.generate_srt,
+            'vtt': self.formatter.generate_vtt,
+            'lrc': self.formatter.generate_lrc,
+            'txt': self.formatter.generate_txt,
+            'srt_words': self.formatter.generate_word_level_srt,
+            'lrc_words': self.formatter.generate_word_level_lrc,
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            saved_files = self.formatter.save_output(self.sample_segments, 'sample.wav', temp_dir, list(generators))
+            for format_name, generator in generators.items():
+                with open(saved_files[format_name], encoding='utf-8') as f:
+                    self.assertEqual(f.read(), generator(self.sample_segments), format_name)
+        self.assertIn('1\n00:00:00,000 --> 00:00:00,700\n你好，欢\n\n', generators['srt_words'](self.sample_segments))
+
+    def test_save_output_isolates_failures(self):
+        """测试某个格式写到一半失败时只删除该格式的文件，其余格式照常写完"""
+        import subtitle_writer
+
+        class FailingSink(subtitle_writer.SubtitleSink):
+            def block(self, first_index, transcript):
+                self.f.write('部分内容')
+                raise OSError('磁盘已满')
+
+        self.formatter.json_sink = lambda f, *args, **kwargs: FailingSink(f)
+        formats = ['srt', 'json', 'txt']
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with redirect_stdout(io.StringIO()) as output:
+                saved_files = self.formatter.save_output(self.sample_segments, 'sample.wav', temp_dir, formats)
+            self.assertEqual(sorted(saved_files), ['srt', 'txt'])
+            self.assertIn('保存json文件失败: 磁盘已满', output.getvalue())
+            output_dir = os.path.dirname(saved_files['srt'])
+            self.assertEqual(sorted(os.listdir(output_dir)), ['sample.srt', 'sample.txt'])
+            with open(saved_files['srt'], encoding='utf-8') as f:
+                self.assertEqual(f.read(), self.formatter.generate_srt(self.sample_segments))
+
+        # 分段本身出错时所有文件都删除并抛出异常
+        with tempfile.TemporaryDirectory() as temp_dir:
+            outputs = {os.path.join(temp_dir, name): self.formatter.srt_sink for name in ('a.srt', 'b.srt')}
+            with self.assertRaises(TypeError):
+                subtitle_writer.write_files([{'text': '甲', 'start_time': None}], outputs)
+            self.assertEqual(os.listdir(temp_dir), [])
+
+    def test_json_matches_baseline_golden(self):
+        """测试 JSON 输出与原实现逐字节一致（test_data 中的文件由原 generate_json 生成）"""
+        import datetime as dt
+        import output_formatter
+        import subtitle_writer
+
+        class FixedDatetime(dt.datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return cls(2025, 7, 14, 13, 59, 18, 116344)
+
+        def read(name):
+            with open(os.path.join(TEST_DATA_DIR, name), encoding='utf-8') as f:
+                return f.read()
+
+        segments = json.loads(read('json_golden_segments.json'))
+        golden, golden_compact = read('json_golden.json'), read('json_golden_compact.json')
+        # 分块写出时块与块之间的拼接也要与整体编码一致
+        with patch.object(output_formatter, 'datetime', FixedDatetime), \
+                patch.object(subtitle_writer, 'BLOCK_SIZE', 3):
+            self.assertEqual(self.formatter.generate_json(segments, compact=False), golden)
+            self.assertEqual(self.formatter.generate_json(segments, compact=True), golden_compact)
+            with tempfile.TemporaryDirectory() as temp_dir, redirect_stdout(io.StringIO()):
+                for compact, expected in [(False, golden), (True, golden_compact)]:
+                    with patch.dict(config.output_config, json_compact=compact):
+                        saved_files = self.formatter.save_output(segments, 'golden.wav', temp_dir, ['json'])
+                    with open(saved_files['json'], encoding='utf-8') as f:
+                        self.assertEqual(f.read(), expected)
+            empty = {'segments': [], 'metadata': dict(json.loads(golden)['metadata'], total_segments=0,
+                                                     total_duration=0)}
+            self.assertEqual(self.formatter.generate_json([], compact=False),
+                             json.dumps(empty, ensure_ascii=False, indent=2))
+
+    def test_batch_timestamps_match_scalar(self):
+        """测试批量格式化时间戳与逐个格式化的结果一致"""
+        import subtitle_writer
+        values = [0, 0.125, 0.375, 0.005, 0.015, 59.995, 59.999, 61.5, 599.995, 3599.9995, 3600, 86399.999,
+                  86400.5, 360000.25, -0.0, -1.5]
+        values += [i * 7.3137 for i in range(64)]
+        for batch, scalar in [
+            (self.formatter.format_timestamps_for_srt, self.formatter.format_timestamp_for_srt),
+            (self.formatter.format_timestamps_for_vtt, self.formatter.format_timestamp_for_vtt),
+            (self.formatter.format_timestamps_for_lrc, self.formatter.format_timestamp_for_lrc),
+        ]:
+            self.assertEqual(batch(values), [scalar(value) for value in values], scalar.__name__)
+
+        # 分成多块写出时序号连续
+        segments = [{'text': str(i), 'start_time': i, 'end_time': i + 0.5,
+                     'words': [{'text': str(i), 'start_time': i, 'end_time': i + 0.5}]} for i in range(10)]
+        expected = self.formatter.generate_word_level_srt(segments)
+        with patch.object(subtitle_writer, 'BLOCK_SIZE', 3):
+            self.assertEqual(self.formatter.generate_word_level_srt(segments), expected)
+        self.assertIn('10\n00:00:09,000 --> 00:00:09,500\n9\n\n', expected)
+
+    def test_word_level_srt_missing_end(self):
+        """测试一组的末词缺少结束时间时，字幕块结束于末词开始后 1 秒（原来为首词开始后 1 秒）"""
+        segments = [{'text': '你好', 'start_time': 1.0, 'end_time': 4.0, 'words': [
+            {'text': '你', 'start_time': 1.0, 'end_time': 1.5},
+            {'text': '好', 'start_time': 3.0},
+        ]}]
+        self.assertEqual(self.formatter.generate_word_level_srt(segments),
+                         '1\n00:00:01,000 --> 00:00:04,000\n你好\n\n')
+
+    def test_compact_json_and_binary(self):
+        """测试紧凑 JSON 与缩进 JSON 内容相同，二进制文件读回后输出不变"""
+        from transcript import Transcript
+        indented = json.loads(self.formatter.generate_json(self.sample_segments))
+        compact_text = self.formatter.generate_json(self.sample_segments, compact=True)
+        self.assertNotIn('\n', compact_text)
+        compact = json.loads(compact_text)
+        for data in (indented, compact):
+            del data['metadata']['generated_at']
+        self.assertEqual(compact, indented)
+        self.assertEqual(compact['metadata']['total_duration'], 5.0)
+        self.assertEqual(compact['segments'][1]['words'][3], self.sample_segments[1]['words'][3])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            saved_files = self.formatter.save_output(self.sample_segments, 'sample.wav', temp_dir, ['json', 'transcript'])
+            with open(saved_files['json'], encoding='utf-8') as f:
+                self.assertEqual(json.load(f)['metadata']['total_segments'], 2)
+            loaded = Transcript.load(saved_files['transcript'])
+        self.assertEqual(loaded.word_texts()[:2], ['你', '好'])
+        self.assertEqual(self.formatter.generate_word_level_lrc(loaded),
+                         self.formatter.generate_word_level_lrc(self.sample_segments))
+
 class TestUtils(unittest.TestCase):
     """测试工具函数"""
     
@@ -217,6 +365,827 @@ class TestAliyunASRClient(unittest.TestCase):
         self.assertEqual(len(segments[0]['words']), 1)
         self.assertEqual(segments[0]['words'][0]['text'], '测')
 
+class TestWordAlignment(unittest.TestCase):
+    """测试词与句子的对齐"""
+    
+    def _word(self, text, begin, end, channel=0):
+        return {'Word': text, 'BeginTime': begin, 'EndTime': end, 'ChannelId': channel}
+    
+    def test_matches_containment(self):
+        """测试词都落在句子内时与逐句扫描的结果一致"""
+        from benchmark_alignment import make_payload, align_quadratic
+        payload = make_payload(50, 7, seed=1)
+        self.assertEqual(
+            AliyunASRClient._align_words(payload['Sentences'], payload['Words']),
+            align_quadratic(payload['Sentences'], payload['Words'])
+        )
+    
+    def test_boundary_words(self):
+        """测试跨越句末的词留在开始的句子，句间静音中的词丢弃"""
+        sentences = [
+            {'Text': '一', 'BeginTime': 0, 'EndTime': 1000},
+            {'Text': '二', 'BeginTime': 1000, 'EndTime': 2000},
+            {'Text': '三', 'BeginTime': 3000, 'EndTime': 4000},
+        ]
+        words = [
+            self._word('a', 0, 500),
+            self._word('b', 900, 1100),
+            self._word('c', 1000, 1500),
+            self._word('d', 2500, 2800),
+            self._word('e', 3000, 3500),
+        ]
+        aligned = AliyunASRClient._align_words(sentences, words)
+        self.assertEqual([[w['Word'] for w in ws] for ws in aligned], [['a', 'b'], ['c'], ['e']])
+    
+    def test_channels_aligned_separately(self):
+        """测试多声道结果按声道对齐，重叠的句子不会互相抢词"""
+        sentences = [
+            {'Text': '左', 'BeginTime': 0, 'EndTime': 2000, 'ChannelId': 0},
+            {'Text': '右', 'BeginTime': 500, 'EndTime': 1500, 'ChannelId': 1},
+        ]
+        words = [self._word('l', 600, 900, 0), self._word('r', 600, 900, 1)]
+        aligned = AliyunASRClient._align_words(sentences, words)
+        self.assertEqual([[w['Word'] for w in ws] for ws in aligned], [['l'], ['r']])
+
+class TestOSSUploader(unittest.TestCase):
+    """测试OSS上传器"""
+    
+    def setUp(self):
+        from utils import OSSUploader
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.uploader = OSSUploader('test-bucket')
+        self.uploader._bucket = Mock()
+        self.uploader._bucket.object_exists.return_value = False
+        self.uploader._bucket.put_object_from_file.return_value = Mock(status=200)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def _write(self, name, content):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+    
+    def test_content_addressed_key(self):
+        """测试对象名由内容决定，同名的不同文件不会覆盖"""
+        first = self._write('a.wav', b'first')
+        os.makedirs(os.path.join(self.temp_dir.name, 'sub'))
+        second = self._write(os.path.join('sub', 'a.wav'), b'second')
+        copy = self._write('copy.wav', b'first')
+        
+        self.assertNotEqual(self.uploader.object_key(first), self.uploader.object_key(second))
+        self.assertEqual(self.uploader.object_key(first), self.uploader.object_key(copy))
+        self.assertTrue(self.uploader.object_key(first).endswith('.wav'))
+    
+    def test_skip_existing_object(self):
+        """测试对象已存在时跳过上传"""
+        path = self._write('a.wav', b'audio')
+        self.uploader._bucket.object_exists.return_value = True
+        
+        url = self.uploader.upload(path)
+        
+        self.uploader._bucket.put_object_from_file.assert_not_called()
+        self.assertTrue(url.endswith(self.uploader.object_key(path)))
+    
+    @patch('utils.oss2.resumable_upload')
+    def test_multipart_above_threshold(self, mock_resumable_upload):
+        """测试超过阈值的文件使用分片断点续传"""
+        mock_resumable_upload.return_value = Mock(status=200)
+        small = self._write('small.wav', b'x' * 10)
+        large = self._write('large.wav', b'x' * 100)
+        self.uploader.upload_config = dict(self.uploader.upload_config, multipart_threshold=50,
+                                           checkpoint_dir=self.temp_dir.name)
+        
+        self.uploader.upload(small)
+        self.uploader._bucket.put_object_from_file.assert_called_once()
+        mock_resumable_upload.assert_not_called()
+        
+        self.uploader.upload(large)
+        mock_resumable_upload.assert_called_once()
+        self.assertEqual(mock_resumable_upload.call_args[0][1], self.uploader.object_key(large))
+
+class TestPrepareUploadFile(unittest.TestCase):
+    """测试上传前转码"""
+    
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.video = os.path.join(self.temp_dir.name, 'talk.mp4')
+        with open(self.video, 'wb') as f:
+            f.write(b'\0' * 1000)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    @patch('utils.subprocess.run')
+    def test_transcode_video(self, mock_run):
+        """测试视频按配置的采样率转码为单声道 MP3"""
+        from utils import prepare_upload_file
+        
+        def fake_ffmpeg(cmd, **kwargs):
+            with open(cmd[-1], 'wb') as f:
+                f.write(b'\0' * 10)
+            return Mock(returncode=0, stderr='')
+        
+        mock_run.side_effect = fake_ffmpeg
+        upload_path = prepare_upload_file(self.video, self.temp_dir.name)
+        
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual(cmd[0], 'ffmpeg')
+        self.assertIn('-vn', cmd)
+        self.assertEqual(cmd[cmd.index('-ac') + 1], '1')
+        self.assertEqual(cmd[cmd.index('-ar') + 1], str(config.file_recognition_config['sample_rate']))
+        self.assertTrue(upload_path.endswith('talk.mp3'))
+    
+    @patch('utils.subprocess.run')
+    def test_fallback_to_original(self, mock_run):
+        """测试压缩音频不转码，转码失败时上传原文件"""
+        from utils import prepare_upload_file
+        self.assertEqual(prepare_upload_file('speech.m4a', self.temp_dir.name), 'speech.m4a')
+        mock_run.assert_not_called()
+        
+        mock_run.return_value = Mock(returncode=1, stderr='Invalid data found')
+        self.assertEqual(prepare_upload_file(self.video, self.temp_dir.name), self.video)
+
+class TestUploadMedia(unittest.TestCase):
+    """测试先检查 OSS 再转码上传"""
+    
+    def setUp(self):
+        from utils import OSSUploader
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.video = os.path.join(self.temp_dir.name, 'talk.mp4')
+        with open(self.video, 'wb') as f:
+            f.write(b'\0' * 1000)
+        self.uploader = OSSUploader('test-bucket')
+        self.uploader._bucket = Mock()
+        self.uploader._bucket.put_object_from_file.return_value = Mock(status=200)
+        patcher = patch('utils.get_uploader', return_value=self.uploader)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    @staticmethod
+    def _fake_ffmpeg(cmd, **kwargs):
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'\0' * 10)
+        return Mock(returncode=0, stderr='')
+    
+    @patch('utils.subprocess.run')
+    def test_skip_transcode_when_uploaded(self, mock_run):
+        """测试 OSS 中已有转码结果时不转码也不上传"""
+        from utils import upload_media
+        self.uploader._bucket.object_exists.return_value = True
+        url = upload_media(self.video)
+        
+        mock_run.assert_not_called()
+        self.uploader._bucket.put_object_from_file.assert_not_called()
+        object_key = self.uploader._bucket.object_exists.call_args[0][0]
+        self.assertTrue(url.endswith(object_key))
+        self.assertTrue(object_key.endswith('.mp3'))
+    
+    @patch('utils.subprocess.run')
+    def test_transcode_and_upload_once(self, mock_run):
+        """测试对象不存在时转码一次并以源文件哈希和转码参数命名对象"""
+        from utils import upload_media
+        mock_run.side_effect = self._fake_ffmpeg
+        self.uploader._bucket.object_exists.return_value = False
+        upload_media(self.video)
+        
+        mock_run.assert_called_once()
+        self.uploader._bucket.object_exists.assert_called_once()
+        checked_key = self.uploader._bucket.object_exists.call_args[0][0]
+        self.assertEqual(self.uploader._bucket.put_object_from_file.call_args[0][0], checked_key)
+    
+    def test_key_depends_on_settings(self):
+        """测试分段位置或转码参数不同时对象名不同，源文件哈希只计算一次"""
+        from utils import hash_file
+        settings = {'sample_rate': 16000, 'bitrate': '32k', 'start': None, 'duration': None}
+        with patch('utils.hash_file', side_effect=hash_file) as mock_hash:
+            keys = {
+                self.uploader.transcoded_object_key(self.video, settings),
+                self.uploader.transcoded_object_key(self.video, dict(settings, start='0.000', duration='30.000')),
+                self.uploader.transcoded_object_key(self.video, dict(settings, start='30.000', duration='30.000')),
+                self.uploader.transcoded_object_key(self.video, dict(settings, bitrate='64k')),
+            }
+        self.assertEqual(len(keys), 4)
+        mock_hash.assert_called_once()
+    
+    @patch('utils.subprocess.run')
+    def test_compressed_audio_not_transcoded(self, mock_run):
+        """测试不需要转码的文件按内容哈希上传"""
+        from utils import upload_media
+        audio = os.path.join(self.temp_dir.name, 'speech.m4a')
+        with open(audio, 'wb') as f:
+            f.write(b'audio')
+        self.uploader._bucket.object_exists.return_value = False
+        upload_media(audio)
+        
+        mock_run.assert_not_called()
+        self.assertEqual(self.uploader._bucket.put_object_from_file.call_args[0][0],
+                         self.uploader.object_key(audio))
+
+class TestLongAudioChunking(unittest.TestCase):
+    """测试长音频切分与合并"""
+    
+    def test_plan_chunks_at_silence(self):
+        """测试切点落在目标位置附近的静音中点，分段互相重叠"""
+        from utils import plan_chunks
+        chunks = plan_chunks(100, [(28, 30), (61, 62)], chunk_seconds=30, overlap=2)
+        
+        self.assertEqual([(core_start, core_end) for _, _, core_start, core_end in chunks],
+                         [(0, 29), (29, 61.5), (61.5, 91.5), (91.5, 100)])
+        self.assertEqual(chunks[1][:2], (27, 63.5))
+        self.assertEqual(chunks[-1][1], 100)
+    
+    def test_merge_removes_overlap_duplicates(self):
+        """测试合并时修正时间偏移，重叠部分的句子只保留一次"""
+        chunks = [(0, 12, 0, 10), (8, 20, 10, 20)]
+        word = {'text': '乙', 'start_time': 1.0, 'end_time': 1.5}
+        results = [
+            [{'text': '甲', 'start_time': 1.0, 'end_time': 3.0, 'words': []},
+             {'text': '乙', 'start_time': 9.0, 'end_time': 11.5, 'words': [dict(word, start_time=9.0)]}],
+            [{'text': '乙', 'start_time': 1.0, 'end_time': 3.5, 'words': [word]},
+             {'text': '丙', 'start_time': 5.0, 'end_time': 7.0, 'words': []}],
+        ]
+        
+        merged = AliyunASRClient._merge_chunk_segments(chunks, results)
+        
+        self.assertEqual([segment['text'] for segment in merged], ['甲', '乙', '丙'])
+        self.assertEqual((merged[1]['start_time'], merged[1]['end_time']), (9.0, 11.5))
+        self.assertEqual(merged[1]['words'][0]['start_time'], 9.0)
+        self.assertEqual(merged[2]['start_time'], 13.0)
+
+class TestTranscriptCache(unittest.TestCase):
+    """测试转录结果缓存"""
+    
+    def setUp(self):
+        from transcript_cache import TranscriptCache
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = TranscriptCache(self.temp_dir.name, max_mb=1)
+        self.segments = [{'text': '测试', 'start_time': 0.0, 'end_time': 1.0, 'words': []}]
+    
+    def tearDown(self):
+        self.temp_dir.cleanup()
+    
+    def test_put_and_get(self):
+        """测试写入后命中"""
+        key = self.cache.make_key('abc', 'aliyun', 'nls-file', 'zh-CN', {'sample_rate': 16000})
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, self.segments)
+        self.assertEqual(self.cache.get(key), self.segments)
+    
+    def test_key_depends_on_options(self):
+        """测试识别参数不同时缓存键不同"""
+        key_zh = self.cache.make_key('abc', 'aliyun', 'nls-file', 'zh-CN', {'sample_rate': 16000})
+        key_en = self.cache.make_key('abc', 'aliyun', 'nls-file', 'en-US', {'sample_rate': 16000})
+        key_8k = self.cache.make_key('abc', 'aliyun', 'nls-file', 'zh-CN', {'sample_rate': 8000})
+        self.assertEqual(len({key_zh, key_en, key_8k}), 3)
+    
+    def test_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的条目"""
+        self.cache.max_bytes = 1500
+        big_segments = [{'text': 'x' * 600}]
+        self.cache.put('aa01', big_segments)
+        os.utime(self.cache._entry_path('aa01'), (1, 1))
+        self.cache.put('aa02', big_segments)
+        os.utime(self.cache._entry_path('aa02'), (2, 2))
+        # 访问 aa01 使其成为最近使用的条目
+        self.assertIsNotNone(self.cache.get('aa01'))
+        self.cache.put('aa03', big_segments)
+        
+        self.assertIsNotNone(self.cache.get('aa01'))
+        self.assertIsNone(self.cache.get('aa02'))
+        self.assertIsNotNone(self.cache.get('aa03'))
+
+    def test_realtime_mode_skips_cache(self):
+        """测试实时识别模式每次都重新识别并输出实时字幕，不读写缓存"""
+        from aliyun_transcribe import AliyunTranscriber
+        transcriber = AliyunTranscriber(use_mock=True, cache=self.cache)
+        with tempfile.NamedTemporaryFile(suffix='.wav', dir=self.temp_dir.name) as audio, \
+                patch.object(transcriber.asr_client, 'recognize_realtime', return_value=self.segments) as realtime:
+            audio.write(b'\x00' * 3200)
+            audio.flush()
+            output_dir = os.path.join(self.temp_dir.name, 'output')
+            for _ in range(2):
+                self.assertTrue(transcriber.process_file(audio.name, 'realtime', output_dir, ['txt']))
+            self.assertEqual(realtime.call_count, 2)
+            self.assertEqual(transcriber._lookup_cache(audio.name, 'realtime'), (None, None))
+
+class TestTaskScheduler(unittest.TestCase):
+    """测试录音文件识别任务调度"""
+    
+    def setUp(self):
+        from task_scheduler import PollPolicy, TaskScheduler
+        self.client = Mock(callback_receiver=None)
+        self.scheduler = TaskScheduler(self.client, PollPolicy(min_interval=0, jitter=0))
+    
+    def test_poll_until_finished(self):
+        """测试仍在处理的任务保留，完成和失败的任务随结果返回"""
+        segments = [{'text': '测试', 'start_time': 0.0, 'end_time': 1.0}]
+        responses = {
+            'running': ('RUNNING', None),
+            'done': ('SUCCESS', segments),
+        }
+        
+        def query(task_id):
+            if task_id == 'failed':
+                raise Exception('FILE_DOWNLOAD_FAILED')
+            return responses[task_id]
+        
+        self.client.query_file_task.side_effect = query
+        for task_id in ('running', 'done', 'failed'):
+            self.scheduler.add(task_id, f'{task_id}.wav')
+        
+        finished = self.scheduler.poll_due()
+        
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertIn(('done.wav', segments, None), finished)
+        failed = [item for item in finished if item[0] == 'failed.wav'][0]
+        self.assertIsNone(failed[1])
+        self.assertIsInstance(failed[2], Exception)
+        
+        responses['running'] = ('SUCCESS', segments)
+        self.assertEqual(self.scheduler.poll_due(), [('running.wav', segments, None)])
+        self.assertIsNone(self.scheduler.seconds_until_next_poll())
+    
+    def test_run_file_tasks_retries(self):
+        """测试提交失败的任务按次数重试，结果到达时回调"""
+        from task_scheduler import run_file_tasks
+        segments = [{'text': '测试', 'start_time': 0.0, 'end_time': 1.0}]
+        self.client.query_file_task.return_value = ('SUCCESS', segments)
+        attempts = {'a.wav': 0, 'b.wav': 0}
+        
+        def submit(path):
+            attempts[path] += 1
+            if path == 'b.wav' or attempts[path] == 1:
+                raise Exception('Throttling')
+            return f'task-{path}', 1.0
+        
+        finished = []
+        run_file_tasks(self.scheduler, [('a', 'a.wav'), ('b', 'b.wav')], submit,
+                       lambda *result: finished.append(result), concurrency=2, retries=2)
+        
+        self.assertEqual(attempts, {'a.wav': 2, 'b.wav': 3})
+        self.assertIn(('a', segments, None), finished)
+        failed = [result for result in finished if result[0] == 'b'][0]
+        self.assertIsNone(failed[1])
+        self.assertEqual(str(failed[2]), 'Throttling')
+    
+    def test_adaptive_delay(self):
+        """测试查询间隔按音频时长估算，排队和超时后按倍数退避"""
+        from task_scheduler import PollPolicy, TaskScheduler
+        policy = PollPolicy(min_interval=1, max_interval=60, backoff=2, jitter=0, processing_ratio=0.1)
+        scheduler = TaskScheduler(self.client, policy)
+        
+        # 5 秒的短音频按最短间隔查询，一小时的长音频不超过最长间隔
+        scheduler.add('short', audio_duration=5)
+        scheduler.add('long', audio_duration=3600)
+        self.assertAlmostEqual(scheduler.seconds_until_next_poll(), 1, places=1)
+        self.assertAlmostEqual(max(due for due, _, _ in scheduler._heap) - min(due for due, _, _ in scheduler._heap), 59, places=1)
+        
+        task = scheduler._tasks['long']
+        # 排队中按倍数退避
+        self.assertEqual(scheduler._next_delay(task, 'QUEUEING', task.submitted_at + 10), 1)
+        self.assertEqual(scheduler._next_delay(task, 'QUEUEING', task.submitted_at + 11), 2)
+        # 开始处理后记录排队时间，下次在预计完成时查询
+        self.assertEqual(scheduler._next_delay(task, 'RUNNING', task.submitted_at + 20), 60)
+        self.assertAlmostEqual(scheduler.queue_time_estimate, 6)
+        # 超过预计完成时间后继续退避
+        self.assertEqual(scheduler._next_delay(task, 'RUNNING', task.submitted_at + 80), 4)
+
+class TestCallbackReceiver(unittest.TestCase):
+    """测试录音文件识别回调接收服务"""
+    
+    def setUp(self):
+        from callback_server import CallbackReceiver
+        self.receiver = CallbackReceiver('127.0.0.1', 0).start()
+    
+    def tearDown(self):
+        self.receiver.stop()
+    
+    def _fake_filetrans_callback(self, url, payload):
+        """模拟录音文件识别服务在任务完成后向 callback_url 发送结果"""
+        request = urllib.request.Request(
+            url, data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    
+    def test_reject_unknown_path(self):
+        """测试路径不匹配的请求被拒绝"""
+        url = f'http://127.0.0.1:{self.receiver.port}/filetrans/forged'
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self._fake_filetrans_callback(url, {'TaskId': 'task-1', 'StatusText': 'SUCCESS'})
+        self.assertEqual(context.exception.code, 404)
+        self.assertIsNone(self.receiver.pop('task-1'))
+    
+    def test_callback_finishes_task(self):
+        """测试收到回调的任务立即结束，不必等待兜底轮询"""
+        from task_scheduler import PollPolicy, TaskScheduler
+        client = AliyunASRClient(use_mock=True)
+        client.callback_receiver = self.receiver
+        client.query_file_task = Mock(return_value=('RUNNING', None))
+        scheduler = TaskScheduler(client, PollPolicy(min_interval=30, max_interval=30, jitter=0))
+        scheduler.add('task-1', 'a.wav', audio_duration=5)
+        
+        payload = {
+            'TaskId': 'task-1',
+            'StatusText': 'SUCCESS',
+            'Result': {'Sentences': [{'Text': '你好', 'BeginTime': 0, 'EndTime': 1500}]},
+        }
+        threading.Timer(0.1, self._fake_filetrans_callback, (self.receiver.url, payload)).start()
+        start = time.monotonic()
+        finished = scheduler.run_until_complete()
+        
+        self.assertLess(time.monotonic() - start, 5)
+        client.query_file_task.assert_not_called()
+        self.assertEqual(len(finished), 1)
+        context, segments, error = finished[0]
+        self.assertEqual(context, 'a.wav')
+        self.assertIsNone(error)
+        self.assertEqual(segments[0]['text'], '你好')
+        self.assertEqual(segments[0]['end_time'], 1.5)
+
+class TestRateLimiter(unittest.TestCase):
+    """测试接口限流"""
+
+    def _limiter(self, qps=1000, concurrency=8):
+        from rate_limiter import RateLimiter
+        return RateLimiter({
+            'actions': {'SubmitTask': {'qps': qps, 'concurrency': concurrency}},
+            'default': {'qps': 1000, 'concurrency': 8},
+            'max_retries': 2, 'retry_base_delay': 0.01, 'retry_max_delay': 0.05, 'retry_jitter': 0,
+        })
+
+    def test_token_bucket_rate(self):
+        """测试令牌用完后按 qps 放行"""
+        from rate_limiter import TokenBucket
+        bucket = TokenBucket(rate=20, burst=1)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        # 第一个令牌立即取得，其余 4 个各等 1/20 秒
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_concurrency_limit(self):
+        """测试同时进行的请求数不超过配置"""
+        limiter = self._limiter(concurrency=2)
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def request():
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+
+        threads = [threading.Thread(target=limiter.call, args=('SubmitTask', request)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+        self.assertEqual(limiter.stats()['SubmitTask']['calls'], 6)
+        self.assertGreater(limiter.stats()['SubmitTask']['max_wait'], 0.04)
+
+    def test_retry_on_throttling(self):
+        """测试被限流时退避重试，其他错误直接抛出"""
+        from aliyunsdkcore.acs_exception.exceptions import ServerException
+        limiter = self._limiter()
+        request = Mock(side_effect=[ServerException('Throttling.User', 'Request was denied due to user flow control.'),
+                                    ServerException('Throttling.User', 'Request was denied due to user flow control.'),
+                                    {'TaskId': 'task-1'}])
+        self.assertEqual(limiter.call('SubmitTask', request), {'TaskId': 'task-1'})
+        self.assertEqual(limiter.stats()['SubmitTask']['throttled'], 2)
+
+        request = Mock(side_effect=ServerException('InvalidParameter', 'bad appkey'))
+        with self.assertRaises(ServerException):
+            limiter.call('SubmitTask', request)
+        self.assertEqual(request.call_count, 1)
+
+class TestSentenceRecognition(unittest.TestCase):
+    """测试一句话识别和短音频自动选择"""
+
+    def setUp(self):
+        self.original_keys = (config.access_key_id, config.access_key_secret, config.appkey)
+        config.access_key_id = 'test_key_id'
+        config.access_key_secret = 'test_key_secret'
+        config.appkey = 'test_appkey'
+
+    def tearDown(self):
+        config.access_key_id, config.access_key_secret, config.appkey = self.original_keys
+
+    @patch('aliyun_asr.requests.post')
+    def test_audio_sent_in_request_body(self, mock_post):
+        """测试音频直接放在请求体中发送，不上传 OSS"""
+        mock_post.return_value.json.return_value = {
+            'task_id': 'test_task_id', 'result': '你好', 'status': 20000000, 'message': 'SUCCESS'
+        }
+        client = AliyunASRClient(use_mock=False)
+        client.create_token = Mock(return_value='test-token')
+        # 1.5 秒 16kHz 16 位单声道 PCM
+        with tempfile.NamedTemporaryFile(suffix='.pcm', delete=False) as tmp:
+            tmp.write(b'\x00' * 48000)
+        try:
+            with patch('aliyun_asr.upload_media') as mock_upload:
+                result = client.recognize_sentence(tmp.name)
+            mock_upload.assert_not_called()
+        finally:
+            os.unlink(tmp.name)
+
+        self.assertEqual(result['text'], '你好')
+        self.assertEqual(result['end_time'], 1.5)
+        _, kwargs = mock_post.call_args
+        self.assertEqual(len(kwargs['data']), 48000)
+        self.assertEqual(kwargs['params']['format'], 'pcm')
+        self.assertEqual(kwargs['headers']['X-NLS-Token'], 'test-token')
+
+    @patch('aliyun_asr.requests.post')
+    def test_error_status(self, mock_post):
+        """测试服务端返回错误状态时抛出异常"""
+        mock_post.return_value.json.return_value = {'status': 40000001, 'message': 'Gateway:ACCESS_DENIED'}
+        client = AliyunASRClient(use_mock=False)
+        client.create_token = Mock(return_value='test-token')
+        with tempfile.NamedTemporaryFile(suffix='.pcm') as tmp:
+            tmp.write(b'\x00' * 3200)
+            tmp.flush()
+            with self.assertRaises(Exception) as context:
+                client.recognize_sentence(tmp.name)
+        self.assertIn('ACCESS_DENIED', str(context.exception))
+
+    def test_auto_mode_routes_by_duration(self):
+        """测试 auto 模式下短于 60 秒的文件走一句话识别"""
+        from aliyun_transcribe import AliyunTranscriber
+        transcriber = AliyunTranscriber(use_mock=True)
+        self.assertEqual(transcriber._resolve_mode('note.m4a', 'auto', 3.0), 'sentence')
+        self.assertEqual(transcriber._resolve_mode('meeting.mp3', 'auto', 600.0), 'file')
+        # 无法探测时长时按长音频处理
+        self.assertEqual(transcriber._resolve_mode('unknown.wav', 'auto', None), 'file')
+        self.assertEqual(transcriber._resolve_mode('note.m4a', 'file', 3.0), 'file')
+        # 一句话识别没有逐字时间戳，请求逐字格式时仍走录音文件识别
+        self.assertEqual(transcriber._resolve_mode('note.m4a', 'auto', 3.0, ['srt', 'json']), 'sentence')
+        self.assertEqual(transcriber._resolve_mode('note.m4a', 'auto', 3.0, ['srt', 'srt_words']), 'file')
+        self.assertEqual(transcriber._resolve_mode('note.m4a', 'auto', 3.0, ['lrc_words']), 'file')
+
+    def test_probe_once_per_file(self):
+        """测试每个文件只探测一次时长，并传给模式选择、切分判断和调度器"""
+        from aliyun_transcribe import AliyunTranscriber
+        transcriber = AliyunTranscriber(use_mock=True)
+        segments = [{'text': '你好', 'start_time': 0.0, 'end_time': 1.0, 'words': []}]
+        submitted = []
+
+        def fake_run_file_tasks(scheduler, jobs, submit, on_finished, concurrency):
+            for context, path in jobs:
+                submitted.append(submit(path))
+                on_finished(context, segments, None)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            durations = {}
+            for name, duration in [('note.m4a', 3.0), ('meeting.mp3', 600.0), ('lecture.mp3', 10000.0)]:
+                path = os.path.join(temp_dir, name)
+                open(path, 'wb').close()
+                durations[path] = duration
+            paths = list(durations)
+
+            with patch('aliyun_transcribe.get_media_duration', side_effect=durations.get) as probe, \
+                    patch('aliyun_asr.get_media_duration') as client_probe, \
+                    patch('aliyun_transcribe.run_file_tasks', side_effect=fake_run_file_tasks), \
+                    patch.dict(config.file_recognition_config, chunk_seconds=1800), \
+                    patch.object(transcriber.asr_client, 'submit_file_task', return_value='task'), \
+                    patch.object(transcriber.asr_client, 'recognize_file', return_value=segments) as recognize_file, \
+                    patch.object(transcriber.asr_client, 'recognize_sentence', return_value=segments[0]), \
+                    patch.object(transcriber, '_save_segments', return_value=True):
+                self.assertTrue(transcriber.process_file(paths[1], 'auto', temp_dir, ['srt']))
+                self.assertEqual(probe.call_count, 1)
+                recognize_file.assert_called_once_with(paths[1], 600.0)
+
+                probe.reset_mock()
+                recognize_file.reset_mock()
+                success_count = transcriber._process_files_concurrent(paths, 'auto', temp_dir, ['srt'], 2)
+
+            self.assertEqual(success_count, 3)
+            self.assertEqual(sorted(call[0][0] for call in probe.call_args_list), sorted(paths))
+            client_probe.assert_not_called()
+            # 短音频走一句话识别，长音频单独切分识别，其余文件提交任务并把时长交给调度器
+            recognize_file.assert_called_once_with(paths[2], 10000.0)
+            self.assertEqual(submitted, [('task', 600.0)])
+
+class TestRealtimeRecognizer(unittest.TestCase):
+    """测试实时语音识别客户端"""
+
+    def setUp(self):
+        from realtime_stub_server import StubNLSServer
+        self.server = StubNLSServer(sentence_seconds=1.0).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_streaming_results(self):
+        """测试 2.5 秒 PCM 按帧发送后，中间结果和句子结果逐条回调"""
+        from realtime_asr import RealtimeRecognizer
+        # 16kHz 16 位单声道，每帧 100ms
+        frames = [b'\x00' * 3200] * 25
+        events = []
+        recognizer = RealtimeRecognizer('test-token', url=self.server.url, appkey='test-appkey')
+        segments = recognizer.recognize(frames, on_result=lambda segment, final: events.append((segment['text'], final)))
+
+        self.assertEqual([s['text'] for s in segments], ['第1句', '第2句', '第3句'])
+        self.assertEqual([(s['start_time'], s['end_time']) for s in segments], [(0, 1), (1, 2), (2, 2.5)])
+        self.assertEqual(segments[1]['words'][0]['start_time'], 1)
+        # 每句先有中间结果，再有最终结果
+        self.assertEqual(events[:2], [('第1', False), ('第1句', True)])
+        self.assertEqual(sum(final for _, final in events), 3)
+        self.assertIsNotNone(recognizer.time_to_first_caption)
+
+    def test_failing_source(self):
+        """测试音频源中途出错时仍结束识别并抛出真正的原因，而不是一直等待"""
+        from realtime_asr import RealtimeRecognizer
+
+        def frames():
+            yield b'\x00' * 3200
+            raise IOError('解码失败')
+
+        recognizer = RealtimeRecognizer('test-token', url=self.server.url, appkey='test-appkey')
+        result = {}
+
+        def run():
+            try:
+                recognizer.recognize(frames())
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(result['error'], RuntimeError)
+        self.assertIn('解码失败', str(result['error']))
+        self.assertIsInstance(result['error'].__cause__, IOError)
+
+class TestTranscript(unittest.TestCase):
+    """测试两个后端共用的列式转录结果"""
+
+    def setUp(self):
+        self.aliyun_segments = [
+            {'text': ' 你好你好 ', 'start_time': 0.0, 'end_time': 1.0, 'confidence': 0.9, 'words': [
+                {'text': '你', 'start_time': 0.0, 'end_time': 0.25, 'confidence': 0.8},
+                {'text': '好', 'start_time': 0.25, 'end_time': 0.5, 'confidence': 0.7},
+                {'text': '你', 'start_time': 0.5, 'end_time': 0.75, 'confidence': 0.8},
+                {'text': '好', 'start_time': 0.75, 'end_time': 1.0, 'confidence': 0.7},
+            ]},
+            {'text': '', 'start_time': 1.0, 'end_time': 1.5, 'confidence': -1, 'words': []},
+            {'text': '好', 'start_time': 2.0, 'confidence': 0.5},
+        ]
+        self.whisper_result = {'text': '', 'segments': [
+            {'id': 0, 'start': 0.0, 'end': 1.0, 'text': ' 你好你好 ', 'words': [
+                {'word': '你', 'start': 0.0, 'end': 0.25, 'probability': 0.8},
+                {'word': '好', 'start': 0.25, 'end': 0.5, 'probability': 0.7},
+                {'word': '你', 'start': 0.5, 'end': 0.75, 'probability': 0.8},
+                {'word': '好', 'start': 0.75, 'end': 1.0, 'probability': 0.7},
+            ]},
+            {'id': 1, 'start': 1.0, 'end': 1.5, 'text': ''},
+            {'id': 2, 'start': 2.0, 'end': 4.0, 'text': '好'},
+        ]}
+
+    def test_columns(self):
+        """测试时间存入数组、文本驻留、分段到词的偏移"""
+        from transcript import Transcript
+        transcript = Transcript.from_aliyun(self.aliyun_segments)
+        self.assertEqual(len(transcript), 3)
+        self.assertEqual(transcript.word_count, 4)
+        self.assertEqual(list(transcript.word_offsets), [0, 4, 4, 4])
+        # 缺失的结束时间按开始时间 + 2 秒补齐
+        self.assertEqual(list(transcript.ends), [1.0, 1.5, 4.0])
+        self.assertEqual(transcript.duration, 4.0)
+        # 相同的文本只存一次
+        self.assertEqual(transcript.strings, [' 你好你好 ', '你', '好', ''])
+        self.assertEqual(transcript.texts(), [' 你好你好 ', '', '好'])
+        self.assertEqual(transcript.word_texts(), ['你', '好', '你', '好'])
+
+        part = transcript.slice(1, 3)
+        self.assertEqual(part.texts(), ['', '好'])
+        self.assertEqual(list(part.word_offsets), [0, 0, 0])
+
+        restored = transcript.to_segments()
+        self.assertEqual(restored[0]['words'][1], self.aliyun_segments[0]['words'][1])
+        self.assertEqual(restored[2]['end_time'], 4.0)
+
+    def test_both_backends_render_the_same(self):
+        """测试两个后端的结果转换后输出相同，OutputFormatter 可直接使用 Transcript"""
+        from transcript import Transcript
+        formatter = OutputFormatter()
+        aliyun = Transcript.from_aliyun(self.aliyun_segments)
+        whisper = Transcript.from_whisper(self.whisper_result)
+        self.assertEqual(list(aliyun.starts), list(whisper.starts))
+        self.assertEqual(list(aliyun.word_confidences), list(whisper.word_confidences))
+        for name in ['generate_srt', 'generate_lrc', 'generate_txt', 'generate_word_level_srt']:
+            generate = getattr(formatter, name)
+            self.assertEqual(generate(aliyun), generate(self.aliyun_segments), name)
+            self.assertEqual(generate(whisper), generate(aliyun), name)
+        data = json.loads(formatter.generate_json(Transcript.from_aliyun(self.aliyun_segments, keep_segments=True)))
+        # JSON 原样写出原始分段，总时长与原来一样只看 end_time，缺少 end_time 的分段不补齐
+        self.assertEqual(data['segments'], self.aliyun_segments)
+        self.assertEqual(data['metadata']['total_duration'], 1.5)
+        self.assertEqual(len(data['segments'][0]['words']), 4)
+
+    def test_original_segments_kept(self):
+        """测试按需保留原始分段的引用，切片后仍可用；读回的二进制文件置信度未知时还原为整数 -1"""
+        from transcript import Transcript
+        # 默认不保留原始分段，只留下数组
+        self.assertIsNone(Transcript.from_aliyun(self.aliyun_segments).segments)
+        self.assertIsNone(Transcript.from_aliyun(self.aliyun_segments).slice(0, 2).segments)
+        transcript = Transcript.from_aliyun(self.aliyun_segments, keep_segments=True)
+        self.assertIs(transcript.segments[0], self.aliyun_segments[0])
+        self.assertEqual(transcript.slice(1, 3).segments, self.aliyun_segments[1:3])
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'sample.transcript')
+            transcript.save(path)
+            loaded = Transcript.load(path)
+        self.assertIsNone(loaded.segments)
+        restored = loaded.to_segments()
+        self.assertEqual(restored[1]['confidence'], -1)
+        self.assertIsInstance(restored[1]['confidence'], int)
+        self.assertIn('"confidence": -1,', OutputFormatter().generate_json(loaded, compact=False))
+
+@unittest.skipIf(pyarrow is None, '需要 pyarrow')
+class TestTranscriptArchive(unittest.TestCase):
+    """测试按日期和后端分区的列式归档"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.segments = [
+            {'text': f'第{i}句', 'start_time': i * 2.0, 'end_time': i * 2.0 + 1.5, 'confidence': 0.5 + i / 10,
+             'words': [{'text': '第', 'start_time': i * 2.0, 'end_time': i * 2.0 + 0.5, 'confidence': 0.9}]}
+            for i in range(4)
+        ]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_append_and_query(self):
+        """测试追加后按日期、后端、源文件过滤，只读取需要的列"""
+        from transcript import Transcript
+        from transcript_archive import TranscriptArchive
+        archive = TranscriptArchive(self.temp_dir.name)
+        transcript = Transcript.from_aliyun(self.segments)
+        archive.append(transcript, 'a.wav', 'aliyun', '20250101')
+        archive.append(transcript, 'b.wav', 'aliyun', '20250102')
+        archive.append(transcript.slice(0, 1), 'c.wav', 'whisper', '20250102')
+
+        table = archive.query('segments', ['source', 'text'], date='20250102', backend='aliyun')
+        self.assertEqual(table.column_names, ['source', 'text'])
+        self.assertEqual(table.column('text').to_pylist(), ['第0句', '第1句', '第2句', '第3句'])
+        # source 统一保存为绝对路径，查询时相对路径同样能匹配
+        self.assertEqual(set(table.column('source').to_pylist()), {os.path.abspath('b.wav')})
+
+        words = archive.query('words', ['segment', 'start'], source=['a.wav', 'c.wav'], date=('20250101', '20250102'))
+        self.assertEqual(words.num_rows, 5)
+        self.assertEqual(archive.query('words', ['segment'], source=os.path.abspath('c.wav')).num_rows, 1)
+        segments = archive.query('segments', filter=pyarrow.dataset.field('confidence') < 0.65)
+        self.assertEqual(segments.num_rows, 5)
+        self.assertEqual(segments.column('word_count').to_pylist(), [1] * 5)
+
+    def test_compact(self):
+        """测试合并后每个分区只剩一个文件，行按源文件排序，查询结果不变"""
+        import glob
+        from transcript import Transcript
+        from transcript_archive import TranscriptArchive, main
+        archive = TranscriptArchive(self.temp_dir.name)
+        transcript = Transcript.from_aliyun(self.segments)
+        for source in ('b.wav', 'a.wav', 'c.wav'):
+            archive.append(transcript, source, 'aliyun', '20250101')
+        archive.append(transcript, 'd.wav', 'aliyun', '20250102')
+        before = archive.query('words').sort_by([('source', 'ascending'), ('segment', 'ascending')])
+
+        self.assertEqual(archive.compact(date='20250101'), 6)
+        self.assertEqual(len(glob.glob(os.path.join(self.temp_dir.name, '*', 'date=20250101', '*', '*'))), 2)
+        self.assertEqual(len(glob.glob(os.path.join(self.temp_dir.name, '*', 'date=20250102', '*', '*'))), 2)
+        segments = archive.query('segments', ['source'], date='20250101')
+        self.assertEqual(segments.column('source').to_pylist(),
+                         [os.path.abspath(name) for name in ('a.wav', 'b.wav', 'c.wav') for _ in range(4)])
+        self.assertTrue(archive.query('words').equals(before))
+
+        with redirect_stdout(io.StringIO()) as output:
+            main(['compact', self.temp_dir.name])
+        self.assertIn('共合并 0 个数据文件', output.getvalue())
+
+    def test_save_output_appends(self):
+        """测试配置归档目录后 save_output 同时追加归档"""
+        from transcript_archive import TranscriptArchive
+        formatter = OutputFormatter()
+        archive_dir = os.path.join(self.temp_dir.name, 'archive')
+        with patch.dict(config.output_config, {'archive_dir': archive_dir}):
+            saved_files = formatter.save_output(self.segments, 'a.wav', self.temp_dir.name, ['txt'], backend='aliyun-mock')
+        self.assertEqual(saved_files['archive'], archive_dir)
+        table = TranscriptArchive(archive_dir).query('words', ['source', 'backend'])
+        self.assertEqual(table.to_pydict(), {'source': [os.path.abspath('a.wav')] * 4, 'backend': ['aliyun-mock'] * 4})
+
 def create_test_audio_file():
     """创建测试音频文件"""
     try:
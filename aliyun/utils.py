@@ -2,10 +2,143 @@
 通用工具模块
 """
 import os
+import sys
+import json
+import hashlib
 import logging
-from typing import Optional
+import tempfile
+import functools
+import subprocess
+import threading
+from typing import List, Optional, Tuple
 import oss2
 from config import config
+from rate_limiter import rate_limiter
+
+# 添加项目根目录，使用与 Whisper 后端共享的模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import instrumentation
+from transcript_cache import hash_file
+
+class OSSUploader:
+    """
+    可复用的阿里云OSS上传器
+
+    Bucket 只创建一次，多线程共用。对象名由文件内容的 SHA-256 决定，相同内容只上传一次，
+    同名的不同文件也不会互相覆盖；上传前先用 HEAD 请求检查对象是否已存在。
+    超过分片阈值的文件使用并行分片的断点续传上传，失败后重试会从已完成的分片继续。
+    """
+
+    def __init__(self, bucket_name: Optional[str] = None):
+        """
+        初始化上传器
+
+        Args:
+            bucket_name (str): Bucket 名称，默认使用录音文件识别配置中的 oss_bucket
+        """
+        self.bucket_name = (bucket_name or config.file_recognition_config.get('oss_bucket')
+                            or config.oss_bucket)
+        self.endpoint = f'oss-{config.region}.aliyuncs.com'
+        self.upload_config = config.oss_upload_config
+        self.logger = logging.getLogger('OSS_Uploader')
+        self._bucket = None
+        self._lock = threading.Lock()
+
+    @property
+    def bucket(self) -> oss2.Bucket:
+        """首次使用时创建 Bucket 实例"""
+        with self._lock:
+            if self._bucket is None:
+                if not all([config.access_key_id, config.access_key_secret, self.bucket_name, config.region]):
+                    raise ValueError("OSS配置不完整 (AK, SK, Bucket, Region都需要)")
+                auth = oss2.Auth(config.access_key_id, config.access_key_secret)
+                self._bucket = oss2.Bucket(auth, self.endpoint, self.bucket_name)
+            return self._bucket
+
+    def object_key(self, local_file_path: str) -> str:
+        """由文件内容哈希生成对象名，保留扩展名以便服务端识别格式"""
+        extension = os.path.splitext(local_file_path)[1].lower()
+        return f"{self.upload_config['object_prefix']}{hash_file(local_file_path)}{extension}"
+
+    def transcoded_object_key(self, source_path: str, settings: dict) -> str:
+        """由源文件内容哈希和转码参数生成转码结果的对象名，不必先转码即可检查对象是否存在"""
+        digest = hashlib.sha256()
+        digest.update(source_file_hash(source_path).encode('utf-8'))
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return f"{self.upload_config['object_prefix']}{digest.hexdigest()}.mp3"
+
+    def exists(self, object_key: str) -> bool:
+        """用 HEAD 请求检查对象是否已存在"""
+        return rate_limiter.call('OSSHead', self.bucket.object_exists, object_key)
+
+    def object_url(self, object_key: str) -> str:
+        """
+        构建对象URL
+        注意：这里的URL格式需要根据你的Bucket权限设置（公开/私有）
+        这里我们构建一个标准的https地址
+        """
+        return f"https://{self.bucket_name}.{self.endpoint}/{object_key}"
+
+    def upload(self, local_file_path: str, object_key: Optional[str] = None, check_exists: bool = True) -> str:
+        """
+        上传文件，对象已存在时跳过
+
+        Args:
+            local_file_path (str): 本地文件路径
+            object_key (str): 对象名，默认由文件内容哈希生成
+            check_exists (bool): 是否先检查对象是否已存在，调用方已检查过时可关闭
+
+        Returns:
+            str: 文件的OSS URL
+
+        Raises:
+            Exception: 如果上传失败
+        """
+        bucket = self.bucket
+        object_key = object_key or self.object_key(local_file_path)
+        file_size = os.path.getsize(local_file_path)
+
+        if check_exists and self.exists(object_key):
+            self.logger.info(f"OSS中已存在相同内容的文件，跳过上传: {object_key}")
+            return self.object_url(object_key)
+
+        self.logger.info(f"准备上传文件 '{local_file_path}' 到OSS Bucket '{self.bucket_name}'...")
+        with instrumentation.span('upload_to_oss', file=local_file_path, size=file_size):
+            if file_size >= self.upload_config['multipart_threshold']:
+                # 断点信息保存在本地，被限流后重试时跳过已上传的分片
+                store = oss2.ResumableStore(root=self.upload_config['checkpoint_dir'])
+                result = rate_limiter.call(
+                    'OSSUpload', oss2.resumable_upload,
+                    bucket, object_key, local_file_path,
+                    store=store,
+                    multipart_threshold=self.upload_config['multipart_threshold'],
+                    part_size=self.upload_config['part_size'],
+                    num_threads=self.upload_config['num_threads'],
+                )
+            else:
+                result = rate_limiter.call('OSSUpload', bucket.put_object_from_file, object_key, local_file_path)
+
+        if result.status != 200:
+            raise Exception(f"上传失败，HTTP状态码: {result.status}")
+
+        file_url = self.object_url(object_key)
+        self.logger.info(f"文件上传成功！URL: {file_url}")
+        return file_url
+
+
+_uploader = None
+_uploader_lock = threading.Lock()
+
+
+def get_uploader() -> OSSUploader:
+    """获取进程内共用的上传器"""
+    global _uploader
+    with _uploader_lock:
+        if _uploader is None or _uploader.bucket_name != (
+                config.file_recognition_config.get('oss_bucket') or config.oss_bucket):
+            _uploader = OSSUploader()
+        return _uploader
+
 
 def upload_to_oss(local_file_path: str) -> str:
     """
@@ -20,51 +153,201 @@ def upload_to_oss(local_file_path: str) -> str:
     Raises:
         Exception: 如果上传失败
     """
-    logger = logging.getLogger('OSS_Uploader')
-    
-    # 从配置中获取OSS信息
-    access_key_id = config.access_key_id
-    access_key_secret = config.access_key_secret
-    bucket_name = config.oss_bucket
-    region = config.region
-    
-    if not all([access_key_id, access_key_secret, bucket_name, region]):
-        raise ValueError("OSS配置不完整 (AK, SK, Bucket, Region都需要)")
-
-    # OSS endpoint 通常是 oss-cn-beijing.aliyuncs.com 格式
-    endpoint = f'oss-{region}.aliyuncs.com'
-    
-    # 创建Bucket实例
-    auth = oss2.Auth(access_key_id, access_key_secret)
-    bucket = oss2.Bucket(auth, endpoint, bucket_name)
-    
-    # 定义上传后的对象名
-    object_name = os.path.basename(local_file_path)
-    
-    logger.info(f"准备上传文件 '{local_file_path}' 到OSS Bucket '{bucket_name}'...")
-    
     try:
-        # 执行上传
-        result = bucket.put_object_from_file(object_name, local_file_path)
-        
-        if result.status != 200:
-            raise Exception(f"上传失败，HTTP状态码: {result.status}")
-            
-        # 构建文件URL
-        # 注意：这里的URL格式需要根据你的Bucket权限设置（公开/私有）
-        # 这里我们构建一个标准的https地址
-        file_url = f"https://{bucket_name}.{endpoint}/{object_name}"
-        
-        logger.info(f"文件上传成功！URL: {file_url}")
-        return file_url
-
+        return get_uploader().upload(local_file_path)
     except oss2.exceptions.OssError as e:
-        logger.error(f"上传到OSS时发生错误: {e}")
+        logging.getLogger('OSS_Uploader').error(f"上传到OSS时发生错误: {e}")
         raise
     except Exception as e:
-        logger.error(f"上传过程中发生未知错误: {e}")
+        logging.getLogger('OSS_Uploader').error(f"上传过程中发生未知错误: {e}")
         raise
 
+@functools.lru_cache(maxsize=256)
+def _cached_file_hash(path: str, size: int, mtime_ns: int) -> str:
+    return hash_file(path)
+
+def source_file_hash(file_path: str) -> str:
+    """文件内容的 SHA-256，按路径、大小和修改时间缓存，长音频的各个分段只计算一次"""
+    stat = os.stat(file_path)
+    return _cached_file_hash(os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+def transcode_for_upload(input_path: str, output_path: str, sample_rate: int, bitrate: str,
+                         start: Optional[float] = None, duration: Optional[float] = None) -> str:
+    """
+    使用 ffmpeg 提取音轨并编码为单声道 MP3
+
+    使用 bitexact 并去掉元数据，相同输入每次得到完全相同的文件，上传时可按内容哈希去重。
+    指定 start/duration（秒）时只截取其中一段。
+
+    Raises:
+        RuntimeError: 如果 ffmpeg 执行失败
+    """
+    cmd = ['ffmpeg', '-nostdin', '-v', 'error', '-y']
+    if start is not None:
+        cmd += ['-ss', f'{start:.3f}']
+    if duration is not None:
+        cmd += ['-t', f'{duration:.3f}']
+    cmd += [
+        '-i', input_path,
+        '-vn', '-map_metadata', '-1',
+        '-ac', '1', '-ar', str(sample_rate),
+        '-c:a', 'libmp3lame', '-b:a', bitrate,
+        '-fflags', '+bitexact', '-flags:a', '+bitexact',
+        output_path
+    ]
+    with instrumentation.span('transcode', file=input_path):
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        except OSError as e:
+            raise RuntimeError(f"无法执行 ffmpeg: {e}")
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg 转码失败: {result.stderr.strip()}")
+    return output_path
+
+def prepare_upload_file(local_file_path: str, work_dir: str) -> str:
+    """
+    返回实际需要上传的文件路径
+
+    视频和无损音频按配置的采样率转码为单声道 MP3 保存到 work_dir，上传字节数通常能减少几个数量级；
+    其他格式或转码失败时直接上传原文件。
+    """
+    upload_config = config.oss_upload_config
+    extension = os.path.splitext(local_file_path)[1].lower()
+    if not upload_config['transcode'] or extension not in upload_config['transcode_extensions']:
+        return local_file_path
+
+    logger = logging.getLogger('OSS_Uploader')
+    output_path = os.path.join(work_dir, os.path.splitext(os.path.basename(local_file_path))[0] + '.mp3')
+    sample_rate = config.file_recognition_config['sample_rate']
+    try:
+        transcode_for_upload(local_file_path, output_path, sample_rate, upload_config['transcode_bitrate'])
+    except RuntimeError as e:
+        logger.warning(f"转码失败，直接上传原文件: {e}")
+        return local_file_path
+
+    original_size = os.path.getsize(local_file_path)
+    upload_size = os.path.getsize(output_path)
+    logger.info(f"已转码为 {sample_rate} Hz 单声道 MP3: {original_size / 1e6:.1f} MB -> {upload_size / 1e6:.1f} MB")
+    return output_path
+
+def upload_media(local_file_path: str, start: Optional[float] = None, duration: Optional[float] = None) -> str:
+    """
+    上传待识别的媒体文件（或其中一段），返回 OSS URL
+
+    需要转码时，对象名由源文件哈希和转码参数决定，先用 HEAD 检查对象是否已存在，
+    已存在时跳过转码和上传；不需要转码的文件直接按内容哈希上传。
+    指定 start/duration（秒）时截取其中一段转码，转码失败时抛出异常。
+
+    Raises:
+        Exception: 如果转码或上传失败
+    """
+    upload_config = config.oss_upload_config
+    extension = os.path.splitext(local_file_path)[1].lower()
+    clip = start is not None or duration is not None
+    if not clip and (not upload_config['transcode'] or extension not in upload_config['transcode_extensions']):
+        return upload_to_oss(local_file_path)
+
+    uploader = get_uploader()
+    sample_rate = config.file_recognition_config['sample_rate']
+    settings = {
+        'sample_rate': sample_rate,
+        'bitrate': upload_config['transcode_bitrate'],
+        # 与传给 ffmpeg 的参数精度一致
+        'start': None if start is None else f'{start:.3f}',
+        'duration': None if duration is None else f'{duration:.3f}',
+    }
+    object_key = uploader.transcoded_object_key(local_file_path, settings)
+    if uploader.exists(object_key):
+        uploader.logger.info(f"OSS中已存在该文件的转码结果，跳过转码和上传: {object_key}")
+        return uploader.object_url(object_key)
+
+    with tempfile.TemporaryDirectory(prefix='aliyun-upload-') as work_dir:
+        if clip:
+            upload_path = transcode_for_upload(
+                local_file_path, os.path.join(work_dir, 'clip.mp3'), sample_rate,
+                upload_config['transcode_bitrate'], start=start, duration=duration
+            )
+        else:
+            upload_path = prepare_upload_file(local_file_path, work_dir)
+        if upload_path == local_file_path:
+            # 转码失败，按原文件内容上传
+            return upload_to_oss(local_file_path)
+        return uploader.upload(upload_path, object_key=object_key, check_exists=False)
+
+def detect_silences(file_path: str, noise_db: float, min_silence: float) -> List[Tuple[float, float]]:
+    """
+    使用 ffmpeg silencedetect 查找静音区间
+
+    Args:
+        file_path (str): 媒体文件路径
+        noise_db (float): 低于该电平（dB）视为静音
+        min_silence (float): 最短静音时长（秒）
+
+    Returns:
+        list: 按时间排序的 (开始, 结束) 秒数；ffmpeg 不可用时返回空列表
+    """
+    cmd = [
+        'ffmpeg', '-nostdin', '-hide_banner', '-vn',
+        '-i', file_path,
+        '-af', f'silencedetect=noise={noise_db}dB:d={min_silence}',
+        '-f', 'null', '-'
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        logging.getLogger('AudioInfo').warning(f"无法执行 ffmpeg 静音检测: {e}")
+        return []
+
+    silences = []
+    silence_start = None
+    for line in result.stderr.splitlines():
+        if 'silence_start:' in line:
+            silence_start = float(line.split('silence_start:')[1].split()[0])
+        elif 'silence_end:' in line and silence_start is not None:
+            silences.append((silence_start, float(line.split('silence_end:')[1].split()[0])))
+            silence_start = None
+    return silences
+
+def plan_chunks(duration: float, silences: List[Tuple[float, float]], chunk_seconds: float,
+                overlap: float) -> List[Tuple[float, float, float, float]]:
+    """
+    在静音处规划长音频的切分
+
+    每个切点取目标位置（每 chunk_seconds 秒）前后 10% 范围内最接近的静音中点，
+    找不到静音时直接在目标位置切分。相邻分段互相重叠 overlap 秒。
+
+    Returns:
+        list: 每段 (截取开始, 截取结束, 归属开始, 归属结束)。归属区间互不重叠且覆盖整段音频，
+            合并结果时用于去掉重叠部分的重复内容
+    """
+    window = chunk_seconds * 0.1
+    midpoints = [(start + end) / 2 for start, end in silences]
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds + window:
+        target = cuts[-1] + chunk_seconds
+        candidates = [m for m in midpoints if abs(m - target) <= window]
+        cuts.append(min(candidates, key=lambda m: abs(m - target)) if candidates else target)
+    cuts.append(duration)
+
+    return [
+        (max(0.0, core_start - overlap), min(duration, core_end + overlap), core_start, core_end)
+        for core_start, core_end in zip(cuts, cuts[1:])
+    ]
+
+def get_media_duration(file_path: str) -> Optional[float]:
+    """使用 ffprobe 获取媒体文件时长（秒），失败时返回 None"""
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=duration',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        file_path
+    ]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return float(result.stdout.split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+
 def get_audio_info(file_path: str) -> Optional[dict]:
     """
     使用pydub获取音频文件的基本信息
@@ -85,3 +368,45 @@ def get_audio_info(file_path: str) -> Optional[dict]:
     except Exception as e:
         logging.getLogger('AudioInfo').error(f"获取音频信息失败: {e}")
         return None
+
+# 支持识别的媒体文件扩展名（音频和视频）
+SUPPORTED_EXTENSIONS = (
+    '.wav', '.mp3', '.aac', '.m4a', '.wma', '.flac', '.pcm',
+    '.mp4', '.mov', '.mkv', '.avi', '.flv',
+)
+
+# 各识别模式的单价（元/小时）；一句话识别按次计费，这里按实时识别的价格粗略估算
+PRICE_PER_HOUR = {
+    'file': 2.50,
+    'realtime': 3.50,
+    'sentence': 3.50,
+}
+
+def validate_audio_file(file_path: str) -> Tuple[bool, str]:
+    """检查文件是否存在且为支持的格式，返回 (是否有效, 说明)"""
+    if not os.path.isfile(file_path):
+        return False, f"文件不存在: {file_path}"
+    ext = os.path.splitext(file_path)[1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        return False, f"不支持的文件格式: {ext or '无扩展名'}"
+    return True, '文件验证通过'
+
+def format_duration(seconds: float) -> str:
+    """将秒数格式化为“1小时1分1.0秒”的形式"""
+    hours, rest = divmod(float(seconds), 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{int(hours)}小时{int(minutes)}分{secs:.1f}秒"
+    if minutes:
+        return f"{int(minutes)}分{secs:.1f}秒"
+    return f"{secs:.1f}秒"
+
+def estimate_cost(duration_seconds: float, service_type: str = 'file') -> dict:
+    """按时长估算识别费用"""
+    duration_hours = duration_seconds / 3600
+    return {
+        'duration_hours': duration_hours,
+        'service_type': service_type,
+        'estimated_cost': round(duration_hours * PRICE_PER_HOUR.get(service_type, PRICE_PER_HOUR['file']), 4),
+        'currency': 'CNY',
+    }
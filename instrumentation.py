@@ -0,0 +1,136 @@
+"""
+阶段耗时与资源统计模块
+
+用 span 包住处理流程中的各个阶段（音频提取、转录、节拍检测、上传、轮询、写文件等），
+记录墙钟时间、CPU 时间、内存和对应的音频时长，最后输出按阶段汇总的 JSON 报告，
+其中包含各阶段的实时率（RTF = 墙钟时间 / 音频时长）。Whisper 与阿里云两个后端共用。
+
+内存取自 ru_maxrss，只能得到进程启动以来的最高值，无法得到某个阶段内的峰值：peak_rss_mb 是阶段结束时
+进程迄今为止的峰值常驻内存，rss_growth_mb 是该阶段把这个峰值抬高了多少。某阶段之前已有更耗内存的阶段时，
+它的 rss_growth_mb 为 0，并不表示它没有占用内存。
+"""
+import os
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+def peak_rss_mb() -> float:
+    """当前进程迄今为止的峰值常驻内存（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+class Instrumentation:
+    """收集各阶段的 span 记录并生成汇总报告"""
+
+    def __init__(self):
+        self.spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, audio_duration: Optional[float] = None, **attrs):
+        """
+        记录一个阶段的耗时与资源占用
+
+        Args:
+            stage (str): 阶段名称
+            audio_duration (float): 该阶段处理的音频时长（秒），未知时可在 with 块内
+                通过 record["audio_duration"] 补充
+            **attrs: 附加信息（如文件路径）
+
+        Yields:
+            dict: 本次 span 的记录，结束时写入 wall_seconds、cpu_seconds、peak_rss_mb 和 rss_growth_mb
+
+        注意 CPU 时间取自整个进程，多个阶段并发执行时会重复计入。
+        """
+        record = {"stage": stage, "audio_duration": audio_duration, "pid": os.getpid(), **attrs}
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        rss_start = peak_rss_mb()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            record["peak_rss_mb"] = peak_rss_mb()
+            record["rss_growth_mb"] = record["peak_rss_mb"] - rss_start
+            with self._lock:
+                self.spans.append(record)
+
+    def record(self, stage: str, wall_seconds: float, audio_duration: Optional[float] = None, **attrs) -> None:
+        """
+        直接记录一个已知耗时的阶段（如等待配额、首条字幕延迟），字段与 span 相同
+
+        这类阶段只是等待，不计 CPU 时间和内存增长。
+        """
+        record = {"stage": stage, "audio_duration": audio_duration, "pid": os.getpid(), **attrs,
+                  "wall_seconds": wall_seconds, "cpu_seconds": 0.0, "peak_rss_mb": peak_rss_mb(),
+                  "rss_growth_mb": 0.0}
+        with self._lock:
+            self.spans.append(record)
+
+    def drain(self) -> List[Dict[str, Any]]:
+        """取出并清空已记录的 span，用于把子进程中的记录传回主进程"""
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def extend(self, spans: List[Dict[str, Any]]) -> None:
+        """合并其他进程传回的 span 记录"""
+        with self._lock:
+            self.spans.extend(spans)
+
+    def report(self) -> Dict[str, Any]:
+        """按阶段汇总，返回报告字典"""
+        stages: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            spans = list(self.spans)
+
+        for record in spans:
+            stage = stages.setdefault(record["stage"], {
+                "count": 0,
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "audio_seconds": 0.0,
+                "peak_rss_mb": 0.0,
+                "rss_growth_mb": 0.0,
+            })
+            stage["count"] += 1
+            stage["wall_seconds"] += record["wall_seconds"]
+            stage["cpu_seconds"] += record["cpu_seconds"]
+            stage["audio_seconds"] += record.get("audio_duration") or 0.0
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], record["peak_rss_mb"])
+            stage["rss_growth_mb"] = max(stage["rss_growth_mb"], record.get("rss_growth_mb", 0.0))
+
+        for stage in stages.values():
+            # 实时率：处理 1 秒音频所需的墙钟秒数
+            stage["real_time_factor"] = (
+                stage["wall_seconds"] / stage["audio_seconds"] if stage["audio_seconds"] else None
+            )
+
+        return {
+            "generated_at": datetime.now().isoformat(),
+            "stages": stages,
+            "spans": spans,
+        }
+
+    def save_report(self, output_path: str) -> None:
+        """将报告保存为 JSON 文件"""
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+# 全局实例
+instrumentation = Instrumentation()
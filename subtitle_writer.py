@@ -0,0 +1,347 @@
+"""
+流式字幕写出模块
+
+分段只遍历一次，每个分段依次交给所有请求的输出格式（sink），各格式直接写入带缓冲的文件，
+不在内存中拼接整篇文档，内存占用与转录长度无关。Whisper 与阿里云两个后端共用，
+时间戳格式、文件头尾等差异由各自创建 sink 时传入。
+分段按块处理，每块的时间戳交给批量格式化函数一次完成，不再逐个调用标量格式化。
+sink 读取的是 Transcript（见 transcript.py）；传入分段列表时逐块转换，不整体转换。
+"""
+import io
+import os
+import json
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, TextIO, Union
+
+from transcript import Transcript
+
+# 输出文件的写缓冲大小（字节）
+BUFFER_SIZE = 1 << 16
+# 每块的分段数：块内的时间戳一次批量格式化，内存占用仍与转录长度无关
+BLOCK_SIZE = 2048
+
+Segment = Dict[str, Any]
+# Transcript，或任一后端的分段列表（也可以是只能遍历一次的迭代器）
+Segments = Union[Transcript, Iterable[Segment]]
+# 批量格式化时间戳：秒数序列 -> 同样长度的字符串列表（见 timestamps.py）
+Timestamps = Callable[[Sequence[float]], List[str]]
+SinkFactory = Callable[[TextIO], "SubtitleSink"]
+
+
+class SubtitleSink:
+    """一种输出格式：写文件头，按块写出分段，最后写文件尾"""
+
+    def __init__(self, f: TextIO, header: str = "", footer: str = "", skip_empty: bool = True):
+        """
+        Args:
+            f: 输出文件
+            header (str): 文件头
+            footer (str): 文件尾
+            skip_empty (bool): 是否跳过文本为空的分段
+        """
+        self.f = f
+        self.header = header
+        self.footer = footer
+        self.skip_empty = skip_empty
+
+    def begin(self) -> None:
+        if self.header:
+            self.f.write(self.header)
+
+    def block(self, first_index: int, transcript: Transcript) -> None:
+        """
+        写出一块连续的分段，时间戳按块批量格式化
+
+        Args:
+            first_index (int): 块内第一个分段在全部分段中的序号（从 1 开始，跳过的分段也计数）
+            transcript (Transcript): 本块的分段
+        """
+        raise NotImplementedError
+
+    def end(self) -> None:
+        if self.footer:
+            self.f.write(self.footer)
+
+    def _kept(self, texts: List[str]) -> List[int]:
+        """块内需要写出的分段下标"""
+        if not self.skip_empty:
+            return list(range(len(texts)))
+        return [offset for offset, text in enumerate(texts) if text]
+
+
+class CueSink(SubtitleSink):
+    """带序号和起止时间的字幕块（SRT、VTT）"""
+
+    def __init__(self, f: TextIO, timestamps: Timestamps, **kwargs):
+        super().__init__(f, **kwargs)
+        self.timestamps = timestamps
+
+    def block(self, first_index, transcript):
+        texts = [text.strip() for text in transcript.texts()]
+        kept = self._kept(texts)
+        starts, ends = transcript.starts, transcript.ends
+        # 开始和结束时间合并成一次批量格式化
+        stamps = self.timestamps([starts[offset] for offset in kept] + [ends[offset] for offset in kept])
+        count = len(kept)
+        self.f.write("".join(
+            f"{first_index + offset}\n{stamps[position]} --> {stamps[count + position]}\n{texts[offset]}\n\n"
+            for position, offset in enumerate(kept)
+        ))
+
+
+class LineSink(SubtitleSink):
+    """每个分段一行：前缀（通常为开始时间）+ 文本 + 后缀（LRC、SMI、TXT）"""
+
+    def __init__(self, f: TextIO, prefix: Optional[Timestamps] = None, suffix: str = "", **kwargs):
+        super().__init__(f, **kwargs)
+        self.prefix = prefix
+        self.suffix = suffix
+
+    def block(self, first_index, transcript):
+        texts = [text.strip() for text in transcript.texts()]
+        kept = self._kept(texts)
+        if self.prefix is not None:
+            starts = transcript.starts
+            prefixes = self.prefix([starts[offset] for offset in kept])
+        else:
+            prefixes = [""] * len(kept)
+        self.f.write("".join(
+            f"{prefix}{texts[offset]}{self.suffix}\n" for prefix, offset in zip(prefixes, kept)
+        ))
+
+
+class WordCueSink(SubtitleSink):
+    """
+    逐字字幕块：每个分段的词按 group_size 个一组，每组一个字幕块，序号连续编号
+
+    块的结束时间取组内末词的结束时间。末词缺少结束时间时按它自己的开始时间 + 1 秒补齐（见 Transcript），
+    不再像原来的 generate_word_level_srt 那样取首词开始时间 + 1 秒，避免结束早于末词出现。
+    """
+
+    def __init__(self, f: TextIO, timestamps: Timestamps, group_size: int = 4, **kwargs):
+        super().__init__(f, **kwargs)
+        self.timestamps = timestamps
+        self.group_size = group_size
+        self.count = 0
+
+    def block(self, first_index, transcript):
+        word_texts = transcript.word_texts()
+        offsets = transcript.word_offsets
+        group_starts, group_ends, group_texts = [], [], []
+        for index in range(len(transcript)):
+            first, stop = offsets[index], offsets[index + 1]
+            for group_first in range(first, stop, self.group_size):
+                group_stop = min(group_first + self.group_size, stop)
+                group_starts.append(transcript.word_starts[group_first])
+                group_ends.append(transcript.word_ends[group_stop - 1])
+                group_texts.append("".join(word_texts[group_first:group_stop]))
+        stamps = self.timestamps(group_starts + group_ends)
+        count = len(group_texts)
+        self.f.write("".join(
+            f"{self.count + position + 1}\n{stamps[position]} --> {stamps[count + position]}\n{text}\n\n"
+            for position, text in enumerate(group_texts)
+        ))
+        self.count += count
+
+
+class WordLineSink(SubtitleSink):
+    """逐字歌词：每个词一行，前缀为词的开始时间"""
+
+    def __init__(self, f: TextIO, prefix: Timestamps, **kwargs):
+        super().__init__(f, **kwargs)
+        self.prefix = prefix
+
+    def block(self, first_index, transcript):
+        word_starts, word_texts = [], []
+        for start, text in zip(transcript.word_starts, transcript.word_texts()):
+            text = text.strip()
+            if text:
+                word_starts.append(start)
+                word_texts.append(text)
+        prefixes = self.prefix(word_starts)
+        self.f.write("".join(f"{prefix}{text}\n" for prefix, text in zip(prefixes, word_texts)))
+
+
+class JsonSink(SubtitleSink):
+    """
+    JSON 文档 {"segments": [...], "metadata": {...}}
+
+    分段按块编码并直接写出，不在内存中构造整个文档。Transcript 保留了原始分段且字段命名与 style 一致时
+    原样写出原始分段（字段顺序、整数时间和额外字段都不变），否则按块还原为 dict。metadata 写在最后，
+    分段总数和总时长在写出分段的同时累计，不再额外遍历一遍。indent 为 None 时输出紧凑格式，
+    否则与 json.dumps(文档, indent=indent) 的结果相同。
+    """
+
+    def __init__(self, f: TextIO, metadata: Optional[Callable[[int, float], Dict[str, Any]]] = None,
+                 indent: Optional[int] = None, style: str = "aliyun", **kwargs):
+        """
+        Args:
+            f: 输出文件
+            metadata: 由 (分段总数, 总时长) 生成 metadata 的函数，为 None 时不写 metadata
+            indent (int): 缩进空格数，None 表示紧凑格式
+            style (str): 分段的字段命名，见 Transcript.to_segments
+        """
+        super().__init__(f, skip_empty=False, **kwargs)
+        self.metadata = metadata
+        self.indent = indent
+        self.style = style
+        self.count = 0
+        self.duration = None
+        # 原始分段中的结束时间字段名
+        self.end_key = "end" if style == "whisper" else "end_time"
+
+    def _dumps(self, value: Any) -> str:
+        if self.indent is None:
+            return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        return json.dumps(value, ensure_ascii=False, indent=self.indent)
+
+    def _newline(self, depth: int) -> str:
+        return "" if self.indent is None else "\n" + " " * (self.indent * depth)
+
+    def begin(self) -> None:
+        separator = ":" if self.indent is None else ": "
+        self.f.write(f'{{{self._newline(1)}"segments"{separator}[')
+
+    def _originals(self, transcript: Transcript) -> Optional[List[Segment]]:
+        """可以原样写出的原始分段，字段命名与 style 不一致时为 None"""
+        segments = transcript.segments
+        if segments is None:
+            return None
+        whisper = self.style == "whisper"
+        if any(("start" in segment or "end" in segment) != whisper for segment in segments):
+            return None
+        return segments
+
+    def block(self, first_index, transcript):
+        segments = self._originals(transcript)
+        if segments is not None:
+            # 与原来对分段列表取 max(end_time) 一致，缺少结束时间的分段按 0 计
+            duration = max(segment.get(self.end_key, 0) for segment in segments)
+        else:
+            segments = transcript.to_segments(self.style)
+            duration = max(transcript.ends)
+        # 整块编码为一个列表，去掉首尾的括号后缩进一层，拼接到文档中
+        encoded = self._dumps(segments)[1:-1]
+        if self.indent is not None:
+            encoded = encoded[:-1].replace("\n", self._newline(1))
+        self.f.write(("," if self.count else "") + encoded)
+        self.count += len(transcript)
+        # 相等时保留先出现的值，与对整个列表取 max 相同
+        self.duration = duration if self.duration is None else max(self.duration, duration)
+
+    def end(self) -> None:
+        self.f.write((self._newline(1) if self.count else "") + "]")
+        if self.metadata is not None:
+            separator = ":" if self.indent is None else ": "
+            duration = 0 if self.duration is None else self.duration
+            encoded = self._dumps(self.metadata(self.count, duration)).replace("\n", self._newline(1))
+            self.f.write(f',{self._newline(1)}"metadata"{separator}{encoded}')
+        self.f.write(self._newline(0) + "}")
+
+
+def _blocks(segments: Segments) -> Iterator[Transcript]:
+    """把分段按 BLOCK_SIZE 个一块切开；分段列表逐块转换为 Transcript，不整体转换"""
+    if isinstance(segments, Transcript):
+        for start in range(0, len(segments), BLOCK_SIZE):
+            yield segments.slice(start, start + BLOCK_SIZE)
+        return
+    iterator = iter(segments)
+    while True:
+        block = list(islice(iterator, BLOCK_SIZE))
+        if not block:
+            return
+        # 调用方本来就持有这些分段，保留引用不额外占内存，JSON 可原样写出
+        yield Transcript.from_segments(block, keep_segments=True)
+
+
+def write_segments(segments: Segments, sinks: List[SubtitleSink],
+                   on_error: Optional[Callable[[SubtitleSink, Exception], None]] = None) -> None:
+    """
+    遍历一次分段，每 BLOCK_SIZE 个分段为一块依次写入所有 sink
+
+    传入 on_error 时，某个 sink 出错只调用 on_error(sink, 异常) 并不再写入该 sink，其余 sink 继续写完；
+    否则直接抛出异常。
+    """
+    active = list(sinks)
+
+    def each(action: Callable[[SubtitleSink], None]) -> None:
+        for sink in list(active):
+            try:
+                action(sink)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                active.remove(sink)
+                on_error(sink, e)
+
+    each(lambda sink: sink.begin())
+    first_index = 1
+    for block in _blocks(segments):
+        each(lambda sink: sink.block(first_index, block))
+        first_index += len(block)
+    each(lambda sink: sink.end())
+
+
+def render(segments: Segments, factory: SinkFactory) -> str:
+    """用单个格式生成完整文本，供需要字符串结果的调用方使用"""
+    buffer = io.StringIO()
+    write_segments(segments, [factory(buffer)])
+    return buffer.getvalue()
+
+
+def write_files(segments: Segments, outputs: Dict[str, SinkFactory],
+                encoding: str = "utf-8") -> Dict[str, Exception]:
+    """
+    遍历一次分段，同时写出多个格式的文件
+
+    各文件互不影响：某个文件打开、写入或关闭失败时删除该文件，其余文件照常写完。
+    分段本身出错（所有文件都无法写完）时删除全部文件并抛出异常。
+
+    Args:
+        segments: Transcript 或分段列表（也可以是只能遍历一次的迭代器）
+        outputs (dict): {输出文件路径: sink 工厂}
+        encoding (str): 文件编码
+
+    Returns:
+        dict: {写出失败的文件路径: 异常}，全部成功时为空
+    """
+    failures: Dict[str, Exception] = {}
+    files: Dict[str, TextIO] = {}
+    sinks: Dict[SubtitleSink, str] = {}
+
+    def remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    try:
+        for path, factory in outputs.items():
+            try:
+                files[path] = open(path, "w", encoding=encoding, buffering=BUFFER_SIZE)
+                sinks[factory(files[path])] = path
+            except Exception as e:
+                failures[path] = e
+
+        def on_error(sink: SubtitleSink, error: Exception) -> None:
+            failures[sinks[sink]] = error
+
+        write_segments(segments, list(sinks), on_error)
+    except BaseException:
+        for path, f in files.items():
+            try:
+                f.close()
+            except Exception:
+                pass
+            remove(path)
+        raise
+
+    for path, f in files.items():
+        try:
+            f.close()
+        except Exception as e:
+            # 写缓冲在关闭时才落盘，磁盘写满等错误可能在这里出现
+            failures.setdefault(path, e)
+        if path in failures:
+            remove(path)
+    return failures
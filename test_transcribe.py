@@ -0,0 +1,834 @@
+#!/usr/bin/env python3
+"""
+Whisper 转录脚本测试
+
+whisper、torch 和 ffmpeg 均用替身代替，不需要下载模型或安装 ffmpeg。
+"""
+import io
+import os
+import json
+import sys
+import wave
+import tempfile
+import threading
+import time
+import unittest
+from contextlib import redirect_stdout
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+try:
+    import librosa
+except ImportError:  # 节拍检测的对比测试需要 librosa
+    librosa = None
+
+try:
+    import pyarrow
+except ImportError:  # 列式归档的测试需要 pyarrow
+    pyarrow = None
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import transcribe
+import transcribe_daemon
+from instrumentation import Instrumentation, instrumentation
+from transcript_cache import TranscriptCache
+
+
+class _InlinePool:
+    """在当前进程中执行任务的进程池替身，初始化函数只调用一次"""
+
+    def __init__(self, processes, initializer=None, initargs=()):
+        self.processes = processes
+        if initializer is not None:
+            initializer(*initargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        return map(func, iterable)
+
+    def map(self, func, iterable, chunksize=1):
+        return list(map(func, iterable))
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class _ChunkedReader(io.RawIOBase):
+    """管道替身：每次 readinto 最多返回 read_size 字节"""
+
+    def __init__(self, data: bytes, read_size: int = None):
+        self.data = memoryview(data)
+        self.position = 0
+        self.read_size = read_size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = len(buffer) if self.read_size is None else min(len(buffer), self.read_size)
+        chunk = self.data[self.position:self.position + size]
+        buffer[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+
+
+class _FakeFFmpeg:
+    """ffmpeg 进程替身，stdout 输出给定的 PCM 字节，并记录命令行"""
+
+    def __init__(self, pcm: bytes, returncode: int = 0, stderr: bytes = b'', read_size: int = None):
+        self.pcm = pcm
+        self.returncode = returncode
+        self.stderr = stderr
+        self.read_size = read_size
+        self.commands = []
+
+    def __call__(self, cmd, **kwargs):
+        self.commands.append(cmd)
+        return Mock(stdout=_ChunkedReader(self.pcm, self.read_size), stderr=io.BytesIO(self.stderr),
+                    wait=Mock(return_value=self.returncode))
+
+
+class TestParallelWorkers(unittest.TestCase):
+    """测试多进程批量模式"""
+
+    def setUp(self):
+        self.whisper = Mock()
+        self.torch = Mock()
+        self.modules = patch.dict(sys.modules, {'whisper': self.whisper, 'torch': self.torch})
+        self.modules.start()
+        self.addCleanup(self.modules.stop)
+        self.addCleanup(setattr, transcribe, '_worker_model', transcribe._worker_model)
+        instrumentation.drain()
+        self.addCleanup(instrumentation.drain)
+
+    def _fake_process(self, input_path, output_dir, model, **options):
+        with instrumentation.span('transcribe', file=input_path):
+            if input_path.startswith('bad'):
+                raise RuntimeError('解码失败')
+        return {}
+
+    def test_worker_loads_model_once(self):
+        """测试工作进程初始化时加载一次模型，之后的文件复用同一个模型"""
+        transcribe._init_worker('small', 3)
+        self.torch.set_num_threads.assert_called_once_with(3)
+        self.whisper.load_model.assert_called_once_with('small')
+
+        with patch.object(transcribe, 'process_single_file', side_effect=self._fake_process) as process:
+            first = transcribe._worker_process_file(('a.wav', 'out', {'save_audio': False}))
+            second = transcribe._worker_process_file(('bad.wav', 'out', {'save_audio': False}))
+
+        model = self.whisper.load_model.return_value
+        self.assertEqual([call.args[2] for call in process.call_args_list], [model, model])
+        self.assertEqual(process.call_args_list[0].kwargs, {'save_audio': False})
+        self.whisper.load_model.assert_called_once()
+
+        # 错误以字符串传回，各自的阶段统计随结果传回并从工作进程中清空
+        self.assertEqual(first[:2], ('a.wav', None))
+        self.assertEqual(second[:2], ('bad.wav', '解码失败'))
+        self.assertEqual([span['file'] for span in first[2]], ['a.wav'])
+        self.assertEqual([span['file'] for span in second[2]], ['bad.wav'])
+        self.assertEqual(instrumentation.spans, [])
+
+    def test_pool_uses_spawn_and_splits_threads(self):
+        """测试进程池使用 spawn 启动，torch 线程数按进程数平分，统计记录合并回主进程"""
+        context = Mock()
+        context.Pool.side_effect = _InlinePool
+        output = io.StringIO()
+        with patch.object(transcribe.multiprocessing, 'get_context', return_value=context) as get_context, \
+                patch.object(transcribe.os, 'cpu_count', return_value=8), \
+                patch.dict(os.environ), \
+                patch.object(transcribe, 'process_single_file', side_effect=self._fake_process) as process, \
+                redirect_stdout(output):
+            os.environ.pop('OMP_NUM_THREADS', None)
+            transcribe.process_files_parallel(['a.wav', 'bad.wav'], 'out', 'base', 4, save_audio=False)
+            self.assertEqual(os.environ['OMP_NUM_THREADS'], '4')
+
+        get_context.assert_called_once_with('spawn')
+        # 进程数不超过文件数
+        self.assertEqual(context.Pool.call_args.args, (2,))
+        self.assertEqual(context.Pool.call_args.kwargs['initargs'], ('base', 4))
+        self.torch.set_num_threads.assert_called_once_with(4)
+        for call in process.call_args_list:
+            self.assertEqual(call.kwargs, {'save_audio': False, 'model_name': 'base'})
+        self.assertIn('文件处理完成: a.wav', output.getvalue())
+        self.assertIn('处理文件时出错 bad.wav: 解码失败', output.getvalue())
+        self.assertEqual(sorted(span['file'] for span in instrumentation.spans), ['a.wav', 'bad.wav'])
+
+
+class TestSharedDecode(unittest.TestCase):
+    """测试每个文件只解码一次，16 kHz 音频同时用于转录和节拍检测"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.addCleanup(instrumentation.drain)
+
+    def test_extract_audio_pipes_16k_mono_pcm(self):
+        """测试 ffmpeg 输出 16 kHz 单声道 s16le，转换为 float32"""
+        samples = np.array([0, 16384, -32768, 32767, -1], dtype='<i2')
+        ffmpeg = _FakeFFmpeg(samples.tobytes())
+        with patch.object(transcribe.subprocess, 'Popen', side_effect=ffmpeg), \
+                patch.object(transcribe, 'probe_duration', return_value=1.0), redirect_stdout(io.StringIO()):
+            audio = transcribe.extract_audio('talk.mp4')
+
+        cmd = ffmpeg.commands[0]
+        self.assertEqual(cmd[cmd.index('-ar') + 1], '16000')
+        self.assertEqual(cmd[cmd.index('-ac') + 1], '1')
+        self.assertEqual(cmd[cmd.index('-f') + 1], 's16le')
+        self.assertEqual(cmd[-1], '-')
+        self.assertEqual(audio.dtype, np.float32)
+        np.testing.assert_array_equal(audio, samples / np.float32(32768.0))
+
+    def _process(self, input_path, native_beat_rate=False):
+        audio = np.full(transcribe.SAMPLE_RATE, 0.25, dtype=np.float32)
+        model = Mock()
+        model.transcribe.return_value = {'segments': [{'start': 0.0, 'end': 1.0, 'text': ' 你好'}]}
+        with patch.object(transcribe, 'extract_audio', return_value=audio) as extract, \
+                patch.object(transcribe, 'detect_beats', return_value=[0.5]) as beats, \
+                patch.object(transcribe, 'detect_beats_from_file', return_value=[0.5]) as beats_from_file, \
+                redirect_stdout(io.StringIO()):
+            outputs = transcribe.process_single_file(input_path, self.temp_dir.name, model,
+                                                     native_beat_rate=native_beat_rate)
+        return audio, model, extract, beats, beats_from_file, outputs
+
+    def test_decode_once_and_share_buffer(self):
+        """测试解码结果直接传给 Whisper 和节拍检测，视频的 .wav 由同一份数据写出"""
+        audio, model, extract, beats, beats_from_file, outputs = self._process('talk.mp4')
+
+        extract.assert_called_once_with('talk.mp4')
+        self.assertIs(model.transcribe.call_args.args[0], audio)
+        self.assertIs(beats.call_args.args[0], audio)
+        self.assertEqual(beats.call_args.args[1], transcribe.SAMPLE_RATE)
+        beats_from_file.assert_not_called()
+
+        with wave.open(outputs['.wav'], 'rb') as f:
+            self.assertEqual((f.getnchannels(), f.getframerate(), f.getnframes()),
+                             (1, transcribe.SAMPLE_RATE, len(audio)))
+            saved = np.frombuffer(f.readframes(len(audio)), dtype='<i2')
+        np.testing.assert_array_equal(saved, np.full(len(audio), int(0.25 * 32768), dtype='<i2'))
+
+    def test_native_beat_rate(self):
+        """测试 native_beat_rate 时节拍检测按原始采样率另行解码，且不超过 22050 Hz"""
+        _, _, extract, beats, beats_from_file, outputs = self._process('song.flac', native_beat_rate=True)
+        extract.assert_called_once_with('song.flac')
+        beats.assert_not_called()
+        beats_from_file.assert_called_once_with('song.flac')
+        # 音频文件不另存 .wav
+        self.assertNotIn('.wav', outputs)
+
+        for native_rate, analysis_rate in [(44100, 22050), (8000, 8000)]:
+            with patch.object(transcribe, 'probe_sample_rate', return_value=native_rate), \
+                    patch.object(transcribe, 'iter_audio_blocks', return_value=iter(())) as blocks, \
+                    patch.object(transcribe, 'onset_envelope_stream', return_value=np.zeros(0)), \
+                    patch.object(transcribe, '_beats_from_envelope', return_value=[]):
+                transcribe.detect_beats_from_file('song.flac')
+            blocks.assert_called_once_with('song.flac', analysis_rate)
+
+
+class TestExtractAudioBuffer(unittest.TestCase):
+    """测试从 ffmpeg 管道读入预分配数组"""
+
+    def _extract(self, samples, duration, read_size=None, returncode=0, stderr=b''):
+        ffmpeg = _FakeFFmpeg(samples.tobytes(), returncode, stderr, read_size)
+        with patch.object(transcribe.subprocess, 'Popen', side_effect=ffmpeg), \
+                patch.object(transcribe, 'probe_duration', return_value=duration), \
+                patch.object(transcribe, '_PIPE_READ_SIZE', 4096), redirect_stdout(io.StringIO()):
+            return transcribe.extract_audio('talk.mp4')
+
+    def _samples(self, count):
+        return np.random.default_rng(0).integers(-32768, 32768, count).astype('<i2')
+
+    def test_grow_when_duration_underestimated(self):
+        """测试时长估计偏短时按倍数扩容，管道分多次短读也不丢数据"""
+        samples = self._samples(100000)
+        audio = self._extract(samples, duration=0.01, read_size=1000)
+        np.testing.assert_array_equal(audio, samples / np.float32(32768.0))
+
+    def test_unknown_duration(self):
+        """测试无法获取时长时从初始缓冲区开始扩容"""
+        samples = self._samples(50000)
+        with patch.object(transcribe, '_INITIAL_BUFFER_SECONDS', 1):
+            audio = self._extract(samples, duration=0.0)
+        np.testing.assert_array_equal(audio, samples / np.float32(32768.0))
+
+    def test_truncate_to_decoded_length(self):
+        """测试时长估计偏长时结果截断到实际解码的样本数"""
+        samples = self._samples(1000)
+        audio = self._extract(samples, duration=10.0)
+        self.assertEqual(len(audio), 1000)
+        np.testing.assert_array_equal(audio, samples / np.float32(32768.0))
+
+    def test_ffmpeg_error(self):
+        """测试 ffmpeg 失败时抛出包含错误输出的异常"""
+        with self.assertRaises(RuntimeError) as context:
+            self._extract(self._samples(10), duration=1.0, returncode=1, stderr=b'Invalid data found')
+        self.assertIn('Invalid data found', str(context.exception))
+
+    def test_save_wav_async(self):
+        """测试后台线程写出 16 位 PCM WAV，超出范围的样本被截断"""
+        audio = np.array([0.0, 0.5, -0.5, 1.5, -1.5], dtype=np.float32)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'talk.wav')
+            transcribe.save_wav_async(audio, path).join()
+            with wave.open(path, 'rb') as f:
+                self.assertEqual((f.getsampwidth(), f.getframerate()), (2, transcribe.SAMPLE_RATE))
+                saved = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+        np.testing.assert_array_equal(saved, [0, 16384, -16384, 32767, -32768])
+
+    def test_save_wav_round_trip(self):
+        """测试 extract_audio 解码得到的样本保存后与 ffmpeg 输出完全一致"""
+        samples = np.array([1, 1000, 32767, -32768, -1, 0], dtype='<i2')
+        audio = self._extract(samples, duration=1.0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'talk.wav')
+            transcribe.save_wav(audio, path)
+            with wave.open(path, 'rb') as f:
+                saved = np.frombuffer(f.readframes(f.getnframes()), dtype='<i2')
+        np.testing.assert_array_equal(saved, samples)
+
+
+class TestLongFileChunking(unittest.TestCase):
+    """测试长音频在静音处切分、并行转录后拼接"""
+
+    def _speech_with_pauses(self, seconds, pauses):
+        """生成带噪声的"语音"，pauses 为 [(开始秒, 结束秒), ...] 的静音区间"""
+        sr = transcribe.SAMPLE_RATE
+        audio = np.random.default_rng(1).normal(0, 0.1, int(seconds * sr)).astype(np.float32)
+        for start, end in pauses:
+            audio[int(start * sr):int(end * sr)] = 0
+        return audio
+
+    def _assert_covering(self, bounds, length, max_chunk_seconds):
+        self.assertEqual(bounds[0][0], 0)
+        self.assertEqual(bounds[-1][1], length)
+        for (_, end), (start, _) in zip(bounds, bounds[1:]):
+            self.assertEqual(end, start)
+        for start, end in bounds:
+            self.assertGreater(end, start)
+            self.assertLessEqual(end - start, max_chunk_seconds * transcribe.SAMPLE_RATE)
+
+    def test_cut_in_silence(self):
+        """测试切分点落在静音区间内，片段首尾相接覆盖整段音频且不超过最大时长"""
+        pauses = [(7.0, 7.6), (16.0, 16.8), (24.0, 24.5)]
+        audio = self._speech_with_pauses(30, pauses)
+        bounds = transcribe.split_on_silence(audio, 10)
+        self._assert_covering(bounds, len(audio), 10)
+        for _, end in bounds[:-1]:
+            cut = end / transcribe.SAMPLE_RATE
+            self.assertTrue(any(start <= cut <= stop for start, stop in pauses), cut)
+
+    def test_max_chunk_length(self):
+        """测试没有静音或全是静音时按最大时长切分，不足一帧的尾部也计入最后一个片段"""
+        for audio in (self._speech_with_pauses(25, []), np.zeros(25 * transcribe.SAMPLE_RATE + 479, np.float32)):
+            for max_chunk_seconds in (1.0, 3.33, 10):
+                bounds = transcribe.split_on_silence(audio, max_chunk_seconds)
+                self._assert_covering(bounds, len(audio), max_chunk_seconds)
+
+        short = self._speech_with_pauses(5, [])
+        self.assertEqual(transcribe.split_on_silence(short, 5), [(0, len(short))])
+
+    def test_reject_short_chunks(self):
+        """测试过短的片段时长被拒绝，不会陷入死循环"""
+        audio = np.zeros(transcribe.SAMPLE_RATE * 2, np.float32)
+        for max_chunk_seconds in (0, -1, 0.05):
+            with self.assertRaises(ValueError):
+                transcribe.split_on_silence(audio, max_chunk_seconds)
+        with redirect_stdout(io.StringIO()), patch('sys.stderr', io.StringIO()):
+            for value in ('0', '0.5', 'nan', 'abc'):
+                with self.assertRaises(SystemExit):
+                    transcribe.parse_args(['--chunk-seconds', value, 'a.mp4'])
+        self.assertEqual(transcribe.parse_args(['--chunk-seconds', '1.5', 'a.mp4']).chunk_seconds, 1.5)
+
+    def test_stitch_segments(self):
+        """测试各片段的分段和词加上片段偏移后重新编号，原分段不被修改"""
+        first = [{'id': 0, 'start': 0.0, 'end': 1.0, 'text': ' a',
+                  'words': [{'word': ' a', 'start': 0.2, 'end': 0.8}]}]
+        second = [{'id': 0, 'start': 0.5, 'end': 2.0, 'text': ' b'},
+                  {'id': 1, 'start': 2.0, 'end': 3.0, 'text': ' c', 'words': []}]
+        stitched = transcribe.stitch_segments([first, second], [0.0, 9.5])
+
+        self.assertEqual([(s['id'], s['start'], s['end'], s['text']) for s in stitched],
+                         [(0, 0.0, 1.0, ' a'), (1, 10.0, 11.5, ' b'), (2, 11.5, 12.5, ' c')])
+        self.assertEqual(stitched[0]['words'], [{'word': ' a', 'start': 0.2, 'end': 0.8}])
+        self.assertEqual(second[0]['start'], 0.5)
+        self.assertEqual(second[1]['id'], 1)
+
+    def test_transcribe_in_chunks(self):
+        """测试各片段交给进程池转录，结果按片段起始时间拼接"""
+        sr = transcribe.SAMPLE_RATE
+        audio = self._speech_with_pauses(25, [(9.0, 9.6), (18.0, 18.6)])
+        model = Mock()
+        model.transcribe.side_effect = lambda chunk: {
+            'segments': [{'start': 0.0, 'end': len(chunk) / sr, 'text': ' x'}]
+        }
+        self.addCleanup(setattr, transcribe, '_worker_model', transcribe._worker_model)
+        transcribe._worker_model = model
+        with redirect_stdout(io.StringIO()):
+            segments = transcribe.transcribe_in_chunks(audio, _InlinePool(2), 10)
+
+        bounds = transcribe.split_on_silence(audio, 10)
+        self.assertEqual(model.transcribe.call_count, len(bounds))
+        self.assertEqual([(s['start'], s['end']) for s in segments],
+                         [(start / sr, end / sr) for start, end in bounds])
+
+
+class TestWhisperCache(unittest.TestCase):
+    """测试 Whisper 转录结果缓存"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.addCleanup(instrumentation.drain)
+        self.cache = TranscriptCache(self.temp_dir.name)
+        self.model = Mock()
+        self.model.transcribe.return_value = {'segments': [{'id': 0, 'start': 0.0, 'end': 1.0, 'text': ' 你好'}]}
+
+    def _transcribe(self, audio, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            return transcribe.transcribe_audio(audio, self.model, cache=self.cache, **kwargs)
+
+    def test_hit_skips_whisper(self):
+        """测试相同音频和模型第二次直接命中缓存"""
+        audio = np.linspace(-0.5, 0.5, transcribe.SAMPLE_RATE, dtype=np.float32)
+        first = self._transcribe(audio.copy())
+        second = self._transcribe(audio.copy())
+        self.assertEqual(first, second)
+        self.model.transcribe.assert_called_once()
+
+    def test_key_depends_on_audio_and_model(self):
+        """测试音频内容或模型不同时不命中缓存"""
+        audio = np.linspace(-0.5, 0.5, transcribe.SAMPLE_RATE, dtype=np.float32)
+        self._transcribe(audio)
+        self._transcribe(audio, model_name='large')
+        changed = audio.copy()
+        changed[0] = 0.1
+        self._transcribe(changed)
+        self.assertEqual(self.model.transcribe.call_count, 3)
+
+    def test_chunk_options_in_key(self):
+        """测试分片转录的结果与整段转录分别缓存"""
+        audio = np.zeros(transcribe.SAMPLE_RATE * 3, dtype=np.float32)
+        self._transcribe(audio)
+        with patch.object(transcribe, 'transcribe_in_chunks', return_value=[]) as chunked:
+            self.assertEqual(self._transcribe(audio, chunk_pool=Mock(), chunk_seconds=1), [])
+            self.assertEqual(self._transcribe(audio, chunk_pool=Mock(), chunk_seconds=1), [])
+        chunked.assert_called_once()
+        self.model.transcribe.assert_called_once()
+
+
+class TestDaemon(unittest.TestCase):
+    """测试转录守护进程"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.addCleanup(instrumentation.drain)
+        self.socket_path = os.path.join(self.temp_dir.name, 'daemon.sock')
+        self.server = transcribe_daemon.TranscribeDaemon(self.socket_path, [], cache=TranscriptCache(self.temp_dir.name))
+        self.server.models['base'] = Mock()
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.caches = {}
+
+    def _fake_process(self, input_path, output_dir, model, cache=None, model_name='base', **kwargs):
+        """记录一个带文件名的 span 并稍作停顿，让并发任务交错"""
+        self.caches[input_path] = cache
+        with instrumentation.span('transcribe', input=input_path):
+            time.sleep(0.05)
+        return {}
+
+    def _request(self, input_paths, **options):
+        """直接发送原始请求，避免客户端合并的记录混入本进程"""
+        import socket
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            transcribe_daemon._send_message(sock, {
+                'input_paths': input_paths, 'output_dir': self.temp_dir.name,
+                'model': 'base', 'options': options,
+            })
+            return transcribe_daemon._recv_message(sock)
+        finally:
+            sock.close()
+
+    def test_spans_belong_to_job(self):
+        """测试并发提交时每个任务只取回自己的阶段统计"""
+        jobs = {name: [f'/{name}/{i}.mp3' for i in range(3)] for name in ('a', 'b', 'c')}
+        responses = {}
+
+        def submit(name):
+            responses[name] = self._request(jobs[name])
+
+        with patch.object(transcribe, 'process_single_file', side_effect=self._fake_process):
+            threads = [threading.Thread(target=submit, args=(name,)) for name in jobs]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        for name, paths in jobs.items():
+            self.assertEqual([r['input'] for r in responses[name]['results']], paths)
+            self.assertEqual([span['input'] for span in responses[name]['spans']], paths)
+
+    def test_forward_cache_options(self):
+        """测试客户端指定的缓存目录和 --no-cache 对该任务生效"""
+        cache_dir = os.path.join(self.temp_dir.name, 'client-cache')
+        with patch.object(transcribe, 'process_single_file', side_effect=self._fake_process):
+            self._request(['/default.mp3'])
+            self._request(['/client.mp3'], cache_dir=cache_dir, cache_max_mb=1)
+            self._request(['/off.mp3'], use_cache=False)
+        self.assertIs(self.caches['/default.mp3'], self.server.cache)
+        self.assertEqual(self.caches['/client.mp3'].cache_dir, cache_dir)
+        self.assertEqual(self.caches['/client.mp3'].max_bytes, 1024 * 1024)
+        self.assertIsNone(self.caches['/off.mp3'])
+
+    def test_main_sends_cache_options(self):
+        """测试 main 把命令行的缓存设置随任务发送给守护进程"""
+        cache_options = {'cache_dir': '/tmp/cache', 'cache_max_mb': 10.0}
+        with patch.object(transcribe_daemon, 'submit_job', return_value=[]) as submit, \
+                redirect_stdout(io.StringIO()):
+            transcribe.main(['/a.mp3'], self.temp_dir.name, cache=TranscriptCache(),
+                            cache_options=cache_options)
+        submit.assert_called_once()
+        self.assertEqual(submit.call_args.kwargs['cache_dir'], '/tmp/cache')
+        self.assertEqual(submit.call_args.kwargs['cache_max_mb'], 10.0)
+        self.assertTrue(submit.call_args.kwargs['use_cache'])
+
+
+    def test_default_socket_path(self):
+        """测试优先使用 $XDG_RUNTIME_DIR，环境变量 TRANSCRIBE_SOCKET 优先级最高"""
+        with patch.dict(os.environ, {'XDG_RUNTIME_DIR': '/run/user/1000'}):
+            os.environ.pop('TRANSCRIBE_SOCKET', None)
+            self.assertEqual(transcribe_daemon.default_socket_path(), '/run/user/1000/transcribe.sock')
+            os.environ['TRANSCRIBE_SOCKET'] = '/custom.sock'
+            self.assertEqual(transcribe_daemon.default_socket_path(), '/custom.sock')
+        with patch.dict(os.environ, {}, clear=True):
+            self.assertEqual(transcribe_daemon.default_socket_path(), f'/tmp/transcribe-{os.getuid()}.sock')
+
+    def test_ignore_socket_of_other_user(self):
+        """测试 socket 不属于当前用户时不发送任务"""
+        with patch.object(transcribe, 'process_single_file', side_effect=self._fake_process), \
+                patch.object(transcribe_daemon.os, 'getuid', return_value=os.getuid() + 1), \
+                redirect_stdout(io.StringIO()) as output:
+            self.assertIsNone(transcribe_daemon.submit_job(['/a.mp3'], self.temp_dir.name,
+                                                           socket_path=self.socket_path))
+        self.assertEqual(self.caches, {})
+        self.assertIn('不属于当前用户', output.getvalue())
+
+    def test_daemon_exits_mid_job(self):
+        """测试守护进程处理中途退出时返回 None，由调用方回退到当前进程"""
+        import socket
+        socket_path = os.path.join(self.temp_dir.name, 'dying.sock')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(listener.close)
+        listener.bind(socket_path)
+        listener.listen(1)
+
+        def accept_and_close():
+            connection, _ = listener.accept()
+            connection.recv(65536)
+            connection.close()
+
+        thread = threading.Thread(target=accept_and_close, daemon=True)
+        thread.start()
+        with redirect_stdout(io.StringIO()) as output:
+            self.assertIsNone(transcribe_daemon.submit_job(['/a.mp3'], self.temp_dir.name, socket_path=socket_path))
+        thread.join()
+        self.assertIn('连接中断', output.getvalue())
+
+
+class TestPipeline(unittest.TestCase):
+    """测试分阶段流水线与输出阶段"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.addCleanup(instrumentation.drain)
+        self.segments = [
+            {'id': 0, 'start': 0.0, 'end': 1.5, 'text': ' 你好'},
+            {'id': 1, 'start': 1.5, 'end': 3.0, 'text': ' 世界'},
+        ]
+
+    def test_errors_do_not_stop_pipeline(self):
+        """测试解码、转录、输出阶段的错误只影响对应文件，转录按输入顺序进行"""
+        paths = [f'/media/{name}.mp3' for name in ('ok1', 'bad_decode', 'bad_model', 'bad_output', 'ok2')]
+        transcribed = []
+
+        def prepare(input_path, output_dir, save_audio=True):
+            if 'bad_decode' in input_path:
+                raise RuntimeError('解码失败')
+            return {'audio': input_path, 'save_thread': None, 'audio_output_path': None}
+
+        def transcribe_audio(audio, model, *args):
+            transcribed.append(audio)
+            if 'bad_model' in audio:
+                raise RuntimeError('转录失败')
+            return self.segments
+
+        def write_outputs(input_path, output_dir, prepared, segments, native_beat_rate=False, archive_dir=None):
+            if 'bad_output' in input_path:
+                raise RuntimeError('写文件失败')
+            return {}
+
+        output = io.StringIO()
+        with patch.object(transcribe, 'prepare_audio', side_effect=prepare), \
+                patch.object(transcribe, 'transcribe_audio', side_effect=transcribe_audio), \
+                patch.object(transcribe, 'write_outputs', side_effect=write_outputs), \
+                redirect_stdout(output):
+            transcribe.process_files_pipelined(paths, self.temp_dir.name, Mock())
+
+        self.assertEqual(transcribed, [p for p in paths if 'bad_decode' not in p])
+        lines = [line for line in output.getvalue().splitlines() if line.startswith('[')]
+        self.assertEqual(len(lines), len(paths))
+        self.assertEqual(sorted(int(line[1:line.index('/')]) for line in lines), list(range(1, len(paths) + 1)))
+        for path in paths:
+            reported = [line for line in lines if path in line]
+            self.assertEqual(len(reported), 1)
+            self.assertEqual('出错' in reported[0], 'bad' in path)
+        self.assertIn('写文件失败', output.getvalue())
+
+    def test_write_outputs(self):
+        """测试输出阶段写出附属文件、字幕、节拍文件并等待音频保存"""
+        save_thread = Mock()
+        wav_path = os.path.join(self.temp_dir.name, 'clip.wav')
+        prepared = {'audio': np.zeros(transcribe.SAMPLE_RATE * 3, dtype=np.float32),
+                    'save_thread': save_thread, 'audio_output_path': wav_path}
+        with patch.object(transcribe, 'detect_beats', return_value=[0.5, 1.0]), \
+                redirect_stdout(io.StringIO()):
+            saved = transcribe.write_outputs('/media/clip.mp4', self.temp_dir.name, prepared, self.segments)
+
+        self.assertEqual(set(saved), {transcribe.SIDECAR_EXT, *transcribe.SUBTITLE_SINKS, '.beats.txt', '.wav'})
+        for ext, path in saved.items():
+            self.assertEqual(path, os.path.join(self.temp_dir.name, f'clip{ext}'))
+        save_thread.join.assert_called_once()
+        with open(saved['.beats.txt'], encoding='utf-8') as f:
+            self.assertEqual(f.read(), '0.5,1.0')
+        with open(saved['.srt'], encoding='utf-8') as f:
+            self.assertEqual(f.read(), transcribe.generate_srt(self.segments))
+        self.assertEqual(transcribe.load_segments_sidecar(saved[transcribe.SIDECAR_EXT]),
+                         [{k: s[k] for k in ('start', 'end', 'text')} for s in self.segments])
+
+
+@unittest.skipIf(librosa is None, '未安装 librosa')
+class TestBeatEnvelope(unittest.TestCase):
+    """测试逐块计算的起音包络与 librosa 整段计算一致"""
+
+    def test_matches_librosa_median(self):
+        """测试与 onset_strength(aggregate=np.median) 的结果一致"""
+        sr = 22050
+        rng = np.random.default_rng(0)
+        y = 0.01 * rng.standard_normal(sr * 3).astype(np.float32)
+        # 每 0.5 秒一个较强的起音，且第一个起音最强，使截至当前的最大值等于全局最大值
+        for i, start in enumerate(range(0, len(y), sr // 2)):
+            y[start:start + 256] += (0.9 if i == 0 else 0.5) * np.hanning(256).astype(np.float32)
+
+        expected = librosa.onset.onset_strength(y=y, sr=sr, aggregate=np.median)
+        blocks = [y[i:i + 10000] for i in range(0, len(y), 10000)]
+        streamed = transcribe.onset_envelope_stream(blocks, sr)
+        self.assertEqual(streamed.shape, expected.shape)
+        np.testing.assert_allclose(streamed, expected, rtol=1e-3, atol=1e-3)
+
+
+class TestSidecarRender(unittest.TestCase):
+    """测试分段附属文件与 render 子命令"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.segments = [
+            {'start': 0.0, 'end': 1.25, 'text': '你好'},
+            {'start': 1.25, 'end': 3.5, 'text': 'emoji 🎵 "引号"'},
+        ]
+        self.sidecar_path = os.path.join(self.temp_dir.name, f'clip{transcribe.SIDECAR_EXT}')
+        transcribe.save_segments_sidecar(transcribe.Transcript.from_whisper(self.segments), self.sidecar_path)
+
+    def test_round_trip(self):
+        """测试附属文件带版本号，读回的分段与写入一致"""
+        with open(self.sidecar_path, encoding='utf-8') as f:
+            data = json.load(f)
+        self.assertEqual(data['version'], 1)
+        self.assertEqual(transcribe.load_segments_sidecar(self.sidecar_path), self.segments)
+
+    def test_reject_unknown_version(self):
+        """测试不支持的版本号报错"""
+        with open(self.sidecar_path, 'w', encoding='utf-8') as f:
+            f.write('{"version":2,"segments":[]}')
+        with self.assertRaises(ValueError):
+            transcribe.load_segments_sidecar(self.sidecar_path)
+
+    def test_render_main(self):
+        """测试 render 子命令生成的字幕与直接生成的一致"""
+        output_dir = os.path.join(self.temp_dir.name, 'rendered')
+        with redirect_stdout(io.StringIO()) as output:
+            transcribe.render_main([self.sidecar_path], ['srt', '.lrc'], output_dir, workers=1)
+        self.assertIn('成功 1/1', output.getvalue())
+        self.assertEqual(sorted(os.listdir(output_dir)), ['clip.lrc', 'clip.srt'])
+        with open(os.path.join(output_dir, 'clip.srt'), encoding='utf-8') as f:
+            self.assertEqual(f.read(), transcribe.generate_srt(self.segments))
+
+    def test_render_unknown_format(self):
+        """测试不支持的格式直接退出"""
+        with redirect_stdout(io.StringIO()), self.assertRaises(SystemExit):
+            transcribe.render_main([self.sidecar_path], ['docx'], workers=1)
+
+    def test_render_missing_sidecar(self):
+        """测试附属文件不存在时返回错误信息而不抛出异常"""
+        missing = os.path.join(self.temp_dir.name, f'missing{transcribe.SIDECAR_EXT}')
+        path, error = transcribe._render_sidecar((missing, None, ['.srt']))
+        self.assertEqual(path, missing)
+        self.assertIsNotNone(error)
+
+
+class TestInstrumentation(unittest.TestCase):
+    """测试阶段统计的记录、取出与汇总"""
+
+    def setUp(self):
+        self.stats = Instrumentation()
+
+    def test_nested_spans(self):
+        """测试嵌套 span 按结束顺序记录，外层耗时包含内层"""
+        with self.stats.span('outer', audio_duration=2.0, file='a.wav'):
+            with self.stats.span('inner'):
+                time.sleep(0.01)
+        inner, outer = self.stats.spans
+        self.assertEqual((inner['stage'], outer['stage']), ('inner', 'outer'))
+        self.assertEqual(outer['file'], 'a.wav')
+        self.assertGreaterEqual(inner['wall_seconds'], 0.01)
+        self.assertGreaterEqual(outer['wall_seconds'], inner['wall_seconds'])
+        for key in ('cpu_seconds', 'peak_rss_mb', 'pid'):
+            self.assertIn(key, outer)
+
+    def test_span_on_error(self):
+        """测试阶段抛出异常时仍然记录，并可在 with 块内补充音频时长"""
+        with self.assertRaises(RuntimeError):
+            with self.stats.span('extract_audio') as record:
+                record['audio_duration'] = 3.0
+                raise RuntimeError('失败')
+        self.assertEqual(self.stats.spans[0]['audio_duration'], 3.0)
+        self.assertIn('wall_seconds', self.stats.spans[0])
+
+    def test_rss_growth(self):
+        """测试 span 记录进程峰值内存，以及本阶段把峰值抬高了多少"""
+        with patch('instrumentation.peak_rss_mb', side_effect=[100.0, 150.0, 150.0, 150.0]):
+            with self.stats.span('decode'):
+                pass
+            with self.stats.span('write_subtitles'):
+                pass
+        decode, write = self.stats.spans
+        self.assertEqual((decode['peak_rss_mb'], decode['rss_growth_mb']), (150.0, 50.0))
+        # 之前的阶段已达到峰值，本阶段不再抬高峰值
+        self.assertEqual((write['peak_rss_mb'], write['rss_growth_mb']), (150.0, 0.0))
+        stages = self.stats.report()['stages']
+        self.assertEqual(stages['decode']['rss_growth_mb'], 50.0)
+
+    def test_record(self):
+        """测试直接记录已知耗时的阶段，字段与 span 一致"""
+        with self.stats.span('transcribe', file='a.wav'):
+            pass
+        self.stats.record('rate_limit_wait', 0.5, action='submit')
+        span, record = self.stats.spans
+        self.assertEqual(set(record), set(span) - {'file'} | {'action'})
+        self.assertEqual((record['wall_seconds'], record['cpu_seconds'], record['action']), (0.5, 0.0, 'submit'))
+        self.assertIsNone(record['audio_duration'])
+
+    def test_drain_and_extend(self):
+        """测试 drain 取出并清空记录，extend 合并其他进程的记录"""
+        with self.stats.span('transcribe'):
+            pass
+        spans = self.stats.drain()
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(self.stats.spans, [])
+        self.stats.extend(spans)
+        self.stats.extend(spans)
+        self.assertEqual(self.stats.report()['stages']['transcribe']['count'], 2)
+
+    def test_report(self):
+        """测试按阶段汇总与实时率，未知音频时长时实时率为 None"""
+        self.stats.extend([
+            {'stage': 'transcribe', 'audio_duration': 10.0, 'wall_seconds': 2.0, 'cpu_seconds': 1.0, 'peak_rss_mb': 100.0},
+            {'stage': 'transcribe', 'audio_duration': 30.0, 'wall_seconds': 6.0, 'cpu_seconds': 3.0, 'peak_rss_mb': 300.0},
+            {'stage': 'upload', 'audio_duration': None, 'wall_seconds': 1.0, 'cpu_seconds': 0.0, 'peak_rss_mb': 50.0},
+        ])
+        stages = self.stats.report()['stages']
+        self.assertEqual(stages['transcribe']['count'], 2)
+        self.assertAlmostEqual(stages['transcribe']['wall_seconds'], 8.0)
+        self.assertAlmostEqual(stages['transcribe']['audio_seconds'], 40.0)
+        self.assertAlmostEqual(stages['transcribe']['real_time_factor'], 0.2)
+        self.assertEqual(stages['transcribe']['peak_rss_mb'], 300.0)
+        self.assertIsNone(stages['upload']['real_time_factor'])
+
+    def test_save_report(self):
+        """测试保存报告时自动创建目录"""
+        with self.stats.span('write_subtitles', audio_duration=1.0):
+            pass
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_path = os.path.join(temp_dir, 'reports', 'run.json')
+            self.stats.save_report(report_path)
+            with open(report_path, encoding='utf-8') as f:
+                report = json.load(f)
+        self.assertEqual(report['stages']['write_subtitles']['count'], 1)
+        self.assertEqual(len(report['spans']), 1)
+
+
+@unittest.skipIf(pyarrow is None, '需要 pyarrow')
+class TestWhisperArchive(unittest.TestCase):
+    """测试 Whisper 转录结果追加到列式归档"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.addCleanup(instrumentation.drain)
+        self.archive_dir = os.path.join(self.temp_dir.name, 'archive')
+        self.segments = [
+            {'id': 0, 'start': 0.0, 'end': 1.5, 'text': ' 你好'},
+            {'id': 1, 'start': 1.5, 'end': 3.0, 'text': ' 世界'},
+        ]
+
+    def test_write_outputs_appends(self):
+        """测试传入归档目录时按 whisper 后端分区追加，归档失败不影响其他输出"""
+        from transcript_archive import TranscriptArchive
+        prepared = {'audio': np.zeros(transcribe.SAMPLE_RATE * 3, dtype=np.float32),
+                    'save_thread': None, 'audio_output_path': None}
+        with patch.object(transcribe, 'detect_beats', return_value=[]), redirect_stdout(io.StringIO()):
+            saved = transcribe.write_outputs('/media/clip.mp3', self.temp_dir.name, prepared, self.segments,
+                                             archive_dir=self.archive_dir)
+        self.assertEqual(saved['archive'], self.archive_dir)
+        table = TranscriptArchive(self.archive_dir).query('segments', ['source', 'text', 'backend'])
+        self.assertEqual(table.column('text').to_pylist(), [' 你好', ' 世界'])
+        self.assertEqual(set(table.column('backend').to_pylist()), {'whisper'})
+        self.assertEqual(set(table.column('source').to_pylist()), {'/media/clip.mp3'})
+
+        with patch.object(transcribe.TranscriptArchive, 'append', side_effect=OSError('只读')), \
+                patch.object(transcribe, 'detect_beats', return_value=[]), \
+                redirect_stdout(io.StringIO()) as output:
+            saved = transcribe.write_outputs('/media/clip.mp3', self.temp_dir.name, prepared, self.segments,
+                                             archive_dir=self.archive_dir)
+        self.assertNotIn('archive', saved)
+        self.assertIn('.srt', saved)
+        self.assertIn('追加转录归档失败: 只读', output.getvalue())
+
+    def test_archive_dir_threaded(self):
+        """测试命令行的归档目录以绝对路径传给各处理方式"""
+        args = transcribe.parse_args(['a.mp3', '--archive-dir', 'archive'])
+        self.assertEqual(args.archive_dir, 'archive')
+        with patch.object(transcribe_daemon, 'submit_job', return_value=[]) as submit, \
+                redirect_stdout(io.StringIO()):
+            transcribe.main(['/a.mp3'], self.temp_dir.name, archive_dir='archive')
+        self.assertEqual(submit.call_args.kwargs['archive_dir'], os.path.abspath('archive'))
+
+
+if __name__ == '__main__':
+    unittest.main()
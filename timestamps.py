@@ -0,0 +1,178 @@
+"""
+批量时间戳格式化模块
+
+逐字输出要为十万级的词各格式化一到两次时间戳，逐个调用 timedelta、divmod 和字符串格式化
+在性能分析中排在最前。这里用 NumPy 一次把整个时间数组转换为 SRT/VTT/LRC/SMI 时间戳：
+先用与标量实现相同的浮点运算得到各字段的整数值，再按位拼出 ASCII 字符矩阵。
+LRC 秒数保留两位小数，按浮点数的精确二进制值做四舍六入五成双，与 Python 格式化的结果一致。
+
+两个后端的格式略有差异（Whisper 的小时不补零、超过一天时带 "1 day,"，阿里云的小时按天取模），
+调用方传入各自的标量实现；负数、NaN、超出范围的值以及未安装 NumPy 时都使用标量实现。
+"""
+from typing import Callable, List, Sequence, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # 阿里云后端可以不安装 NumPy，此时逐个格式化
+    np = None
+
+Scalar = Callable[[float], str]
+# 字面字符串，或 (非负整数数组, 最少位数)
+_Part = Union[str, Tuple["np.ndarray", int]]
+
+# 少于该数量时直接逐个格式化，省去数组开销
+_MIN_BATCH = 32
+# 快速路径处理的最大秒数，保证中间结果的整数不溢出
+_MAX_SECONDS = 1e12
+
+
+def _digit_count(values: "np.ndarray") -> "np.ndarray":
+    """非负整数的十进制位数"""
+    count = np.ones(len(values), dtype=np.int64)
+    threshold = 10
+    while True:
+        more = values >= threshold
+        if not more.any():
+            return count
+        count += more
+        threshold *= 10
+
+
+def _digits(values: "np.ndarray", width: int) -> "np.ndarray":
+    """把非负整数写成补零到 width 位的 ASCII 矩阵，形状为 (n, width)"""
+    out = np.empty((len(values), width), dtype=np.uint8)
+    remaining = values.copy()
+    for column in range(width - 1, -1, -1):
+        out[:, column] = 48 + remaining % 10
+        remaining //= 10
+    return out
+
+
+def _compose(parts: List[_Part], count: int) -> List[str]:
+    """按字段拼出字符串；各行位数不同时按位数分组，每组拼成一个定长矩阵"""
+    numbers = [part for part in parts if not isinstance(part, str)]
+    widths = [np.maximum(_digit_count(values), min_width) for values, min_width in numbers]
+    # 各字段位数不超过 15，按 4 比特一段合成一个整数键，避免按行去重的多列排序
+    key = np.zeros(count, dtype=np.int64)
+    for width in widths:
+        key = (key << 4) | width
+    if key.min() == key.max():
+        groups = [np.arange(count)]
+    else:
+        _, inverse = np.unique(key, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        groups = np.split(order, np.nonzero(np.diff(inverse[order]))[0] + 1)
+
+    result = np.empty(count, dtype=object)
+    for rows in groups:
+        columns = []
+        number_index = 0
+        for part in parts:
+            if isinstance(part, str):
+                literal = np.frombuffer(part.encode('ascii'), dtype=np.uint8)
+                columns.append(np.broadcast_to(literal, (len(rows), len(literal))))
+            else:
+                columns.append(_digits(part[0][rows], int(widths[number_index][rows[0]])))
+                number_index += 1
+        matrix = np.ascontiguousarray(np.concatenate(columns, axis=1))
+        strings = matrix.view(f'S{matrix.shape[1]}').reshape(-1).astype(str)
+        result[rows] = strings.tolist()
+    return result.tolist()
+
+
+def _with_fallback(seconds: Sequence[float], scalar: Scalar, fast: "np.ndarray",
+                   format_fast: Callable[["np.ndarray"], List[str]]) -> List[str]:
+    """快速路径处理 fast 为真的元素，其余逐个调用标量实现"""
+    values = np.asarray(seconds, dtype=np.float64)
+    if fast.all():
+        return format_fast(values)
+    result = [None] * len(values)
+    fast_rows = np.nonzero(fast)[0]
+    if len(fast_rows):
+        for row, text in zip(fast_rows.tolist(), format_fast(values[fast_rows])):
+            result[row] = text
+    for row in np.nonzero(~fast)[0].tolist():
+        result[row] = scalar(float(values[row]))
+    return result
+
+
+def _round_hundredths(values: "np.ndarray") -> "np.ndarray":
+    """
+    把 [0, 2^40) 内的浮点数乘以 100 后按精确值四舍六入五成双取整
+
+    value = m * 2^e（m 为 53 位整数），value * 100 = m * 100 / 2^k，用整数移位求商和余数。
+    """
+    mantissa, exponent = np.frexp(values)
+    numerator = (mantissa * 2.0 ** 53).astype(np.int64) * 100
+    shift = 53 - exponent.astype(np.int64)
+    # numerator < 2^60，移位超过 60 时结果必然为 0
+    clipped = np.clip(shift, 1, 60)
+    quotient = numerator >> clipped
+    remainder = numerator & ((np.int64(1) << clipped) - 1)
+    half = np.int64(1) << (clipped - 1)
+    quotient += (remainder > half) | ((remainder == half) & (quotient % 2 == 1))
+    quotient[shift > 60] = 0
+    return quotient
+
+
+def clock_timestamps(seconds: Sequence[float], scalar: Scalar, separator: str = ',',
+                     hour_width: int = 2, wrap_days: bool = False) -> List[str]:
+    """
+    批量格式化 H:MM:SS,mmm 形式的时间戳（SRT、VTT）
+
+    毫秒取 int((秒 - int(秒)) * 1000)，与标量实现相同。
+
+    Args:
+        seconds: 秒数序列
+        scalar: 对应的标量实现，用于快速路径以外的值
+        separator (str): 秒与毫秒之间的分隔符，SRT 为逗号，VTT 为点
+        hour_width (int): 小时的最少位数
+        wrap_days (bool): 小时是否按天取模；为 False 时超过一天的值交给标量实现
+    """
+    if np is None or len(seconds) < _MIN_BATCH:
+        return [scalar(value) for value in seconds]
+
+    def format_fast(values):
+        whole = np.trunc(values)
+        milliseconds = np.trunc((values - whole) * 1000).astype(np.int64)
+        total = whole.astype(np.int64)
+        if wrap_days:
+            total %= 86400
+        hours, remainder = np.divmod(total, 3600)
+        minutes, secs = np.divmod(remainder, 60)
+        return _compose([(hours, hour_width), ':', (minutes, 2), ':', (secs, 2), separator,
+                         (milliseconds, 3)], len(values))
+
+    values = np.asarray(seconds, dtype=np.float64)
+    fast = np.isfinite(values) & ~np.signbit(values) & (values < (_MAX_SECONDS if wrap_days else 86400))
+    return _with_fallback(values, scalar, fast, format_fast)
+
+
+def lrc_timestamps(seconds: Sequence[float], scalar: Scalar) -> List[str]:
+    """批量格式化 [MM:SS.xx] 形式的 LRC 时间戳，分钟为 int(秒 // 60)，秒数保留两位小数"""
+    if np is None or len(seconds) < _MIN_BATCH:
+        return [scalar(value) for value in seconds]
+
+    def format_fast(values):
+        minutes = np.floor_divide(values, 60)
+        hundredths = _round_hundredths(values - minutes * 60)
+        secs, fraction = np.divmod(hundredths, 100)
+        return _compose(['[', (minutes.astype(np.int64), 2), ':', (secs, 2), '.', (fraction, 2), ']'],
+                        len(values))
+
+    values = np.asarray(seconds, dtype=np.float64)
+    fast = np.isfinite(values) & ~np.signbit(values) & (values < 2.0 ** 40)
+    return _with_fallback(values, scalar, fast, format_fast)
+
+
+def millisecond_timestamps(seconds: Sequence[float], scalar: Scalar) -> List[str]:
+    """批量格式化整数毫秒时间戳 int(秒 * 1000)（SMI）"""
+    if np is None or len(seconds) < _MIN_BATCH:
+        return [scalar(value) for value in seconds]
+
+    def format_fast(values):
+        return _compose([(np.trunc(values * 1000).astype(np.int64), 1)], len(values))
+
+    values = np.asarray(seconds, dtype=np.float64)
+    fast = np.isfinite(values) & ~np.signbit(values) & (values < _MAX_SECONDS)
+    return _with_fallback(values, scalar, fast, format_fast)
@@ -1,11 +1,23 @@
 import os
 import sys
+import json
+import argparse
 import subprocess
-import tempfile
 import datetime
-import whisper
+import wave
+import queue
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 import warnings  # 新增导入
-import librosa  # 新增导入
+from transcript_cache import TranscriptCache, hash_audio
+from instrumentation import instrumentation
+from subtitle_writer import CueSink, LineSink, render, write_files
+from transcript import Transcript
+from transcript_archive import TranscriptArchive
+from timestamps import clock_timestamps, lrc_timestamps, millisecond_timestamps
 
 def is_video_file(file_path: str) -> bool:
     # 简单判断是否为视频文件，可根据需求扩展支持的格式
@@ -13,27 +25,103 @@ def is_video_file(file_path: str) -> bool:
     _, ext = os.path.splitext(file_path.lower())
     return ext in video_exts
 
-def extract_audio(video_path: str) -> str:
-    # 使用 ffmpeg 提取音频，保存为临时 WAV 文件
-    temp_audio_fd, temp_audio_path = tempfile.mkstemp(suffix=".wav")
-    os.close(temp_audio_fd)  # 关闭文件描述符
+# Whisper 使用的采样率
+SAMPLE_RATE = 16000
+
+def probe_sample_rate(file_path: str) -> int:
+    """使用 ffprobe 获取首个音频流的原始采样率"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-select_streams", "a:0",
+        "-show_entries", "stream=sample_rate",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        file_path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(f"无法获取采样率: {result.stderr.decode()}")
+    return int(result.stdout.split()[0])
+
+def probe_duration(file_path: str) -> float:
+    """使用 ffprobe 获取媒体时长（秒），失败时返回 0"""
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "format=duration",
+        "-of", "default=noprint_wrappers=1:nokey=1",
+        file_path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        return float(result.stdout.split()[0])
+    except (IndexError, ValueError):
+        return 0.0
+
+# 无法获取时长时的初始缓冲区长度（秒）
+_INITIAL_BUFFER_SECONDS = 60
+# 每次从管道读取的字节数
+_PIPE_READ_SIZE = 1 << 20
+
+def extract_audio(input_path: str, sr: int = SAMPLE_RATE) -> np.ndarray:
+    """使用 ffmpeg 将音频或视频解码为单声道 float32 数组
+
+    ffmpeg 将 s16le 原始 PCM 写到 stdout，按 ffprobe 得到的时长预分配数组后
+    直接 readinto，全程不写临时文件。
+    """
     cmd = [
         "ffmpeg",
-        "-y",  # 覆盖输出文件
-        "-i", video_path,
+        "-nostdin",
+        "-loglevel", "error",
+        "-i", input_path,
         "-vn",  # 不处理视频流
+        "-f", "s16le",
         "-acodec", "pcm_s16le",
-        "-ar", "16000",  # 将采样率转为 16000 Hz，Whisper 性能较佳
+        "-ar", str(sr),  # 默认转为 16000 Hz，Whisper 性能较佳
         "-ac", "1",  # 单通道
-        temp_audio_path
+        "-"  # 输出到 stdout
     ]
-    print(f"提取音频: {' '.join(cmd)}")
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    if result.returncode != 0:
-        print("音频提取失败！")
-        print(result.stderr.decode())
-        sys.exit(1)
-    return temp_audio_path
+    print(f"解码音频: {' '.join(cmd)}")
+
+    duration = probe_duration(input_path)
+    # 多留 1 秒余量，避免时长估计偏差导致扩容
+    capacity = int((duration + 1) * sr) if duration > 0 else _INITIAL_BUFFER_SECONDS * sr
+    pcm = np.empty(capacity, dtype="<i2")
+    filled = 0  # 已写入的字节数
+
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    with process.stdout:
+        while True:
+            if filled + _PIPE_READ_SIZE > pcm.nbytes:
+                # 预估不足时按倍数扩容
+                pcm = np.resize(pcm, max(pcm.size * 2, (filled + _PIPE_READ_SIZE) // 2))
+            view = memoryview(pcm).cast("B")[filled:filled + _PIPE_READ_SIZE]
+            n = process.stdout.readinto(view)
+            if not n:
+                break
+            filled += n
+    stderr = process.stderr.read()
+    process.stderr.close()
+    if process.wait() != 0:
+        raise RuntimeError(f"音频提取失败: {stderr.decode()}")
+
+    audio = pcm[:filled // 2].astype(np.float32)
+    audio /= 32768.0
+    return audio
+
+def save_wav(audio: np.ndarray, output_path: str, sr: int = SAMPLE_RATE) -> None:
+    """将 float32 音频数组保存为 16 位 PCM WAV 文件"""
+    # 与 extract_audio 的 /32768 对应，解码得到的样本原样写回，超出范围的截断
+    pcm = np.clip(audio * 32768.0, -32768, 32767).astype("<i2")
+    with wave.open(output_path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(pcm.tobytes())
+
+def save_wav_async(audio: np.ndarray, output_path: str, sr: int = SAMPLE_RATE) -> threading.Thread:
+    """在后台线程中保存 WAV 文件，返回线程以便调用方等待完成"""
+    thread = threading.Thread(target=save_wav, args=(audio, output_path, sr), daemon=True)
+    thread.start()
+    return thread
 
 def format_timestamp_for_srt(seconds: float) -> str:
     ms = int((seconds - int(seconds)) * 1000)
@@ -50,34 +138,26 @@ def format_timestamp_for_lrc(seconds: float) -> str:
     sec = seconds - minutes * 60
     return f"[{minutes:02d}:{sec:05.2f}]"
 
-def generate_srt(segments):
-    srt_output = ""
-    for i, segment in enumerate(segments, 1):
-        start = format_timestamp_for_srt(segment["start"])
-        end = format_timestamp_for_srt(segment["end"])
-        text = segment["text"].strip()
-        srt_output += f"{i}\n{start} --> {end}\n{text}\n\n"
-    return srt_output
+# 批量格式化时间戳，结果与上面的标量实现逐字节一致
+def format_timestamps_for_srt(values):
+    return clock_timestamps(values, format_timestamp_for_srt, ",", hour_width=1)
 
-def generate_vtt(segments):
-    vtt_output = "WEBVTT\n\n"
-    for i, segment in enumerate(segments, 1):
-        start = format_timestamp_for_vtt(segment["start"])
-        end = format_timestamp_for_vtt(segment["end"])
-        text = segment["text"].strip()
-        vtt_output += f"{i}\n{start} --> {end}\n{text}\n\n"
-    return vtt_output
+def format_timestamps_for_vtt(values):
+    return clock_timestamps(values, format_timestamp_for_vtt, ".", hour_width=1)
 
-def generate_lrc(segments):
-    lrc_output = ""
-    for segment in segments:
-        timestamp = format_timestamp_for_lrc(segment["start"])
-        text = segment["text"].strip()
-        lrc_output += f"{timestamp}{text}\n"
-    return lrc_output
+def format_timestamps_for_lrc(values):
+    return lrc_timestamps(values, format_timestamp_for_lrc)
 
-def generate_smi(segments, lang="ENCC"):
-    smi_output = """<SAMI>
+def srt_sink(f):
+    return CueSink(f, format_timestamps_for_srt, skip_empty=False)
+
+def vtt_sink(f):
+    return CueSink(f, format_timestamps_for_vtt, header="WEBVTT\n\n", skip_empty=False)
+
+def lrc_sink(f):
+    return LineSink(f, format_timestamps_for_lrc, skip_empty=False)
+
+_SMI_HEADER = """<SAMI>
 <Head>
  <STYLE TYPE="text/css">
   <!--
@@ -88,24 +168,175 @@ def generate_smi(segments, lang="ENCC"):
 </Head>
 <BODY>
 """
-    for segment in segments:
-        start_ms = int(segment["start"] * 1000)
-        text = segment["text"].strip()
-        smi_output += f'<SYNC Start={start_ms}><P Class={lang}>{text}<br>\n'
-    smi_output += "</BODY>\n</SAMI>"
-    return smi_output
+
+def smi_sink(f, lang="ENCC"):
+    def prefix(values):
+        return [f"<SYNC Start={ms}><P Class={lang}>"
+                for ms in millisecond_timestamps(values, lambda start: str(int(start * 1000)))]
+    return LineSink(f, prefix, suffix="<br>",
+                    header=_SMI_HEADER, footer="</BODY>\n</SAMI>", skip_empty=False)
+
+def generate_srt(segments):
+    return render(segments, srt_sink)
+
+def generate_vtt(segments):
+    return render(segments, vtt_sink)
+
+def generate_lrc(segments):
+    return render(segments, lrc_sink)
+
+def generate_smi(segments, lang="ENCC"):
+    return render(segments, lambda f: smi_sink(f, lang))
+
+# 扩展名到字幕格式的映射，写文件时所有格式在一次遍历中同时写出
+SUBTITLE_SINKS = {
+    ".srt": srt_sink,
+    ".vtt": vtt_sink,
+    ".lrc": lrc_sink,
+    ".smi": smi_sink
+}
+
+# 原始分段附属文件的扩展名，render 子命令据此重新生成字幕
+SIDECAR_EXT = ".segments.json"
+
+def save_segments_sidecar(transcript: Transcript, output_path: str) -> None:
+    """将分段以紧凑 JSON 保存：{"version": 1, "segments": [[start, end, text], ...]}"""
+    data = {
+        "version": 1,
+        "segments": [list(row) for row in zip(transcript.starts, transcript.ends, transcript.texts())],
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+def load_segments_sidecar(sidecar_path: str) -> list:
+    """读取附属文件，返回与 Whisper 相同结构的分段列表"""
+    with open(sidecar_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != 1:
+        raise ValueError(f"不支持的附属文件版本: {data.get('version')}")
+    return [{"start": start, "end": end, "text": text} for start, end, text in data["segments"]]
 
 def get_output_path(input_path: str, output_dir: str, ext: str) -> str:
     """为输出文件生成合适的路径"""
     basename = os.path.splitext(os.path.basename(input_path))[0]
     return os.path.join(output_dir, f"{basename}{ext}")
 
-def detect_beats(audio_path: str) -> list:
-    """检测音频文件中的节拍"""
-    y, sr = librosa.load(audio_path, sr=None)
-    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
-    beat_times = librosa.frames_to_time(beats, sr=sr)
-    return beat_times
+# 节拍检测的 STFT 参数与每块样本数
+_BEAT_N_FFT = 2048
+_BEAT_HOP_LENGTH = 512
+_BEAT_BLOCK_SIZE = _BEAT_HOP_LENGTH * 512
+# 从文件流式检测节拍时的最高分析采样率
+_BEAT_MAX_SAMPLE_RATE = 22050
+
+def iter_audio_blocks(input_path: str, sr: int, block_size: int = _BEAT_BLOCK_SIZE):
+    """通过 ffmpeg 管道逐块读取单声道 float32 音频，内存占用与时长无关"""
+    cmd = [
+        "ffmpeg", "-nostdin", "-loglevel", "error",
+        "-i", input_path, "-vn",
+        "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ar", str(sr), "-ac", "1", "-"
+    ]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    pcm = np.empty(block_size, dtype="<i2")
+    view = memoryview(pcm).cast("B")
+    try:
+        while True:
+            filled = 0
+            while filled < len(view):
+                n = process.stdout.readinto(view[filled:])
+                if not n:
+                    break
+                filled += n
+            if filled:
+                yield pcm[:filled // 2].astype(np.float32) / 32768.0
+            if filled < len(view):
+                break
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read()
+        process.stderr.close()
+        if process.wait() != 0:
+            raise RuntimeError(f"音频提取失败: {stderr.decode()}")
+
+def onset_envelope_stream(blocks, sr: int, n_fft: int = _BEAT_N_FFT,
+                          hop_length: int = _BEAT_HOP_LENGTH) -> np.ndarray:
+    """逐块计算起音强度包络（对数 Mel 频谱的正向差分在频带上取中位数，与原先 aggregate=np.median 一致）
+
+    相邻块之间保留不足一帧的尾部样本和上一帧的 Mel 频谱，结果与 librosa 整段计算一致
+    （首尾按 center=True 补零），只是 top_db 截断以截至当前的最大值为参考。峰值内存只取决于块大小。
+    """
+    import librosa  # 延迟导入，仅在需要时加载
+    mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft).astype(np.float32)
+    window = librosa.filters.get_window("hann", n_fft, fftbins=True).astype(np.float32)
+
+    carry = np.zeros(n_fft // 2, dtype=np.float32)
+    prev_db = None
+    running_max = -np.inf
+    envelope = []
+
+    def consume(buffer):
+        nonlocal prev_db, running_max
+        n_frames = 1 + (len(buffer) - n_fft) // hop_length if len(buffer) >= n_fft else 0
+        if n_frames == 0:
+            return buffer
+        frames = np.lib.stride_tricks.sliding_window_view(buffer, n_fft)[::hop_length][:n_frames]
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+        mel_db = 10.0 * np.log10(np.maximum(power @ mel_basis.T, 1e-10))
+        # top_db=80 截断，参考值用截至当前的最大值代替全局最大值
+        running_max = max(running_max, float(mel_db.max()))
+        mel_db = np.maximum(mel_db, running_max - 80.0)
+        previous = mel_db[0] if prev_db is None else prev_db
+        diff = np.diff(mel_db, axis=0, prepend=previous[np.newaxis, :])
+        envelope.append(np.median(np.maximum(diff, 0.0), axis=1))
+        prev_db = mel_db[-1]
+        return buffer[n_frames * hop_length:]
+
+    for block in blocks:
+        carry = consume(np.concatenate([carry, block]))
+    consume(np.concatenate([carry, np.zeros(n_fft // 2, dtype=np.float32)]))
+    if not envelope:
+        return np.zeros(0, dtype=np.float32)
+    envelope = np.concatenate(envelope)
+    # 与 librosa 一致：补偿分帧居中带来的偏移，再截断到原帧数
+    shift = n_fft // (2 * hop_length)
+    return np.concatenate([np.zeros(shift, dtype=envelope.dtype), envelope])[:len(envelope)]
+
+def _mean_tempogram(envelope: np.ndarray, sr: int, block_frames: int = 4096) -> np.ndarray:
+    """分块计算自相关节奏图并对时间取平均，结果等价于 librosa 对整段计算后取均值"""
+    import librosa  # 延迟导入，仅在需要时加载
+    win_length = librosa.time_to_frames(8.0, sr=sr, hop_length=_BEAT_HOP_LENGTH).item()
+    padded = np.pad(envelope, win_length // 2, mode="linear_ramp", end_values=(0, 0))
+    total = np.zeros(win_length)
+    for start in range(0, len(envelope), block_frames):
+        stop = min(len(envelope), start + block_frames)
+        tempogram = librosa.feature.tempogram(
+            onset_envelope=padded[start:stop + win_length - 1], sr=sr,
+            hop_length=_BEAT_HOP_LENGTH, win_length=win_length, center=False
+        )
+        total += tempogram.sum(axis=1)
+    return (total / max(len(envelope), 1))[:, np.newaxis]
+
+def _beats_from_envelope(envelope: np.ndarray, sr: int) -> np.ndarray:
+    """由起音包络估计全局速度并跟踪节拍，返回节拍时间（秒）"""
+    import librosa  # 延迟导入，仅在需要时加载
+    if len(envelope) == 0:
+        return np.zeros(0)
+    # 直接估计整段的节奏图会占用 win_length × 帧数 的内存，这里分块累加
+    tempo = librosa.feature.tempo(tg=_mean_tempogram(envelope, sr), sr=sr, hop_length=_BEAT_HOP_LENGTH)
+    tempo, beats = librosa.beat.beat_track(
+        onset_envelope=envelope, sr=sr, hop_length=_BEAT_HOP_LENGTH, bpm=float(tempo[0])
+    )
+    return librosa.frames_to_time(beats, sr=sr, hop_length=_BEAT_HOP_LENGTH)
+
+def detect_beats(y: np.ndarray, sr: int = SAMPLE_RATE) -> list:
+    """检测内存中音频数据的节拍，按块计算起音包络以限制峰值内存"""
+    blocks = (y[i:i + _BEAT_BLOCK_SIZE] for i in range(0, len(y), _BEAT_BLOCK_SIZE))
+    return _beats_from_envelope(onset_envelope_stream(blocks, sr), sr)
+
+def detect_beats_from_file(input_path: str) -> list:
+    """按原始采样率（不超过 22050 Hz）流式解码文件并检测节拍，不把整段音频读入内存"""
+    sr = min(probe_sample_rate(input_path), _BEAT_MAX_SAMPLE_RATE)
+    return _beats_from_envelope(onset_envelope_stream(iter_audio_blocks(input_path, sr), sr), sr)
 
 def save_beats_to_file(beat_times: list, output_path: str) -> None:
     """将节拍时间点保存到文件"""
@@ -113,92 +344,544 @@ def save_beats_to_file(beat_times: list, output_path: str) -> None:
         for beat_time in beat_times:
             f.write(f"{beat_time:.1f}\n")
 
-def process_single_file(input_path: str, output_dir: str, model) -> None:
-    """处理单个文件的转录"""
-    print(f"\n处理文件: {input_path}")
-    
-    # 如果文件为视频，则先分离音频
+# VAD 分析帧长（秒）
+_VAD_FRAME_SECONDS = 0.03
+# 切分点附近至少需要的静音长度（秒）
+_VAD_MIN_SILENCE_SECONDS = 0.3
+# 长音频模式下片段的最短时长（秒），过短的片段既无法在静音处切分，也失去了并行转录的意义
+MIN_CHUNK_SECONDS = 1.0
+
+def detect_voice_activity(audio: np.ndarray, sr: int = SAMPLE_RATE) -> tuple:
+    """基于短时能量的语音活动检测
+
+    返回 (每帧能量 dB, 每帧是否为语音) 两个数组。阈值取能量中位数以下 20 dB，
+    且不低于 -60 dBFS。
+    """
+    frame = int(sr * _VAD_FRAME_SECONDS)
+    n_frames = len(audio) // frame
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    if n_frames == 0:
+        return energy_db, energy_db > 0
+    threshold = max(np.median(energy_db) - 20.0, -60.0)
+    return energy_db, energy_db > threshold
+
+def split_on_silence(audio: np.ndarray, max_chunk_seconds: float, sr: int = SAMPLE_RATE) -> list:
+    """在静音处将音频切分为不超过 max_chunk_seconds 的片段，返回 [(起始采样, 结束采样), ...]
+
+    每个切分点取片段后半段内平滑能量最低的位置，优先落在 VAD 判定的静音区间中，
+    并移到该静音区间的中点。
+
+    Raises:
+        ValueError: max_chunk_seconds 小于 MIN_CHUNK_SECONDS
+    """
+    if max_chunk_seconds < MIN_CHUNK_SECONDS:
+        raise ValueError(f"片段时长不能小于 {MIN_CHUNK_SECONDS} 秒: {max_chunk_seconds}")
+    max_samples = int(max_chunk_seconds * sr)
+    if len(audio) <= max_samples:
+        return [(0, len(audio))]
+
+    frame = int(sr * _VAD_FRAME_SECONDS)
+    energy_db, is_speech = detect_voice_activity(audio, sr)
+    # 对能量做滑动平均，使切分点落在较长的静音段中间
+    width = max(1, int(_VAD_MIN_SILENCE_SECONDS / _VAD_FRAME_SECONDS))
+    smoothed = np.convolve(energy_db, np.ones(width) / width, mode="same")
+    smoothed[is_speech] += 100.0  # 语音帧只在没有静音时才会被选中
+
+    # 按样本数判断剩余部分，最后一个片段连同不足一帧的尾部也不超过 max_samples
+    max_frames = max_samples // frame
+    bounds = []
+    start = 0
+    while len(audio) - start * frame > max_samples:
+        search_from = start + max_frames // 2
+        search_to = start + max_frames
+        cut = search_from + int(np.argmin(smoothed[search_from:search_to]))
+        if not is_speech[cut]:
+            left, right = cut, cut
+            while left > search_from and not is_speech[left - 1]:
+                left -= 1
+            while right + 1 < search_to and not is_speech[right + 1]:
+                right += 1
+            cut = (left + right + 1) // 2
+        # 每次至少前进一帧，保证循环结束
+        cut = max(cut, start + 1)
+        bounds.append((start * frame, cut * frame))
+        start = cut
+    bounds.append((start * frame, len(audio)))
+    return bounds
+
+def stitch_segments(chunk_results: list, offsets: list) -> list:
+    """将各片段的转录结果按全局时间偏移合并为一个分段列表"""
+    stitched = []
+    for segments, offset in zip(chunk_results, offsets):
+        for segment in segments:
+            segment = dict(segment)
+            segment["id"] = len(stitched)
+            segment["start"] = segment["start"] + offset
+            segment["end"] = segment["end"] + offset
+            if segment.get("words"):
+                segment["words"] = [
+                    dict(word, start=word["start"] + offset, end=word["end"] + offset)
+                    for word in segment["words"]
+                ]
+            stitched.append(segment)
+    return stitched
+
+def transcribe_in_chunks(audio: np.ndarray, chunk_pool, max_chunk_seconds: float) -> list:
+    """长音频模式：在静音处切分后由进程池并行转录，再拼接时间戳"""
+    bounds = split_on_silence(audio, max_chunk_seconds)
+    print(f"长音频模式：切分为 {len(bounds)} 个片段并行转录")
+    chunks = [audio[start:end] for start, end in bounds]
+    chunk_results = chunk_pool.map(_worker_transcribe_chunk, chunks, chunksize=1)
+    offsets = [start / SAMPLE_RATE for start, _ in bounds]
+    return stitch_segments(chunk_results, offsets)
+
+def prepare_audio(input_path: str, output_dir: str, save_audio: bool = True) -> dict:
+    """解码阶段：解码音频；视频文件的 .wav 在后台线程中保存
+
+    返回 {"audio": 16 kHz 音频数组, "save_thread": 保存线程或 None, "audio_output_path": .wav 路径}
+    """
+    # 确保输出目录存在
+    os.makedirs(output_dir, exist_ok=True)
+
     if is_video_file(input_path):
         print("检测到视频文件，正在提取音频...")
-        audio_path = extract_audio(input_path)
-        delete_audio_after = True
-    else:
-        audio_path = input_path
-        delete_audio_after = False
+    with instrumentation.span("extract_audio", file=input_path) as span:
+        audio = extract_audio(input_path)
+        span["audio_duration"] = len(audio) / SAMPLE_RATE
+
+    prepared = {"audio": audio, "save_thread": None, "audio_output_path": None}
+    # 如果输入为视频，在转录的同时将解码后的音频保存到output目录
+    if save_audio and is_video_file(input_path):
+        prepared["audio_output_path"] = get_output_path(input_path, output_dir, ".wav")
+        prepared["save_thread"] = save_wav_async(audio, prepared["audio_output_path"])
+    return prepared
+
+def transcribe_audio(audio: np.ndarray, model, chunk_pool=None, chunk_seconds: float = 300,
+                     cache: TranscriptCache = None, model_name: str = "base") -> list:
+    """转录阶段：返回 Whisper 分段列表，优先使用缓存"""
+    use_chunks = chunk_pool is not None and len(audio) > chunk_seconds * SAMPLE_RATE
+    segments = None
+    if cache is not None:
+        # 分片转录的结果与整段转录不同，分片参数也计入缓存键
+        options = {"chunk_seconds": chunk_seconds} if use_chunks else {}
+        cache_key = cache.make_key(hash_audio(audio), "whisper", model_name, options=options)
+        segments = cache.get(cache_key)
+
+    if segments is not None:
+        print("命中转录缓存，跳过 Whisper 转录")
+        return segments
 
     print("转录处理中，请稍候……")
-    result = model.transcribe(audio_path)
-    segments = result["segments"]
-    
-    # 确保输出目录存在
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 生成字幕文件
-    output_files = {
-        ".srt": generate_srt,
-        ".vtt": generate_vtt,
-        ".lrc": generate_lrc,
-        ".smi": generate_smi
-    }
-    
-    for ext, generator in output_files.items():
-        output_path = get_output_path(input_path, output_dir, ext)
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(generator(segments))
+    with instrumentation.span("transcribe", audio_duration=len(audio) / SAMPLE_RATE):
+        if use_chunks:
+            segments = transcribe_in_chunks(audio, chunk_pool, chunk_seconds)
+        else:
+            result = model.transcribe(audio)
+            segments = result["segments"]
+    if cache is not None:
+        cache.put(cache_key, segments)
+    return segments
+
+def write_outputs(input_path: str, output_dir: str, prepared: dict, segments: list,
+                  native_beat_rate: bool = False, archive_dir: str = None) -> dict:
+    """输出阶段：写分段附属文件和字幕文件、检测节拍并等待音频保存完成，返回 {扩展名: 输出文件路径}
+
+    传入 archive_dir 时，同时把结果追加到列式归档（见 transcript_archive.py），后端分区为 whisper。
+    """
+    audio_duration = len(prepared["audio"]) / SAMPLE_RATE
+    saved_files = {}
+    with instrumentation.span("write_subtitles", audio_duration=audio_duration, file=input_path):
+        transcript = Transcript.from_whisper(segments)
+        sidecar_path = get_output_path(input_path, output_dir, SIDECAR_EXT)
+        save_segments_sidecar(transcript, sidecar_path)
+        saved_files[SIDECAR_EXT] = sidecar_path
+
+        # 一次遍历分段，同时写出所有字幕文件
+        outputs = {get_output_path(input_path, output_dir, ext): sink for ext, sink in SUBTITLE_SINKS.items()}
+        failures = write_files(transcript, outputs)
+        for ext, output_path in zip(SUBTITLE_SINKS, outputs):
+            if output_path in failures:
+                print(f"保存{ext}文件失败: {failures[output_path]}")
+            else:
+                saved_files[ext] = output_path
     
     print(f"字幕文件生成成功，保存在目录: {output_dir}")
 
+    if archive_dir:
+        # 追加到按日期和后端分区的列式归档，供跨文件统计分析
+        try:
+            TranscriptArchive(archive_dir).append(transcript, input_path, "whisper")
+            saved_files["archive"] = archive_dir
+        except Exception as e:
+            print(f"追加转录归档失败: {e}")
+
     # 检测节拍并保存到文件
     print("检测节拍中，请稍候……")
-    beat_times = detect_beats(audio_path)
+    with instrumentation.span("detect_beats", audio_duration=audio_duration, file=input_path):
+        if native_beat_rate:
+            beat_times = detect_beats_from_file(input_path)
+        else:
+            beat_times = detect_beats(prepared["audio"], SAMPLE_RATE)
     beat_output_path = get_output_path(input_path, output_dir, ".beats.txt")
     with open(beat_output_path, "w", encoding="utf-8") as f:
         f.write(",".join(f"{beat_time:.1f}" for beat_time in beat_times))
+    saved_files[".beats.txt"] = beat_output_path
     print(f"节拍文件生成成功，保存在: {beat_output_path}")
-    # print("检测节拍中，请稍候……")
-    # beat_times = detect_beats(audio_path)
-    # beat_output_path = get_output_path(input_path, output_dir, ".beats.txt")
-    # save_beats_to_file(beat_times, beat_output_path)
-    # print(f"节拍文件生成成功，保存在: {beat_output_path}")
-
-    # 如果创建了临时音频文件，保存音频文件到output目录
-    if delete_audio_after:
-        audio_output_path = get_output_path(input_path, output_dir, ".wav")
-        os.rename(audio_path, audio_output_path)
-        print(f"音频文件保存在: {audio_output_path}")
-    
 
-def main(input_paths, output_dir="output"):
+    if prepared["save_thread"] is not None:
+        prepared["save_thread"].join()
+        saved_files[".wav"] = prepared["audio_output_path"]
+        print(f"音频文件保存在: {prepared['audio_output_path']}")
+
+    return saved_files
+
+def process_single_file(input_path: str, output_dir: str, model, native_beat_rate: bool = False,
+                        save_audio: bool = True, chunk_pool=None, chunk_seconds: float = 300,
+                        cache: TranscriptCache = None, model_name: str = "base", archive_dir: str = None) -> dict:
+    """处理单个文件的转录
+
+    音频只解码一次，得到的 16 kHz 数组同时用于 Whisper 转录和节拍检测；
+    仅当 native_beat_rate 为 True 时才额外按原始采样率解码一份用于节拍检测。
+    视频文件的音频在后台线程中保存，可通过 save_audio=False 关闭。
+    传入 chunk_pool 时，长于 chunk_seconds 的音频会切分后并行转录。
+    传入 cache 时，以音频哈希和模型参数查询缓存，命中则跳过 Whisper 转录。
+    传入 archive_dir 时，结果同时追加到列式归档。
+    返回 {扩展名: 输出文件路径}。
+    """
+    print(f"\n处理文件: {input_path}")
+    prepared = prepare_audio(input_path, output_dir, save_audio)
+    segments = transcribe_audio(prepared["audio"], model, chunk_pool, chunk_seconds, cache, model_name)
+    return write_outputs(input_path, output_dir, prepared, segments, native_beat_rate, archive_dir)
+
+# 流水线中预先解码、等待转录的文件数
+_PIPELINE_PREFETCH = 2
+# 输出阶段（节拍检测与写文件）的线程数
+_PIPELINE_OUTPUT_WORKERS = 2
+
+def process_files_pipelined(input_paths, output_dir: str, model, native_beat_rate: bool = False,
+                            save_audio: bool = True, chunk_pool=None, chunk_seconds: float = 300,
+                            cache: TranscriptCache = None, model_name: str = "base",
+                            archive_dir: str = None) -> None:
+    """以流水线方式批量处理文件
+
+    解码线程提前解码后续文件，放入有界队列；当前线程只负责转录；
+    节拍检测和写文件交给输出线程池。队列和待输出任务数都有上限，
+    避免音频数组在内存中堆积。
+    """
+    total_files = len(input_paths)
+    decoded = queue.Queue(maxsize=_PIPELINE_PREFETCH)
+
+    def decode_stage():
+        for input_path in input_paths:
+            try:
+                decoded.put((input_path, prepare_audio(input_path, output_dir, save_audio), None))
+            except Exception as e:
+                decoded.put((input_path, None, e))
+        decoded.put(None)
+
+    threading.Thread(target=decode_stage, daemon=True).start()
+
+    finished = 0
+
+    def report(input_path, error=None):
+        nonlocal finished
+        finished += 1
+        if error is None:
+            print(f"[{finished}/{total_files}] 文件处理完成: {input_path}")
+        else:
+            print(f"[{finished}/{total_files}] 处理文件时出错 {input_path}: {str(error)}")
+
+    def wait_output(pending_item):
+        input_path, future = pending_item
+        try:
+            future.result()
+            report(input_path)
+        except Exception as e:
+            report(input_path, e)
+
+    pending = collections.deque()
+    with ThreadPoolExecutor(max_workers=_PIPELINE_OUTPUT_WORKERS) as executor:
+        while True:
+            item = decoded.get()
+            if item is None:
+                break
+            input_path, prepared, error = item
+            if error is not None:
+                report(input_path, error)
+                continue
+
+            print(f"\n处理文件: {input_path}")
+            try:
+                segments = transcribe_audio(prepared["audio"], model, chunk_pool, chunk_seconds,
+                                            cache, model_name)
+            except Exception as e:
+                report(input_path, e)
+                continue
+
+            pending.append((input_path, executor.submit(
+                write_outputs, input_path, output_dir, prepared, segments, native_beat_rate, archive_dir
+            )))
+            while len(pending) > _PIPELINE_OUTPUT_WORKERS:
+                wait_output(pending.popleft())
+
+        while pending:
+            wait_output(pending.popleft())
+
+# 工作进程内的 Whisper 模型，每个进程只在启动时加载一次
+_worker_model = None
+
+def _init_worker(model_name: str, torch_threads: int) -> None:
+    """进程池初始化：限制 torch 线程数并预加载模型"""
+    global _worker_model
+    import torch
+    import whisper
+    warnings.filterwarnings("ignore", message="FP16 is not supported on CPU; using FP32 instead")
+    # 各进程平分 CPU 核心，避免 intra-op 线程相互争抢
+    torch.set_num_threads(torch_threads)
+    _worker_model = whisper.load_model(model_name)
+
+def _worker_process_file(task):
+    """在工作进程中处理单个文件，返回 (文件路径, 错误信息, 阶段统计记录)"""
+    input_path, output_dir, options = task
+    try:
+        process_single_file(input_path, output_dir, _worker_model, **options)
+        return input_path, None, instrumentation.drain()
+    except Exception as e:
+        return input_path, str(e), instrumentation.drain()
+
+def _worker_transcribe_chunk(chunk: np.ndarray) -> list:
+    """在工作进程中转录一个音频片段，返回片段内的分段列表"""
+    return _worker_model.transcribe(chunk)["segments"]
+
+def process_files_parallel(input_paths, output_dir: str, model_name: str, workers: int,
+                           **options) -> None:
+    """使用进程池并行处理多个文件，每个工作进程持有一份预加载的模型"""
+    workers = min(workers, len(input_paths))
+    torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    # 子进程在导入 torch 时读取该变量，需在启动进程池前设置
+    os.environ.setdefault("OMP_NUM_THREADS", str(torch_threads))
+    print(f"启动 {workers} 个工作进程，每个进程使用 {torch_threads} 个 torch 线程")
+
+    total_files = len(input_paths)
+    options["model_name"] = model_name
+    tasks = [(input_path, output_dir, options) for input_path in input_paths]
+    # 使用 spawn 启动方式，避免 fork 后 torch 线程池状态不一致
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(workers, initializer=_init_worker, initargs=(model_name, torch_threads)) as pool:
+        # chunksize=1 让空闲进程逐个从共享队列领取文件
+        results = pool.imap_unordered(_worker_process_file, tasks, chunksize=1)
+        for i, (input_path, error, spans) in enumerate(results, 1):
+            instrumentation.extend(spans)
+            if error is None:
+                print(f"[{i}/{total_files}] 文件处理完成: {input_path}")
+            else:
+                print(f"[{i}/{total_files}] 处理文件时出错 {input_path}: {error}")
+
+def main(input_paths, output_dir="output", workers=1, model_name="base", native_beat_rate=False,
+         save_audio=True, long_file_workers=1, chunk_seconds=300, cache=None, use_daemon=True,
+         cache_options=None, archive_dir=None):
+    """
+    cache_options 为命令行显式指定的 cache_dir、cache_max_mb，交给守护进程处理时随任务发送；
+    archive_dir 为列式归档目录，为空时不归档
+    """
     # 忽略 FP16 警告
     warnings.filterwarnings("ignore", message="FP16 is not supported on CPU; using FP32 instead")
+    # 守护进程的工作目录不同，使用绝对路径
+    archive_dir = os.path.abspath(archive_dir) if archive_dir else None
 
     # 创建带日期的输出子目录
     date_subdir = datetime.datetime.now().strftime("%Y%m%d")
     output_dir = os.path.join(output_dir, date_subdir)
     
-    print("正在加载 Whisper 模型……选base模型速度快，但是如果效果太差选large 是多语言的")
-    model = whisper.load_model("base")
-    
     total_files = len(input_paths)
     print(f"\n共发现 {total_files} 个文件待处理")
     print(f"输出目录: {output_dir}")
-    
-    for i, input_path in enumerate(input_paths, 1):
-        print(f"\n[{i}/{total_files}] 开始处理文件...")
-        try:
-            process_single_file(input_path, output_dir, model)
-            print(f"文件处理完成: {input_path}")
-        except Exception as e:
-            print(f"处理文件时出错 {input_path}: {str(e)}")
-            continue
+
+    if workers > 1 and total_files > 1:
+        if long_file_workers > 1:
+            print("提示：多进程批量模式下不启用长音频分片转录")
+        process_files_parallel(input_paths, output_dir, model_name, workers,
+                               native_beat_rate=native_beat_rate, save_audio=save_audio, cache=cache,
+                               archive_dir=archive_dir)
+        print("\n所有文件处理完成！")
+        return
+
+    # 单进程模式下优先交给已加载模型的守护进程处理
+    if use_daemon and long_file_workers <= 1:
+        from transcribe_daemon import submit_job
+        results = submit_job(input_paths, output_dir, model_name, native_beat_rate=native_beat_rate,
+                             save_audio=save_audio, archive_dir=archive_dir, use_cache=cache is not None,
+                             **(cache_options or {}))
+        if results is not None:
+            for i, result in enumerate(results, 1):
+                if result["error"] is None:
+                    print(f"[{i}/{total_files}] 文件处理完成: {result['input']}")
+                    for output_path in result["outputs"].values():
+                        print(f"  {output_path}")
+                else:
+                    print(f"[{i}/{total_files}] 处理文件时出错 {result['input']}: {result['error']}")
+            print("\n所有文件处理完成！")
+            return
+        print("转录守护进程不可用，在当前进程中处理")
+
+    print(f"正在加载 Whisper 模型（{model_name}）……选base模型速度快，但是如果效果太差选large 是多语言的")
+    import whisper  # 延迟导入，使用守护进程时不必加载 torch/whisper
+    model = whisper.load_model(model_name)
+
+    # 长音频模式：预先启动进程池，所有长文件复用同一批已加载模型的工作进程
+    chunk_pool = None
+    if long_file_workers > 1:
+        torch_threads = max(1, (os.cpu_count() or 1) // long_file_workers)
+        os.environ.setdefault("OMP_NUM_THREADS", str(torch_threads))
+        chunk_pool = multiprocessing.get_context("spawn").Pool(
+            long_file_workers, initializer=_init_worker, initargs=(model_name, torch_threads)
+        )
+
+    try:
+        # 解码、转录、输出三个阶段重叠执行
+        process_files_pipelined(input_paths, output_dir, model, native_beat_rate=native_beat_rate,
+                                save_audio=save_audio, chunk_pool=chunk_pool,
+                                chunk_seconds=chunk_seconds, cache=cache, model_name=model_name,
+                                archive_dir=archive_dir)
+    finally:
+        if chunk_pool is not None:
+            chunk_pool.close()
+            chunk_pool.join()
 
     print("\n所有文件处理完成！")
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("用法：python transcribe.py <音频或视频文件路径1> [文件路径2 ...]")
+def _render_sidecar(task):
+    """根据一个附属文件重新生成字幕，返回 (附属文件路径, 错误信息)"""
+    sidecar_path, output_dir, exts = task
+    try:
+        segments = load_segments_sidecar(sidecar_path)
+        basename = os.path.basename(sidecar_path)[:-len(SIDECAR_EXT)]
+        output_dir = output_dir or os.path.dirname(sidecar_path)
+        os.makedirs(output_dir, exist_ok=True)
+        failures = write_files(segments, {os.path.join(output_dir, f"{basename}{ext}"): SUBTITLE_SINKS[ext]
+                                          for ext in exts})
+        if failures:
+            return sidecar_path, "; ".join(f"{path}: {error}" for path, error in failures.items())
+        return sidecar_path, None
+    except Exception as e:
+        return sidecar_path, str(e)
+
+def render_main(sidecar_paths, formats, output_dir=None, workers=None):
+    """render 子命令：不加载模型，由 .segments.json 附属文件并行重新生成字幕"""
+    exts = [f".{name.strip().lstrip('.')}" for name in formats]
+    unknown = [ext for ext in exts if ext not in SUBTITLE_SINKS]
+    if unknown:
+        print(f"不支持的字幕格式: {', '.join(unknown)}")
         sys.exit(1)
-    
-    # 获取所有输入文件路径
-    input_paths = sys.argv[1:]
-    main(input_paths)
\ No newline at end of file
+
+    tasks = [(path, output_dir, exts) for path in sidecar_paths]
+    total_files = len(tasks)
+    failed = 0
+    print(f"共 {total_files} 个附属文件，生成格式: {', '.join(exts)}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for sidecar_path, error in executor.map(_render_sidecar, tasks, chunksize=16):
+            if error is not None:
+                failed += 1
+                print(f"生成失败 {sidecar_path}: {error}")
+    print(f"\n生成完成：成功 {total_files - failed}/{total_files}")
+
+def chunk_seconds_arg(value: str) -> float:
+    """--chunk-seconds 的参数类型：不小于 MIN_CHUNK_SECONDS 的秒数"""
+    try:
+        seconds = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的秒数: {value}")
+    if not seconds >= MIN_CHUNK_SECONDS:
+        raise argparse.ArgumentTypeError(f"片段时长不能小于 {MIN_CHUNK_SECONDS} 秒: {value}")
+    return seconds
+
+def parse_render_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="transcribe.py render",
+        description="由 .segments.json 附属文件重新生成字幕，不运行 Whisper"
+    )
+    parser.add_argument("sidecar_files", nargs="+", help=f"{SIDECAR_EXT} 附属文件路径")
+    parser.add_argument(
+        "--formats",
+        default="srt,vtt,lrc,smi",
+        help="要生成的格式，用逗号分隔 (默认: srt,vtt,lrc,smi)"
+    )
+    parser.add_argument("--output-dir", help="输出目录 (默认: 与附属文件相同的目录)")
+    parser.add_argument("--workers", type=int, help="并行进程数 (默认: CPU 核心数)")
+    return parser.parse_args(argv)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="使用 Whisper 将音频或视频文件转录为字幕")
+    parser.add_argument("input_files", nargs="+", help="音频或视频文件路径")
+    parser.add_argument("--output-dir", default="output", help="输出目录 (默认: output)")
+    parser.add_argument("--model", default="base", help="Whisper 模型名称 (默认: base)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="并行处理文件的进程数，每个进程加载一份模型 (默认: 1)"
+    )
+    parser.add_argument(
+        "--native-beat-rate",
+        action="store_true",
+        help="按原始采样率（不超过 22050 Hz）额外流式解码一次用于节拍检测（默认复用 16 kHz 音频）"
+    )
+    parser.add_argument(
+        "--no-save-audio",
+        dest="save_audio",
+        action="store_false",
+        help="不保存视频文件中提取出的 .wav 音频"
+    )
+    parser.add_argument(
+        "--long-file-workers",
+        type=int,
+        default=1,
+        help="长音频模式的进程数：在静音处切分后并行转录 (默认: 1，不切分)"
+    )
+    parser.add_argument(
+        "--chunk-seconds",
+        type=chunk_seconds_arg,
+        default=300,
+        help=f"长音频模式下每个片段的最大时长（秒），更长的文件才会切分，不小于 {MIN_CHUNK_SECONDS:g} (默认: 300)"
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="不使用转录结果缓存"
+    )
+    parser.add_argument("--cache-dir", help="转录缓存目录 (默认: ~/.cache/transcribe)")
+    parser.add_argument("--cache-max-mb", type=float, help="转录缓存总大小上限 MB (默认: 1024)")
+    parser.add_argument("--metrics-report", help="将各阶段耗时与资源统计保存为 JSON 报告的路径")
+    parser.add_argument(
+        "--archive-dir",
+        default=os.getenv("TRANSCRIBE_ARCHIVE_DIR"),
+        help="同时把转录结果追加到该目录下的 Parquet 列式归档，需要 pyarrow (默认: 环境变量 TRANSCRIBE_ARCHIVE_DIR)"
+    )
+    parser.add_argument(
+        "--no-daemon",
+        dest="use_daemon",
+        action="store_false",
+        help="不使用转录守护进程，始终在当前进程中加载模型"
+    )
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "render":
+        render_args = parse_render_args(sys.argv[2:])
+        render_main(render_args.sidecar_files, render_args.formats.split(","),
+                    output_dir=render_args.output_dir, workers=render_args.workers)
+        sys.exit(0)
+
+    args = parse_args()
+    cache = TranscriptCache(args.cache_dir, args.cache_max_mb) if args.use_cache else None
+    cache_options = {name: value for name, value in (("cache_dir", args.cache_dir),
+                                                     ("cache_max_mb", args.cache_max_mb)) if value is not None}
+    main(args.input_files, args.output_dir, workers=args.workers, model_name=args.model,
+         native_beat_rate=args.native_beat_rate, save_audio=args.save_audio,
+         long_file_workers=args.long_file_workers, chunk_seconds=args.chunk_seconds, cache=cache,
+         use_daemon=args.use_daemon, cache_options=cache_options, archive_dir=args.archive_dir)
+    if args.metrics_report:
+        instrumentation.save_report(args.metrics_report)
+        print(f"阶段统计报告保存在: {args.metrics_report}")
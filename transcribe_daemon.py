@@ -0,0 +1,242 @@
+"""
+转录守护进程
+
+常驻内存并持有已加载的 Whisper 模型，通过本地 Unix socket 接收转录任务，
+使 transcribe.py 的每次调用不必重复导入 torch/whisper 和加载模型。
+
+启动守护进程：
+    python transcribe_daemon.py --models base,large
+
+之后 transcribe.py 会自动把任务发送给守护进程；守护进程未运行时在当前进程中处理。
+"""
+import os
+import sys
+import json
+import stat
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+import warnings
+from typing import Optional
+
+# 单条消息的结束符，请求和响应都是一行 JSON
+_MESSAGE_END = b"\n"
+# 连接守护进程的超时时间（秒），仅用于建立连接
+_CONNECT_TIMEOUT = 1.0
+
+
+def default_socket_path() -> str:
+    """
+    守护进程 socket 路径，可通过环境变量 TRANSCRIBE_SOCKET 覆盖
+
+    优先放在只有当前用户可写的 $XDG_RUNTIME_DIR 中，未设置时才放在 /tmp。
+    """
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    default = os.path.join(runtime_dir, "transcribe.sock") if runtime_dir else f"/tmp/transcribe-{os.getuid()}.sock"
+    return os.getenv("TRANSCRIBE_SOCKET", default)
+
+
+def _recv_message(sock: socket.socket) -> dict:
+    """读取一行 JSON 消息，对方在消息结束前关闭连接时抛出 ConnectionError"""
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise ConnectionError("连接在消息结束前关闭")
+        chunks.append(chunk)
+        if chunk.endswith(_MESSAGE_END):
+            break
+    return json.loads(b"".join(chunks).decode("utf-8"))
+
+
+def _send_message(sock: socket.socket, message: dict) -> None:
+    sock.sendall(json.dumps(message, ensure_ascii=False).encode("utf-8") + _MESSAGE_END)
+
+
+def submit_job(input_paths, output_dir: str, model_name: str = "base",
+               socket_path: Optional[str] = None, **options) -> Optional[list]:
+    """
+    将转录任务发送给守护进程
+
+    Args:
+        input_paths (list): 输入文件路径
+        output_dir (str): 输出目录
+        model_name (str): Whisper 模型名称
+        socket_path (str): 守护进程 socket 路径，默认见 default_socket_path()
+        **options: 传给 process_single_file 的其他参数，以及缓存设置 use_cache、cache_dir、cache_max_mb；
+            未指定 cache_dir/cache_max_mb 时使用守护进程启动时的缓存
+
+    Returns:
+        list: 每个文件的结果 {"input", "outputs", "error"}；守护进程未运行、socket 不属于当前用户
+            或守护进程在处理中途退出时返回 None
+    """
+    socket_path = socket_path or default_socket_path()
+    try:
+        info = os.stat(socket_path)
+    except OSError:
+        return None
+    # /tmp 中的 socket 可能由其他用户创建，不把任务发送给不属于自己的进程
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        print(f"忽略不属于当前用户的守护进程 socket: {socket_path}")
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(_CONNECT_TIMEOUT)
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            return None
+        # 转录可能很久，连接建立后不再设置超时
+        sock.settimeout(None)
+        try:
+            _send_message(sock, {
+                "input_paths": [os.path.abspath(path) for path in input_paths],
+                "output_dir": os.path.abspath(output_dir),
+                "model": model_name,
+                "options": options,
+            })
+            response = _recv_message(sock)
+        except (OSError, ValueError) as e:
+            # 守护进程中途退出：连接断开或响应不完整
+            print(f"与守护进程的连接中断: {e}")
+            return None
+    finally:
+        sock.close()
+
+    if "error" in response:
+        raise RuntimeError(f"守护进程处理失败: {response['error']}")
+    # 合并守护进程中记录的阶段统计
+    from instrumentation import instrumentation
+    instrumentation.extend(response.get("spans", []))
+    return response["results"]
+
+
+class TranscribeDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """持有已加载模型的转录服务"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, model_names, cache=None):
+        self.models = {}
+        self.cache = cache
+        # 模型不是线程安全的，任务按顺序执行
+        self.job_lock = threading.Lock()
+        for model_name in model_names:
+            self.get_model(model_name)
+        super().__init__(socket_path, TranscribeRequestHandler)
+
+    def get_model(self, model_name: str):
+        """获取已加载的模型，首次使用时加载"""
+        if model_name not in self.models:
+            import whisper
+            print(f"正在加载 Whisper 模型（{model_name}）……")
+            self.models[model_name] = whisper.load_model(model_name)
+        return self.models[model_name]
+
+    def _job_cache(self, options: dict):
+        """本次任务使用的缓存：客户端指定了缓存目录或容量时按其设置，否则使用守护进程的缓存"""
+        from transcript_cache import TranscriptCache
+
+        use_cache = options.pop("use_cache", True)
+        cache_dir = options.pop("cache_dir", None)
+        cache_max_mb = options.pop("cache_max_mb", None)
+        if not use_cache:
+            return None
+        if cache_dir is not None or cache_max_mb is not None:
+            return TranscriptCache(cache_dir, cache_max_mb)
+        return self.cache
+
+    def run_job(self, request: dict) -> dict:
+        """
+        在当前进程中逐个处理任务中的文件
+
+        Returns:
+            dict: {"results": 每个文件的结果, "spans": 本次任务的阶段统计记录}
+        """
+        from transcribe import process_single_file
+        from instrumentation import instrumentation
+
+        options = dict(request.get("options", {}))
+        cache = self._job_cache(options)
+        model_name = request.get("model", "base")
+        results = []
+        with self.job_lock:
+            # 同一时间只有一个任务在记录，在锁内取出的记录只属于本次任务
+            try:
+                model = self.get_model(model_name)
+                for input_path in request["input_paths"]:
+                    try:
+                        outputs = process_single_file(
+                            input_path, request["output_dir"], model,
+                            cache=cache, model_name=model_name, **options
+                        )
+                        results.append({"input": input_path, "outputs": outputs, "error": None})
+                    except Exception as e:
+                        results.append({"input": input_path, "outputs": {}, "error": str(e)})
+            finally:
+                spans = instrumentation.drain()
+        return {"results": results, "spans": spans}
+
+
+class TranscribeRequestHandler(socketserver.BaseRequestHandler):
+    """处理一次连接：读取任务、执行并返回结果路径"""
+
+    def handle(self):
+        try:
+            request = _recv_message(self.request)
+            response = self.server.run_job(request)
+        except Exception as e:
+            response = {"error": str(e)}
+        _send_message(self.request, response)
+
+
+def serve(socket_path: str, model_names, cache=None) -> None:
+    """启动守护进程并阻塞运行"""
+    warnings.filterwarnings("ignore", message="FP16 is not supported on CPU; using FP32 instead")
+    if os.path.exists(socket_path):
+        # 清理上次异常退出残留的 socket 文件
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            raise RuntimeError(f"守护进程已在运行: {socket_path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)
+        finally:
+            probe.close()
+
+    server = TranscribeDaemon(socket_path, model_names, cache=cache)
+    os.chmod(socket_path, 0o600)
+    # 收到 SIGTERM 时同样走 finally 清理 socket 文件
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"转录守护进程已启动，监听: {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n守护进程退出")
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main():
+    from transcript_cache import TranscriptCache
+
+    parser = argparse.ArgumentParser(description="常驻内存的 Whisper 转录守护进程")
+    parser.add_argument("--socket", default=default_socket_path(), help="Unix socket 路径")
+    parser.add_argument("--models", default="base", help="启动时预加载的模型，用逗号分隔 (默认: base)")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="不使用转录结果缓存")
+    parser.add_argument("--cache-dir", help="转录缓存目录 (默认: ~/.cache/transcribe)")
+    parser.add_argument("--cache-max-mb", type=float, help="转录缓存总大小上限 MB (默认: 1024)")
+    args = parser.parse_args()
+
+    cache = TranscriptCache(args.cache_dir, args.cache_max_mb) if args.use_cache else None
+    model_names = [name.strip() for name in args.models.split(",") if name.strip()]
+    serve(args.socket, model_names, cache=cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+紧凑的转录结果模型
+
+Whisper 的分段使用 start/end，阿里云的分段使用 start_time/end_time/words，两者都是每个词一个 dict，
+长转录每个词要占数百字节，使用方处处要写带默认值的 .get()。Transcript 是两个后端共用的列式结构：
+
+- 分段和词的开始、结束时间与置信度存放在 array('d') 中；
+- 文本拼接成一个字符串缓冲区，相同的文本只存一次（逐字结果里重复的字很多），
+  分段和词只记录文本编号；
+- word_offsets 记录每个分段的词在词数组中的范围，第 i 个分段的词为
+  [word_offsets[i], word_offsets[i + 1])。
+
+缺失的字段在构造时按输出格式原有的约定补齐：分段结束时间默认为开始时间 + 2 秒，
+词的结束时间默认为开始时间 + 1 秒，置信度未知时为 -1。安装了 NumPy 时可用 np.frombuffer
+直接查看各数组，不需要复制。
+
+构造时传入 keep_segments=True 才保留对原始分段 dict 的引用（segments，不复制），JSON 输出据此
+原样写出各字段，与直接 json.dumps 分段列表的结果一致；只在需要输出 JSON 时保留，否则原始分段
+可随调用方释放，只留下紧凑的数组。未保留时以及从二进制文件读回的对象 segments 为 None。
+
+save/load 以二进制列式文件保存和读取：各数组的原始字节依次写出，读取时整块读入数组，
+不为每个词重建 dict，比解析 JSON 快得多。
+"""
+import sys
+import json
+import struct
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+Segment = Dict[str, Any]
+
+# 二进制文件的标识和格式版本
+BINARY_MAGIC = b'TRSC'
+BINARY_VERSION = 1
+# 二进制文件中依次保存的数组
+_ARRAY_FIELDS = ('starts', 'ends', 'confidences', 'text_ids', 'word_offsets',
+                 'word_starts', 'word_ends', 'word_confidences', 'word_text_ids', 'text_offsets')
+
+
+class _StringPool:
+    """构造时使用的文本驻留表：相同的文本只追加一次到缓冲区"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.parts: List[str] = []
+        self.offsets = array('q', [0])
+
+    def add(self, text: str) -> int:
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.parts)
+            self.parts.append(text)
+            self.offsets.append(self.offsets[-1] + len(text))
+        return string_id
+
+
+class Transcript:
+    """列式存储的转录结果，分段与词共用一个文本缓冲区"""
+
+    __slots__ = ('starts', 'ends', 'confidences', 'text_ids', 'word_offsets',
+                 'word_starts', 'word_ends', 'word_confidences', 'word_text_ids',
+                 'text_buffer', 'text_offsets', 'segments', '_strings')
+
+    def __init__(self, starts: array, ends: array, confidences: array, text_ids: array, word_offsets: array,
+                 word_starts: array, word_ends: array, word_confidences: array, word_text_ids: array,
+                 text_buffer: str, text_offsets: array, segments: Optional[List[Segment]] = None):
+        self.starts = starts
+        self.ends = ends
+        self.confidences = confidences
+        self.text_ids = text_ids
+        self.word_offsets = word_offsets
+        self.word_starts = word_starts
+        self.word_ends = word_ends
+        self.word_confidences = word_confidences
+        self.word_text_ids = word_text_ids
+        self.text_buffer = text_buffer
+        self.text_offsets = text_offsets
+        # 构造时要求保留的原始分段，未保留时为 None
+        self.segments = segments
+        # 按编号取出的文本，首次使用时从缓冲区切出
+        self._strings: Optional[List[str]] = None
+
+    @classmethod
+    def _build(cls, segments: Iterable[Segment], segment_keys: Optional[tuple],
+               word_keys: Optional[tuple], keep_segments: bool = False) -> 'Transcript':
+        """
+        逐个分段填充各数组
+
+        segment_keys/word_keys 为 (开始, 结束, 文本, 置信度) 字段名；为 None 时按分段自动识别两种命名。
+        keep_segments 为 True 时同时保留原始分段的引用。
+        """
+        starts, ends, confidences, text_ids = array('d'), array('d'), array('d'), array('q')
+        word_starts, word_ends, word_confidences, word_text_ids = array('d'), array('d'), array('d'), array('q')
+        word_offsets = array('q', [0])
+        pool = _StringPool()
+        originals = [] if keep_segments else None
+
+        for segment in segments:
+            if keep_segments:
+                originals.append(segment)
+            if segment_keys is not None:
+                start_key, end_key, text_key, confidence_key = segment_keys
+            elif 'start' in segment or 'end' in segment:
+                start_key, end_key, text_key, confidence_key = 'start', 'end', 'text', 'confidence'
+            else:
+                start_key, end_key, text_key, confidence_key = 'start_time', 'end_time', 'text', 'confidence'
+            start = segment.get(start_key, 0)
+            starts.append(start)
+            ends.append(segment.get(end_key, start + 2))
+            confidences.append(segment.get(confidence_key, -1))
+            text_ids.append(pool.add(segment.get(text_key) or ''))
+
+            for word in segment.get('words') or ():
+                if word_keys is not None:
+                    start_key, end_key, text_key, confidence_key = word_keys
+                elif 'word' in word or 'start' in word:
+                    start_key, end_key, text_key, confidence_key = 'start', 'end', 'word', 'probability'
+                else:
+                    start_key, end_key, text_key, confidence_key = 'start_time', 'end_time', 'text', 'confidence'
+                word_start = word.get(start_key, 0)
+                word_starts.append(word_start)
+                word_ends.append(word.get(end_key, word_start + 1))
+                word_confidences.append(word.get(confidence_key, -1))
+                word_text_ids.append(pool.add(word.get(text_key) or ''))
+            word_offsets.append(len(word_starts))
+
+        return cls(starts, ends, confidences, text_ids, word_offsets,
+                   word_starts, word_ends, word_confidences, word_text_ids,
+                   ''.join(pool.parts), pool.offsets, originals)
+
+    @classmethod
+    def from_segments(cls, segments: Iterable[Segment], keep_segments: bool = False) -> 'Transcript':
+        """由任一后端的分段列表构造，每个分段和词分别识别 Whisper 或阿里云的字段名"""
+        return cls._build(segments, None, None, keep_segments)
+
+    @classmethod
+    def from_whisper(cls, result: Union[Dict[str, Any], List[Segment]], keep_segments: bool = False) -> 'Transcript':
+        """由 model.transcribe 的返回值（或其中的 segments 列表）构造"""
+        segments = result['segments'] if isinstance(result, dict) else result
+        return cls._build(segments, ('start', 'end', 'text', 'confidence'), ('start', 'end', 'word', 'probability'),
+                          keep_segments)
+
+    @classmethod
+    def from_aliyun(cls, segments: List[Segment], keep_segments: bool = False) -> 'Transcript':
+        """由 AliyunASRClient 各识别接口返回的分段列表构造"""
+        keys = ('start_time', 'end_time', 'text', 'confidence')
+        return cls._build(segments, keys, keys, keep_segments)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.word_starts)
+
+    @property
+    def duration(self) -> float:
+        """最后一个分段的结束时间，没有分段时为 0"""
+        return max(self.ends) if len(self.ends) else 0
+
+    @property
+    def strings(self) -> List[str]:
+        """按编号排列的全部驻留文本"""
+        if self._strings is None:
+            buffer, offsets = self.text_buffer, self.text_offsets
+            self._strings = [buffer[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return self._strings
+
+    def texts(self) -> List[str]:
+        """各分段的文本"""
+        strings = self.strings
+        return [strings[text_id] for text_id in self.text_ids]
+
+    def word_texts(self) -> List[str]:
+        """各词的文本"""
+        strings = self.strings
+        return [strings[text_id] for text_id in self.word_text_ids]
+
+    def slice(self, start: int, stop: int) -> 'Transcript':
+        """取第 start 到 stop 个分段（不含 stop），与原对象共用文本缓冲区"""
+        stop = min(stop, len(self))
+        first_word, last_word = self.word_offsets[start], self.word_offsets[stop]
+        word_offsets = array('q', (offset - first_word for offset in self.word_offsets[start:stop + 1]))
+        part = Transcript(
+            self.starts[start:stop], self.ends[start:stop], self.confidences[start:stop],
+            self.text_ids[start:stop], word_offsets,
+            self.word_starts[first_word:last_word], self.word_ends[first_word:last_word],
+            self.word_confidences[first_word:last_word], self.word_text_ids[first_word:last_word],
+            self.text_buffer, self.text_offsets,
+            None if self.segments is None else self.segments[start:stop],
+        )
+        # 先在原对象上切出文本列表，各切片共用，不必各自切分整个缓冲区
+        part._strings = self.strings
+        return part
+
+    def nbytes(self) -> int:
+        """各数组与文本缓冲区占用的字节数（估算）"""
+        arrays = [getattr(self, name) for name in _ARRAY_FIELDS]
+        return sum(len(values) * values.itemsize for values in arrays) + len(self.text_buffer.encode('utf-8'))
+
+    def save(self, path: str) -> None:
+        """
+        保存为二进制列式文件
+
+        文件依次为 4 字节标识、4 字节小端头部长度、JSON 头部（版本、字节序、各数组的类型和长度），
+        然后是各数组的原始字节和 UTF-8 文本缓冲区。
+        """
+        text = self.text_buffer.encode('utf-8')
+        header = json.dumps({
+            'version': BINARY_VERSION,
+            'byteorder': sys.byteorder,
+            'arrays': [[name, getattr(self, name).typecode, len(getattr(self, name))] for name in _ARRAY_FIELDS],
+            'text_bytes': len(text),
+        }).encode('utf-8')
+        with open(path, 'wb') as f:
+            f.write(BINARY_MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for name in _ARRAY_FIELDS:
+                getattr(self, name).tofile(f)
+            f.write(text)
+
+    @classmethod
+    def load(cls, path: str) -> 'Transcript':
+        """
+        读取 save 保存的二进制文件
+
+        Raises:
+            ValueError: 文件不是该格式或版本不支持
+        """
+        with open(path, 'rb') as f:
+            if f.read(4) != BINARY_MAGIC:
+                raise ValueError(f"不是转录结果二进制文件: {path}")
+            (header_size,) = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_size))
+            if header['version'] != BINARY_VERSION:
+                raise ValueError(f"不支持的转录结果文件版本: {header['version']}")
+            arrays = {}
+            for name, typecode, count in header['arrays']:
+                values = array(typecode)
+                values.fromfile(f, count)
+                if header['byteorder'] != sys.byteorder:
+                    values.byteswap()
+                arrays[name] = values
+            text = f.read(header['text_bytes']).decode('utf-8')
+        return cls(text_buffer=text, **arrays)
+
+    def to_segments(self, style: str = 'aliyun') -> List[Segment]:
+        """
+        还原为分段列表，供仍需 dict 结构的代码使用（如 JSON 输出、缓存）
+
+        Args:
+            style (str): 'aliyun' 使用 start_time/end_time/words；'whisper' 使用 start/end，词使用 word/probability
+
+        未知的置信度还原为整数 -1，与识别接口的返回值一致；时间均为浮点数。
+        """
+        def confidence(value):
+            return -1 if value == -1 else value
+
+        texts = self.texts()
+        word_texts = self.word_texts()
+        segments = []
+        for i in range(len(self)):
+            word_range = range(self.word_offsets[i], self.word_offsets[i + 1])
+            if style == 'whisper':
+                segment = {'id': i, 'start': self.starts[i], 'end': self.ends[i], 'text': texts[i]}
+                if len(word_range):
+                    segment['words'] = [{
+                        'word': word_texts[j], 'start': self.word_starts[j], 'end': self.word_ends[j],
+                        'probability': confidence(self.word_confidences[j]),
+                    } for j in word_range]
+            else:
+                segment = {
+                    'text': texts[i], 'start_time': self.starts[i], 'end_time': self.ends[i],
+                    'confidence': confidence(self.confidences[i]),
+                    'words': [{
+                        'text': word_texts[j], 'start_time': self.word_starts[j], 'end_time': self.word_ends[j],
+                        'confidence': confidence(self.word_confidences[j]),
+                    } for j in word_range],
+                }
+            segments.append(segment)
+        return segments
+
+
+def as_transcript(segments: Union[Transcript, Iterable[Segment]], keep_segments: bool = False) -> Transcript:
+    """已是 Transcript 时原样返回，否则由分段列表构造"""
+    if isinstance(segments, Transcript):
+        return segments
+    return Transcript.from_segments(segments, keep_segments)
@@ -0,0 +1,241 @@
+"""
+转录结果列式归档模块
+
+每次保存输出时，把转录结果追加到按日期和后端分区的 Parquet 数据集中，分为两张表：
+segments（每个分段一行）和 words（每个词一行）。目录结构为
+
+    <归档目录>/segments/date=YYYYMMDD/backend=aliyun/<随机名>.parquet
+    <归档目录>/words/date=YYYYMMDD/backend=aliyun/<随机名>.parquet
+
+每次追加写出的数据文件只包含一个源文件的结果，按日期、后端过滤时直接跳过不相关的目录，
+按 source 过滤时依据 Parquet 的列统计跳过不相关的文件；列式存储只读取查询用到的列。
+统计一年的输出不必再逐个解析 JSON。每次追加都会写出两个小文件，可定期运行
+
+    python transcript_archive.py compact <归档目录>
+
+把每个分区中的文件合并为一个按 source 排序的文件。
+
+依赖 pyarrow（可选），只在写入或查询归档时导入。
+"""
+import os
+import uuid
+import argparse
+from array import array
+from datetime import datetime
+from itertools import repeat
+from typing import List, Optional, Sequence, Tuple, Union
+
+from transcript import Transcript
+
+TABLES = ("segments", "words")
+
+# 日期条件：单个 "YYYYMMDD"，或 (起始, 结束) 闭区间
+DateFilter = Union[str, Tuple[str, str]]
+
+
+def _pyarrow():
+    """导入 pyarrow，未安装时给出安装提示"""
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("转录归档需要 pyarrow，请运行: pip install pyarrow") from e
+    return pyarrow
+
+
+def _column(pa, values: array, data_type):
+    """把 array.array 直接包装为 Arrow 数组，不逐个转换元素"""
+    return pa.Array.from_buffers(data_type, len(values), [None, pa.py_buffer(values)])
+
+
+def _texts(pa, transcript: Transcript, text_ids: array):
+    """按文本编号从驻留文本中取出字符串列；Parquet 写入时按列自行做字典编码，只保留本列用到的文本"""
+    return pa.array(transcript.strings, pa.string()).take(_column(pa, text_ids, pa.int64()))
+
+
+class TranscriptArchive:
+    """按日期和后端分区的转录结果 Parquet 数据集"""
+
+    def __init__(self, archive_dir: str):
+        """
+        Args:
+            archive_dir (str): 归档根目录，其下为 segments 和 words 两个数据集
+        """
+        self.archive_dir = archive_dir
+
+    def _partition_dir(self, table: str, date: str, backend: str) -> str:
+        return os.path.join(self.archive_dir, table, f"date={date}", f"backend={backend}")
+
+    def _write(self, table, directory: str) -> str:
+        """写入一个数据文件；先写隐藏的临时文件再重命名，查询时不会读到写了一半的文件"""
+        pq = _pyarrow().parquet
+        os.makedirs(directory, exist_ok=True)
+        name = f"{uuid.uuid4().hex}.parquet"
+        temp_path = os.path.join(directory, f".{name}.tmp")
+        path = os.path.join(directory, name)
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, path)
+        return path
+
+    def append(self, transcript: Transcript, source: str, backend: str, date: Optional[str] = None) -> List[str]:
+        """
+        追加一个源文件的转录结果
+
+        Args:
+            transcript (Transcript): 转录结果
+            source (str): 源文件路径，统一保存为绝对路径
+            backend (str): 识别后端，如 aliyun、whisper
+            date (str): 分区日期 YYYYMMDD，默认为今天
+
+        Returns:
+            list: 写入的数据文件路径
+        """
+        pa = _pyarrow()
+        date = date or datetime.now().strftime("%Y%m%d")
+        # 同一文件无论以相对路径、绝对路径还是经守护进程提交，都记为同一个 source
+        source = os.path.abspath(source)
+        segment_count, word_count = len(transcript), transcript.word_count
+        offsets = transcript.word_offsets
+
+        segment_words = array("q", (offsets[i + 1] - offsets[i] for i in range(segment_count)))
+        segments = pa.table({
+            "source": pa.repeat(source, segment_count),
+            "segment": pa.array(range(segment_count), pa.int64()),
+            "start": _column(pa, transcript.starts, pa.float64()),
+            "end": _column(pa, transcript.ends, pa.float64()),
+            "confidence": _column(pa, transcript.confidences, pa.float64()),
+            "word_count": _column(pa, segment_words, pa.int64()),
+            "text": _texts(pa, transcript, transcript.text_ids),
+        })
+
+        # 每个词所属的分段序号
+        word_segments = array("q")
+        for i, count in enumerate(segment_words):
+            word_segments.extend(repeat(i, count))
+        words = pa.table({
+            "source": pa.repeat(source, word_count),
+            "segment": _column(pa, word_segments, pa.int64()),
+            "start": _column(pa, transcript.word_starts, pa.float64()),
+            "end": _column(pa, transcript.word_ends, pa.float64()),
+            "confidence": _column(pa, transcript.word_confidences, pa.float64()),
+            "text": _texts(pa, transcript, transcript.word_text_ids),
+        })
+
+        return [
+            self._write(segments, self._partition_dir("segments", date, backend)),
+            self._write(words, self._partition_dir("words", date, backend)),
+        ]
+
+    def _partitions(self, table: str, date: Optional[DateFilter], backend: Optional[str]) -> List[str]:
+        """符合日期、后端条件的分区目录"""
+        directories = []
+        table_dir = os.path.join(self.archive_dir, table)
+        if not os.path.isdir(table_dir):
+            return directories
+        for date_name in sorted(os.listdir(table_dir)):
+            if not date_name.startswith("date="):
+                continue
+            value = date_name[len("date="):]
+            if date is not None and not (value == date if isinstance(date, str) else date[0] <= value <= date[1]):
+                continue
+            date_dir = os.path.join(table_dir, date_name)
+            for backend_name in sorted(os.listdir(date_dir)):
+                if backend_name.startswith("backend=") and backend in (None, backend_name[len("backend="):]):
+                    directories.append(os.path.join(date_dir, backend_name))
+        return directories
+
+    def compact(self, date: Optional[DateFilter] = None, backend: Optional[str] = None) -> int:
+        """
+        把每个分区中的数据文件合并为一个，行按 source、segment 排序，返回被合并的文件数
+
+        合并结果同样先写临时文件再重命名，随后删除原文件；重命名到删除之间查询可能读到重复的行，
+        宜在没有查询时运行。合并开始后新追加的文件不受影响，留到下次合并。
+
+        Args:
+            date: 只合并该日期 "YYYYMMDD" 或 (起始, 结束) 闭区间的分区，默认全部
+            backend (str): 只合并该后端的分区，默认全部
+        """
+        pa = _pyarrow()
+        merged = 0
+        for table in TABLES:
+            for directory in self._partitions(table, date, backend):
+                paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                               if name.endswith(".parquet") and not name.startswith("."))
+                if len(paths) < 2:
+                    continue
+                data = pa.concat_tables([pa.parquet.read_table(path, partitioning=None) for path in paths])
+                self._write(data.sort_by([("source", "ascending"), ("segment", "ascending")]), directory)
+                for path in paths:
+                    os.remove(path)
+                merged += len(paths)
+        return merged
+
+    def dataset(self, table: str = "segments"):
+        """打开一张表对应的 pyarrow Dataset，分区列 date、backend 均为字符串"""
+        pa = _pyarrow()
+        if table not in TABLES:
+            raise ValueError(f"未知的归档表: {table}，可选: {', '.join(TABLES)}")
+        partitioning = pa.dataset.partitioning(
+            pa.schema([("date", pa.string()), ("backend", pa.string())]), flavor="hive"
+        )
+        return pa.dataset.dataset(os.path.join(self.archive_dir, table), format="parquet", partitioning=partitioning)
+
+    def query(self, table: str = "segments", columns: Optional[Sequence[str]] = None,
+              date: Optional[DateFilter] = None, backend: Optional[Union[str, Sequence[str]]] = None,
+              source: Optional[Union[str, Sequence[str]]] = None, filter=None):
+        """
+        按条件读取归档，返回 pyarrow.Table
+
+        日期、后端条件只读取对应的分区目录，source 条件依据文件的列统计跳过其他文件，
+        只读取 columns 指定的列。
+
+        Args:
+            table (str): segments 或 words
+            columns (list): 需要的列，默认全部
+            date: "YYYYMMDD" 或 (起始, 结束) 闭区间
+            backend: 后端名或其列表
+            source: 源文件路径或其列表，相对路径按当前目录转换为绝对路径
+            filter: 额外的 pyarrow.dataset 表达式，与上述条件取交集
+        """
+        pa = _pyarrow()
+        field = pa.dataset.field
+        conditions = []
+        if date is not None:
+            if isinstance(date, str):
+                conditions.append(field("date") == date)
+            else:
+                conditions.append((field("date") >= date[0]) & (field("date") <= date[1]))
+        if source is not None:
+            source = os.path.abspath(source) if isinstance(source, str) else [os.path.abspath(s) for s in source]
+        for name, value in (("backend", backend), ("source", source)):
+            if value is None:
+                continue
+            if isinstance(value, str):
+                conditions.append(field(name) == value)
+            else:
+                conditions.append(field(name).isin(list(value)))
+        if filter is not None:
+            conditions.append(filter)
+
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        return self.dataset(table).to_table(columns=list(columns) if columns else None, filter=expression)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="转录结果列式归档维护")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="把每个分区中的小文件合并为一个")
+    compact.add_argument("archive_dir", help="归档目录")
+    compact.add_argument("--date", help="只合并该日期（YYYYMMDD）的分区")
+    compact.add_argument("--backend", help="只合并该后端的分区，如 aliyun、whisper")
+    args = parser.parse_args(argv)
+
+    merged = TranscriptArchive(args.archive_dir).compact(date=args.date, backend=args.backend)
+    print(f"合并完成：共合并 {merged} 个数据文件")
+
+
+if __name__ == "__main__":
+    main()
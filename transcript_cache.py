@@ -0,0 +1,119 @@
+"""
+转录结果缓存模块
+
+以音频内容哈希加上后端、模型、语言和识别参数作为键，将转录分段持久化到磁盘，
+按缓存目录总大小做 LRU 淘汰。Whisper（transcribe.py）和阿里云（aliyun/）两个后端共用。
+"""
+import os
+import json
+import hashlib
+from typing import Any, Dict, List, Optional
+
+# 默认缓存目录与容量，可通过环境变量覆盖
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "transcribe")
+DEFAULT_MAX_MB = 1024
+
+# 计算文件哈希时每次读取的字节数
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_audio(audio) -> str:
+    """计算解码后音频缓冲区（numpy 数组或 bytes）的 SHA-256"""
+    return hashlib.sha256(memoryview(audio).cast("B")).hexdigest()
+
+
+def hash_file(file_path: str) -> str:
+    """分块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(_HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    """基于内容寻址的转录结果磁盘缓存"""
+
+    def __init__(self, cache_dir: Optional[str] = None, max_mb: Optional[float] = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir (str): 缓存目录，默认读取 TRANSCRIBE_CACHE_DIR，否则为 ~/.cache/transcribe
+            max_mb (float): 缓存总大小上限（MB），默认读取 TRANSCRIBE_CACHE_MAX_MB，否则为 1024
+        """
+        self.cache_dir = cache_dir or os.getenv("TRANSCRIBE_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_mb is None:
+            max_mb = float(os.getenv("TRANSCRIBE_CACHE_MAX_MB", DEFAULT_MAX_MB))
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+    @staticmethod
+    def make_key(content_hash: str, backend: str, model: str, language: Optional[str] = None,
+                 options: Optional[Dict[str, Any]] = None) -> str:
+        """由音频哈希和识别参数生成缓存键"""
+        key_data = {
+            "content": content_hash,
+            "backend": backend,
+            "model": model,
+            "language": language,
+            "options": options or {},
+        }
+        encoded = json.dumps(key_data, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """读取缓存的分段列表，未命中时返回 None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                segments = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # 更新修改时间作为最近使用时间
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return segments
+
+    def put(self, key: str, segments: List[Dict[str, Any]]) -> None:
+        """写入分段列表，写入后按容量上限淘汰最久未使用的条目"""
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(segments, f, ensure_ascii=False, separators=(",", ":"), default=float)
+        # 原子替换，避免并发进程读到写了一半的文件
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        """按最近使用时间淘汰条目，直到总大小不超过上限"""
+        entries = []
+        total_size = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+
+        if total_size <= self.max_bytes:
+            return
+
+        for _, size, path in sorted(entries):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            if total_size <= self.max_bytes:
+                break